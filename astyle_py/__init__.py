@@ -1,6 +1,45 @@
 # SPDX-FileCopyrightText: 2022 Ivan Grokhotkov <ivan@igrr.me>
 # SPDX-License-Identifier: MIT
-from .astyle_wrapper import Astyle, AstyleError
+import importlib
+import typing
+
 from .version import __version__
 
-__all__ = ['Astyle', 'AstyleError', '__version__']
+if typing.TYPE_CHECKING:
+    from .astyle_wrapper import Astyle, CallStats, FormatResult
+    from .async_astyle import AsyncAstyle
+    from .errors import AstyleError, AstyleTimeout
+
+__all__ = [
+    'Astyle',
+    'AstyleError',
+    'AstyleTimeout',
+    'AsyncAstyle',
+    'CallStats',
+    'FormatResult',
+    '__version__',
+]
+
+# The submodules are only imported when first used: astyle_wrapper imports wasmtime,
+# and async_astyle imports asyncio, neither of which is cheap to import.
+_LAZY_ATTRS = {
+    'Astyle': 'astyle_wrapper',
+    'AstyleError': 'errors',
+    'AstyleTimeout': 'errors',
+    'CallStats': 'astyle_wrapper',
+    'FormatResult': 'astyle_wrapper',
+    'AsyncAstyle': 'async_astyle',
+}
+
+
+def __getattr__(name: str) -> typing.Any:
+    module = _LAZY_ATTRS.get(name)
+    if module is None:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+    value = getattr(importlib.import_module('.' + module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> typing.List[str]:
+    return sorted(set(globals()) | set(__all__))
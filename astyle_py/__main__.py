@@ -1,11 +1,19 @@
 # SPDX-FileCopyrightText: 2022 Ivan Grokhotkov <ivan@igrr.me>
 # SPDX-License-Identifier: MIT
+import os
 import sys
+import time
 
 from . import __version__
 from .args import parse_args
-from .astyle_wrapper import ASTYLE_COMPAT_VERSION, Astyle, AstyleError
-from .files_iter import iterate_files
+from .astyle_versions import (
+    ASTYLE_COMPAT_VERSION,
+    ASTYLE_SUPPORTED_VERSIONS,
+    check_astyle_version,
+)
+
+# The other modules are imported only once they are needed, so that invocations
+# which don't format anything (--version, no files given) return quickly.
 
 
 # Called via entry_points
@@ -13,6 +21,60 @@ def main():
     astyle_py_main(sys.argv[1:])
 
 
+def connect_to_server(socket_path, astyle_version, use_daemon):
+    from .errors import AstyleError
+    from .server import RemoteAstyle, connect
+
+    if not use_daemon:
+        return None
+    sock = connect(socket_path)
+    if sock is None:
+        return None
+    try:
+        return RemoteAstyle(sock, astyle_version)
+    except (ConnectionError, ValueError, AstyleError):
+        # e.g. the server can't load this version: format locally instead
+        sock.close()
+        return None
+
+
+def precompile_modules(astyle_version, quiet):
+    from .astyle_wrapper import precompile
+
+    versions = [astyle_version] if astyle_version else ASTYLE_SUPPORTED_VERSIONS
+    for version in versions:
+        # Both engines, see get_engine
+        for interruptible in (False, True):
+            try:
+                path = precompile(version, interruptible)
+            except OSError as e:
+                print(
+                    'Failed to precompile Astyle v{}: {}'.format(version, e),
+                    file=sys.stderr,
+                )
+                raise SystemExit(1)
+            if not quiet:
+                print(
+                    'Precompiled Astyle v{} to {}'.format(version, path),
+                    file=sys.stderr,
+                )
+
+
+def report_stats(run_stats, print_stats, json_file):
+    import json
+
+    report = run_stats.report()
+    if print_stats:
+        print(run_stats.format_report(report), file=sys.stderr)
+    if json_file is not None:
+        try:
+            with open(json_file, 'w') as f:
+                json.dump(report, f, indent=2)
+        except OSError as e:
+            print('Failed to write the stats: {}'.format(e), file=sys.stderr)
+            raise SystemExit(1)
+
+
 def astyle_py_main(argv_array):
     try:
         args = parse_args(argv_array)
@@ -24,60 +86,192 @@ def astyle_py_main(argv_array):
         astyle_version = args.astyle_version
     else:
         astyle_version = ASTYLE_COMPAT_VERSION
-
     try:
-        astyle = Astyle(version=astyle_version)
+        check_astyle_version(astyle_version)
     except ValueError as e:
         print(str(e), file=sys.stderr)
         raise SystemExit(1)
 
+    if args.precompile:
+        precompile_modules(args.astyle_version, args.quiet)
+        raise SystemExit(0)
+
+    if args.serve:
+        from .server import default_socket_path, serve
+
+        try:
+            serve(args.socket or default_socket_path())
+        except ValueError as e:
+            print(str(e), file=sys.stderr)
+            raise SystemExit(1)
+        raise SystemExit(0)
+
     if args.version:
-        print('astyle-py {} with Astyle v{}'.format(__version__, astyle.version()))
+        # The bundled module of each version reports the same version as its directory
+        print('astyle-py {} with Astyle v{}'.format(__version__, astyle_version))
         raise SystemExit(0)
 
     def diag(*args_):
         if not args.quiet:
             print(*args_, file=sys.stderr)
 
-    if len(args.files) == 0:
+    if len(args.files) == 0 and args.files_from is None and not args.changed_since:
         diag('No files specified')
         raise SystemExit(0)
 
+    from .cache import ResultCache, default_cache_dir
+    from .files_iter import iterate_files
+    from .runner import (
+        AstyleInstances,
+        default_jobs,
+        default_jobs_backend,
+        format_files,
+    )
+    from .server import default_socket_path
+    from .stats import RunStats
+    from .vcs import git_changed_files, git_changed_lines
+
+    jobs = args.jobs or default_jobs()
+
+    socket_path = args.socket or default_socket_path()
+    remote = connect_to_server(socket_path, astyle_version, args.use_daemon)
+
+    def make_astyle(version):
+        # Instances for the versions set in the rules file are only created if used
+        astyle = remote if version == astyle_version else None
+        if astyle is None and remote is not None:
+            astyle = connect_to_server(socket_path, version, args.use_daemon)
+        if astyle is None:
+            # Only imports wasmtime if the server isn't used
+            from .astyle_wrapper import Astyle
+
+            return Astyle(version=version, timeout=args.timeout_per_file)
+        astyle.timeout = args.timeout_per_file
+        return astyle
+
+    collect_stats = args.stats or args.stats_json is not None
+    instances = AstyleInstances(
+        astyle_version, args.timeout_per_file, make_astyle, collect_stats
+    )
+    # The server handles the requests one by one, over one connection: the workloads
+    # large enough to be formatted in parallel are formatted by local instances.
+    thread_instances = None
+    if remote is not None:
+        thread_instances = AstyleInstances(
+            astyle_version, args.timeout_per_file, stats=collect_stats
+        )
+
+    changed_files = None
+    changed_lines = None
+    try:
+        if args.changed_since:
+            changed_files = git_changed_files(args.changed_since)
+        if args.lines_changed_only:
+            changed_lines = {
+                os.path.abspath(fname): lines
+                for fname, lines in git_changed_lines(
+                    args.changed_since or 'HEAD'
+                ).items()
+            }
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        raise SystemExit(1)
+
+    cache = None
+    if args.use_cache:
+        cache = ResultCache(args.cache_dir or default_cache_dir())
+
+    run_stats = RunStats() if collect_stats else None
+    file_items = iterate_files(args, changed_files)
+    if run_stats is not None:
+        file_items = run_stats.timed_iter(file_items, 'files')
+
     files_checked = 0
     files_with_errors = 0
     files_formatted = 0
-    for file_item in iterate_files(args):
-        files_checked += 1
-        fname = file_item.filename
-        astyle.set_options(' '.join(file_item.astyle_options))
-        with open(fname) as f:
-            original = f.read()
-        try:
-            formatted = astyle.format(original)
-        except AstyleError as e:
-            print('Error formatting {}: {}'.format(fname, e), file=sys.stderr)
-            raise SystemExit(1)
-        if formatted != original:
-            if args.fix_formatting:
-                diag('Formatting {}'.format(fname))
-                with open(fname, 'w') as f:
-                    f.write(formatted)
-                files_formatted += 1
-            else:
-                diag('Formatting error in {}'.format(fname))
-                files_with_errors += 1
+    files_timed_out = 0
+    cache_hits = 0
+    try:
+        for result in format_files(
+            instances,
+            file_items,
+            args.fix_formatting,
+            jobs,
+            cache,
+            changed_lines,
+            args.jobs_backend or default_jobs_backend(),
+            collect_stats,
+            thread_instances,
+        ):
+            files_checked += 1
+            fname = result.filename
+            if run_stats is not None:
+                run_stats.add_file(fname, result.stats, result.cache_hit)
+            if result.timed_out:
+                print(
+                    'Timeout formatting {}: took longer than {}s'.format(
+                        fname, args.timeout_per_file
+                    ),
+                    file=sys.stderr,
+                )
+                files_timed_out += 1
+                continue
+            if result.error is not None:
+                print(
+                    'Error formatting {}: {}'.format(fname, result.error),
+                    file=sys.stderr,
+                )
+                raise SystemExit(1)
+            if result.cache_hit:
+                cache_hits += 1
+            if result.changed:
+                if args.fix_formatting:
+                    diag('Formatting {}'.format(fname))
+                    start = time.perf_counter()
+                    with open(fname, 'wb') as f:
+                        f.write(result.formatted)
+                    if run_stats is not None:
+                        run_stats.add_time('write', time.perf_counter() - start)
+                    files_formatted += 1
+                else:
+                    diag('Formatting error in {}'.format(fname))
+                    files_with_errors += 1
+            if cache is not None and result.formatted_key is not None:
+                cache.record(result.formatted_key)
+    finally:
+        if cache is not None:
+            cache.close()
+
+    if cache is not None and files_checked:
+        diag('Cache: {} hits, {} misses'.format(cache_hits, files_checked - cache_hits))
+
+    if run_stats is not None:
+        report_stats(run_stats, args.stats, args.stats_json)
 
     if files_checked == 0:
-        assert args.exclude_list or args.rules  # otherwise we would have exited earlier
-        diag(
-            'No files checked, excluded by {}'.format(
-                '--exclude/--exclude-list option'
-                if args.exclude_list
-                else 'the rules file ({})'.format(args.rules)
+        if args.exclude_list or args.rules:
+            diag(
+                'No files checked, excluded by {}'.format(
+                    '--exclude/--exclude-list option'
+                    if args.exclude_list
+                    else 'the rules file ({})'.format(args.rules)
+                )
             )
-        )
+        elif changed_files is not None:
+            diag(
+                'No files checked, no files changed since {}'.format(args.changed_since)
+            )
+        else:
+            diag('No files checked, no matching files found')
         raise SystemExit(0)
 
+    if files_timed_out:
+        print(
+            '{} files took longer than {}s to format, not checked'.format(
+                files_timed_out, args.timeout_per_file
+            ),
+            file=sys.stderr,
+        )
     if args.fix_formatting:
         if files_formatted:
             diag('Formatted {} files'.format(files_formatted))
@@ -85,7 +279,7 @@ def astyle_py_main(argv_array):
         if files_with_errors:
             diag('Formatting errors found in {} files'.format(files_with_errors))
             raise SystemExit(1)
-    raise SystemExit(0)
+    raise SystemExit(1 if files_timed_out else 0)
 
 
 if __name__ == '__main__':
@@ -15,6 +15,22 @@ AstyleArgs = namedtuple(
         'quiet',
         'version',
         'astyle_version',
+        'jobs',
+        'use_cache',
+        'cache_dir',
+        'extensions',
+        'files_from',
+        'null_delimited',
+        'serve',
+        'socket',
+        'use_daemon',
+        'changed_since',
+        'lines_changed_only',
+        'timeout_per_file',
+        'precompile',
+        'jobs_backend',
+        'stats',
+        'stats_json',
     ],
 )
 
@@ -22,7 +38,7 @@ AstyleArgs = namedtuple(
 def parse_args(args) -> AstyleArgs:
     i = 0
     for i, arg in enumerate(args):
-        if not arg.startswith('--'):
+        if not arg.startswith('--') and arg != '-0':
             break
     else:
         i = len(args)
@@ -36,6 +52,22 @@ def parse_args(args) -> AstyleArgs:
     options_to_remove = []
     version = False
     astyle_version = None
+    jobs = None
+    use_cache = True
+    cache_dir = None
+    extensions = None
+    files_from = None
+    null_delimited = False
+    serve = False
+    socket = None
+    use_daemon = True
+    changed_since = None
+    lines_changed_only = False
+    timeout_per_file = None
+    precompile = False
+    jobs_backend = None
+    stats = False
+    stats_json = None
 
     for o in options:
         o_trimmed = o[2:] if o.startswith('--') else o
@@ -84,9 +116,111 @@ def parse_args(args) -> AstyleArgs:
             ensure_value()
             astyle_version = value
 
+        elif opt == 'jobs':
+            options_to_remove.append(o)
+            ensure_value()
+            try:
+                jobs = int(value)  # type: ignore
+            except ValueError:
+                jobs = 0
+            if jobs < 1:
+                raise ValueError(
+                    'Option --jobs requires a positive number, found {}'.format(value)
+                )
+
+        elif opt == 'jobs-backend':
+            options_to_remove.append(o)
+            ensure_value()
+            if value not in ('process', 'thread'):
+                raise ValueError(
+                    'Option --jobs-backend requires \'process\' or \'thread\', found {}'.format(
+                        value
+                    )
+                )
+            jobs_backend = value
+
+        elif opt == 'cache-dir':
+            options_to_remove.append(o)
+            ensure_value()
+            cache_dir = value
+
+        elif opt == 'no-cache':
+            options_to_remove.append(o)
+            use_cache = False
+
+        elif opt == 'extensions':
+            options_to_remove.append(o)
+            ensure_value()
+            extensions = [
+                ext.strip().lstrip('.')
+                for ext in value.split(',')  # type: ignore
+                if ext.strip()
+            ]
+
+        elif opt == 'files-from':
+            options_to_remove.append(o)
+            ensure_value()
+            files_from = value
+
+        elif opt in ('-0', 'null'):
+            options_to_remove.append(o)
+            null_delimited = True
+
+        elif opt == 'serve':
+            options_to_remove.append(o)
+            serve = True
+
+        elif opt == 'socket':
+            options_to_remove.append(o)
+            ensure_value()
+            socket = value
+
+        elif opt == 'no-daemon':
+            options_to_remove.append(o)
+            use_daemon = False
+
+        elif opt == 'changed-since':
+            options_to_remove.append(o)
+            ensure_value()
+            changed_since = value
+
+        elif opt == 'lines-changed-only':
+            options_to_remove.append(o)
+            lines_changed_only = True
+
+        elif opt == 'timeout-per-file':
+            options_to_remove.append(o)
+            ensure_value()
+            try:
+                timeout_per_file = float(value)  # type: ignore
+            except ValueError:
+                timeout_per_file = 0
+            if not timeout_per_file > 0:
+                raise ValueError(
+                    'Option --timeout-per-file requires a positive number of seconds, found {}'.format(
+                        value
+                    )
+                )
+
+        elif opt == 'precompile':
+            options_to_remove.append(o)
+            precompile = True
+
+        elif opt == 'stats':
+            options_to_remove.append(o)
+            stats = True
+
+        elif opt == 'stats-json':
+            options_to_remove.append(o)
+            ensure_value()
+            stats_json = value
+
     for o in options_to_remove:
         options.remove(o)
 
+    if null_delimited and files_from is None:
+        raise ValueError('Option -0 (--null) can only be used with --files-from')
+
     has_rules = rules is not None
     has_options_or_exclude_list = options or exclude_list
     if has_rules and has_options_or_exclude_list:
@@ -103,4 +237,20 @@ def parse_args(args) -> AstyleArgs:
         quiet=quiet,
         version=version,
         astyle_version=astyle_version,
+        jobs=jobs,
+        use_cache=use_cache,
+        cache_dir=cache_dir,
+        extensions=extensions,
+        files_from=files_from,
+        null_delimited=null_delimited,
+        serve=serve,
+        socket=socket,
+        use_daemon=use_daemon,
+        changed_since=changed_since,
+        lines_changed_only=lines_changed_only,
+        timeout_per_file=timeout_per_file,
+        precompile=precompile,
+        jobs_backend=jobs_backend,
+        stats=stats,
+        stats_json=stats_json,
     )
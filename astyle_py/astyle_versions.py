@@ -0,0 +1,26 @@
+# SPDX-FileCopyrightText: 2026 Ivan Grokhotkov <ivan@igrr.me>
+# SPDX-License-Identifier: MIT
+"""
+The bundled Astyle versions. Kept apart from astyle_wrapper, so that they can be
+looked up without importing wasmtime.
+"""
+import os
+
+ASTYLE_COMPAT_VERSION = '3.1'
+ASTYLE_SUPPORTED_VERSIONS = os.listdir(os.path.join(os.path.dirname(__file__), 'lib'))
+
+
+def get_wasm_file(version: str) -> str:
+    return os.path.join(os.path.dirname(__file__), 'lib', version, 'libastyle.wasm')
+
+
+def check_astyle_version(version: str) -> None:
+    """
+    Raise ValueError if the given astyle version isn't bundled.
+    """
+    if version not in ASTYLE_SUPPORTED_VERSIONS:
+        raise ValueError(
+            'Unsupported astyle version: {}. Available versions: {}'.format(
+                version, ', '.join(ASTYLE_SUPPORTED_VERSIONS)
+            )
+        )
@@ -1,22 +1,40 @@
 # SPDX-FileCopyrightText: 2022 Ivan Grokhotkov <ivan@igrr.me>
 # SPDX-License-Identifier: MIT
+import collections
+import functools
+import math
 import os
 import platform
+import re
+import struct
+import threading
+import time
 import typing
+import weakref
+from collections import namedtuple
 
 from wasmtime import (
     Config,
     Engine,
+    ExitTrap,
     Func,
     FuncType,
     Instance,
     Linker,
+    Memory,
     Module,
     Store,
+    Trap,
+    TrapCode,
     ValType,
     WasiConfig,
+    WasmtimeError,
 )
 
+from .astyle_versions import ASTYLE_SUPPORTED_VERSIONS  # noqa: F401 (public name)
+from .astyle_versions import ASTYLE_COMPAT_VERSION, check_astyle_version, get_wasm_file
+from .errors import AstyleError, AstyleTimeout
+
 # Workaround for https://github.com/bytecodealliance/wasmtime/issues/10099
 MACOS_MACH_PORTS_WORKAROUND = False
 
@@ -29,23 +47,250 @@ if platform.system() == 'Darwin':
         pass
 
 
+# Engines and compiled modules, by whether the calls can be interrupted
+_engines = {}  # type: typing.Dict[bool, Engine]
+_modules = {}  # type: typing.Dict[typing.Tuple[str, bool], Module]
+_registry_lock = threading.Lock()
+
+# Period of the epoch ticks used for the time limits, in seconds
+EPOCH_TICK = 0.01
+# Epoch deadline of the stores without a time limit, in ticks from now
+NO_EPOCH_DEADLINE = 1 << 48
+_epoch_ticker = None  # type: typing.Optional[threading.Thread]
+
+# Upper limit on the size of the linear memory of each instance, in bytes
+WASM_MEMORY_LIMIT = 64 * 1024 * 1024
+
+
+def get_engine(interruptible: bool = False) -> Engine:
+    """
+    Return the wasmtime Engine shared by all WasmContext instances in this process.
+    The calls into the modules compiled by the interruptible engine can be interrupted
+    once their epoch deadline passes (see Astyle.timeout). This makes the WASM code
+    about 1.5x slower, so it is only used by the instances with a time limit.
+    """
+    with _registry_lock:
+        engine = _engines.get(interruptible)
+        if engine is None:
+            wasm_cfg = Config()
+            wasm_cfg.cache = True
+            wasm_cfg.epoch_interruption = interruptible
+            if MACOS_MACH_PORTS_WORKAROUND:
+                wasmtime_config_macos_use_mach_ports_set(wasm_cfg.ptr(), False)
+            engine = Engine(wasm_cfg)
+            _engines[interruptible] = engine
+        return engine
+
+
+def start_epoch_ticker() -> None:
+    """
+    Start the thread which increments the epoch of the interruptible engine every
+    EPOCH_TICK seconds, if it isn't running yet.
+    """
+    global _epoch_ticker
+    engine = get_engine(interruptible=True)
+    with _registry_lock:
+        if _epoch_ticker is not None:
+            return
+
+        def tick():
+            while True:
+                time.sleep(EPOCH_TICK)
+                engine.increment_epoch()
+
+        _epoch_ticker = threading.Thread(
+            target=tick, name='astyle_py epoch ticker', daemon=True
+        )
+        _epoch_ticker.start()
+
+
+# Environment variable with the directory of the precompiled modules, if not the default
+PRECOMPILED_DIR_ENV = 'ASTYLE_PY_PRECOMPILED_DIR'
+
+
+def get_precompiled_file(version: str, interruptible: bool = False) -> str:
+    """
+    Return the path of the precompiled module for the given astyle version and engine.
+    By default, it is kept in the 'precompiled' directory next to the .wasm file,
+    or in the '<version>' subdirectory of $ASTYLE_PY_PRECOMPILED_DIR if it is set.
+    """
+    base = os.environ.get(PRECOMPILED_DIR_ENV)
+    if base:
+        directory = os.path.join(base, version)
+    else:
+        directory = os.path.join(os.path.dirname(get_wasm_file(version)), 'precompiled')
+    name = 'libastyle-{}{}.cwasm'.format(
+        platform.machine().lower() or 'unknown',
+        '-interruptible' if interruptible else '',
+    )
+    return os.path.join(directory, name)
+
+
+def precompile(version: str, interruptible: bool = False) -> str:
+    """
+    Compile the module for the given astyle version and engine, and save it
+    to get_precompiled_file(), for get_module to load without compiling it.
+    Returns the path of the file written. Raises OSError if it can't be written.
+    The loaded modules map the file into memory, so it is replaced, never overwritten.
+    """
+    module = Module.from_file(get_engine(interruptible), get_wasm_file(version))
+    path = get_precompiled_file(version, interruptible)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Other processes may be loading the file meanwhile, never let them see it half-written
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(module.serialize())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+    return path
+
+
+def _load_module(engine: Engine, version: str, interruptible: bool) -> Module:
+    wasm_file = get_wasm_file(version)
+    precompiled = get_precompiled_file(version, interruptible)
+    try:
+        if os.stat(precompiled).st_mtime >= os.stat(wasm_file).st_mtime:
+            return Module.deserialize_file(engine, precompiled)
+    except (OSError, WasmtimeError):
+        # Not precompiled, or compiled by a different version of wasmtime,
+        # or for a CPU with different features: compile it instead.
+        pass
+    return Module.from_file(engine, wasm_file)
+
+
+def get_module(version: str, interruptible: bool = False) -> Module:
+    """
+    Return the compiled module for the given astyle version. Each module is only
+    loaded and compiled once per process (and engine), the result is shared by
+    all instances. The module precompiled by precompile() is used if available.
+    """
+    engine = get_engine(interruptible)
+    with _registry_lock:
+        module = _modules.get((version, interruptible))
+        if module is None:
+            module = _load_module(engine, version, interruptible)
+            _modules[(version, interruptible)] = module
+        return module
+
+
+class _BoundFunc:
+    """
+    Exported function bound to the store, looked up once when the module is
+    instantiated rather than on each call. Only the public API of wasmtime is used:
+    calling its internals directly would halve the cost of the calls of small
+    functions like malloc and free, but break with any release of wasmtime.
+    """
+
+    def __init__(self, store: Store, func: Func):
+        self._call = functools.partial(func.__call__, store)
+        self.calls = 0
+
+    def __call__(self, *args):
+        self.calls += 1
+        return self._call(*args)
+
+
+# Contents of the linear memory up to the end of the heap, and the stack pointer
+MemorySnapshot = namedtuple('MemorySnapshot', ['data', 'stack_ptr'])
+
+# Size of the block allocated to find the end of the heap when taking a snapshot
+SNAPSHOT_PROBE_SIZE = 64 * 1024
+
+
 class WasmContext:
-    def __init__(self):
-        wasm_cfg = Config()
-        wasm_cfg.cache = True
-        if MACOS_MACH_PORTS_WORKAROUND:
-            wasmtime_config_macos_use_mach_ports_set(wasm_cfg.ptr(), False)
-        self.linker = Linker(Engine(wasm_cfg))
+    def __init__(self, interruptible: bool = False):
+        self.interruptible = interruptible
+        self.linker = Linker(get_engine(interruptible))
         self.linker.define_wasi()
         self.store = Store(self.linker.engine)
         self.store.set_wasi(WasiConfig())
+        # The bundled modules have a fixed-size memory, this only matters for the modules
+        # which can grow it: memory.grow fails past the limit, so malloc returns 0.
+        self.store.set_limits(memory_size=WASM_MEMORY_LIMIT)
+        if interruptible:
+            # The default deadline would interrupt any call
+            self.store.set_epoch_deadline(NO_EPOCH_DEADLINE)
+        # Set when the instance is replaced after an interrupted call
+        self.discarded = False
+        # Incremented when the memory is restored from a snapshot, which invalidates
+        # the memory allocated before
+        self.generation = 0
         self.inst = None  # type: typing.Optional[Instance]
+        self._funcs = {}  # type: typing.Dict[str, _BoundFunc]
+        self._memories = {}  # type: typing.Dict[str, Memory]
+        self._views = {}  # type: typing.Dict[str, typing.Tuple[int, memoryview]]
+
+    def instantiate(self, module: Module) -> None:
+        """
+        Instantiate the module, and resolve its exports once.
+        """
+        self.inst = self.linker.instantiate(self.store, module)
+        for name, export in self.inst.exports(self.store).items():
+            if isinstance(export, Func):
+                self._funcs[name] = _BoundFunc(self.store, export)
+            elif isinstance(export, Memory):
+                self._memories[name] = export
+
+    @property
+    def guest_calls(self) -> int:
+        """
+        Number of calls into the WASM module so far, for measuring the overhead.
+        """
+        return sum(func.calls for func in self._funcs.values())
+
+    def has_func(self, name: str) -> bool:
+        return name in self._funcs
 
     def call_func(self, name: str, *args):
-        return self.inst.exports(self.store)[name](self.store, *args)  # type: ignore
+        return self._funcs[name](*args)
 
     def get_data_ptr(self, name: str):
-        return self.inst.exports(self.store)[name].data_ptr(self.store)  # type: ignore
+        return self._memories[name].data_ptr(self.store)
+
+    def take_snapshot(self) -> MemorySnapshot:
+        """
+        Save the state of the heap and the stack pointer, to restore them later
+        with restore_snapshot. Only the part of the memory in use is saved: the end
+        of the heap is found by allocating a block larger than any free one.
+        """
+        probe = int(self.call_func('malloc', SNAPSHOT_PROBE_SIZE))
+        if not probe:
+            raise MemoryError('Failed to allocate {} bytes'.format(SNAPSHOT_PROBE_SIZE))
+        self.call_func('free', probe)
+        stack_ptr = self.call_func('stackSave') if self.has_func('stackSave') else None
+        return MemorySnapshot(bytes(self.get_memory_view()[:probe]), stack_ptr)
+
+    def restore_snapshot(self, snapshot: MemorySnapshot) -> None:
+        """
+        Restore the heap and the stack pointer saved by take_snapshot. Must not be called
+        while a guest call is in progress. All the memory allocated since the snapshot
+        was taken becomes invalid, and mustn't be freed.
+        """
+        self.get_memory_view()[: len(snapshot.data)] = snapshot.data
+        if snapshot.stack_ptr is not None:
+            self.call_func('stackRestore', snapshot.stack_ptr)
+        self.generation += 1
+
+    def get_memory_view(self, name: str = 'memory') -> memoryview:
+        """
+        Return a writable memoryview over the whole linear memory, without copying it.
+        The view is only re-created when the memory grows, since the memory may be
+        moved then. It shouldn't be kept across guest calls, nor released.
+        """
+        memory = self._memories[name]
+        size = memory.data_len(self.store)
+        cached = self._views.get(name)
+        if cached is not None and cached[0] == size:
+            return cached[1]
+        view = memoryview(memory.get_buffer_ptr(self.store, size)).cast('B')
+        self._views[name] = (size, view)
+        return view
+
+
+_NUL_RE = re.compile(b'\x00')
 
 
 class WasmString:
@@ -54,98 +299,723 @@ class WasmString:
         self._addr = addr
         self._len = len
         self._str = as_str
+        self._generation = context.generation
 
     def __del__(self):
-        self._context.call_func('free', self._addr)
+        if self._context.discarded or self._generation != self._context.generation:
+            return
+        try:
+            self._context.call_func('free', self._addr)
+        except ValueError:
+            # The store is already closed, and the linear memory is gone with it.
+            # Happens when the garbage collector finalizes the store first.
+            pass
 
     @property
     def addr(self):
         return self._addr
 
+    @property
+    def n_bytes(self):
+        return self._len
+
     def __str__(self):
         return self._str
 
     @staticmethod
     def from_str(context: WasmContext, string: str) -> 'WasmString':
-        strb = string.encode('utf-8') + b'\x00'
+        strb = string.encode('utf-8')
         n_bytes = len(strb)
         addr = int(context.call_func('malloc', n_bytes + 1))
-        data = context.get_data_ptr('memory')
-        for i in range(n_bytes):
-            data[addr + i] = strb[i]
-        data[addr + n_bytes] = 0
+        if not addr:
+            raise MemoryError('Failed to allocate {} bytes'.format(n_bytes + 1))
+        end = addr + n_bytes
+        data = context.get_memory_view()
+        data[addr:end] = strb
+        data[end] = 0
         return WasmString(context, addr, n_bytes, string)
 
     @staticmethod
     def from_addr(context: WasmContext, addr: int) -> 'WasmString':
-        n_bytes = 0
-        strb = bytearray()
-        data = context.get_data_ptr('memory')
-        while True:
-            c = data[addr + n_bytes]
-            if c == 0:
-                break
-            strb.append(c)
-            n_bytes += 1
-        string = strb.decode('utf-8')  # type: ignore
+        string, n_bytes = WasmString._read(context, addr)
         return WasmString(context, addr, n_bytes, string)
 
+    @staticmethod
+    def read(context: WasmContext, addr: int) -> str:
+        """
+        Read the string at the given address without taking ownership of it,
+        for strings which must not be freed.
+        """
+        return WasmString._read(context, addr)[0]
+
+    @staticmethod
+    def read_bytes(context: WasmContext, addr: int) -> bytes:
+        """
+        Read the NUL-terminated string at the given address as bytes, without decoding it
+        and without taking ownership of it.
+        """
+        data = context.get_memory_view()
+        end = WasmString._find_end(data, addr)
+        return bytes(data[addr:end])
 
-ASTYLE_COMPAT_VERSION = '3.1'
-ASTYLE_SUPPORTED_VERSIONS = os.listdir(os.path.join(os.path.dirname(__file__), 'lib'))
+    @staticmethod
+    def _read(context: WasmContext, addr: int) -> typing.Tuple[str, int]:
+        data = context.get_memory_view()
+        end = WasmString._find_end(data, addr)
+        return str(data[addr:end], 'utf-8'), end - addr
 
+    @staticmethod
+    def _find_end(data: memoryview, addr: int) -> int:
+        nul = _NUL_RE.search(data, addr)  # type: ignore
+        if nul is None:
+            raise ValueError('String at 0x{:x} is not NUL-terminated'.format(addr))
+        return nul.start()
 
-class AstyleError(RuntimeError):
-    pass
 
+def _common_prefix_len(a: bytes, b: bytes) -> int:
+    # Bisect on the prefix length, comparing the prefixes is much faster
+    # than comparing the strings byte by byte in Python.
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
 
-class Astyle:
-    def __init__(self, version: str = ASTYLE_COMPAT_VERSION):
-        if version not in ASTYLE_SUPPORTED_VERSIONS:
-            raise ValueError(
-                'Unsupported astyle version: {}. Available versions: {}'.format(
-                    version, ', '.join(ASTYLE_SUPPORTED_VERSIONS)
-                )
-            )
 
-        self.context = WasmContext()
+# Maximum number of distinct option strings kept in the linear memory of an Astyle instance
+OPTIONS_CACHE_SIZE = 16
+
+# Initial size of the buffer in the linear memory which the sources are copied to
+SOURCE_BUFFER_MIN_SIZE = 64 * 1024
+
+
+# Option string copied into the linear memory, and the error found while validating it
+_InternedOptions = namedtuple('_InternedOptions', ['ptr', 'error'])
+
+# Result of formatting one source with format_many or check_many.
+# 'formatted' is None for check_many, and 'error' is the error message if the source
+# couldn't be formatted.
+FormatResult = namedtuple('FormatResult', ['formatted', 'changed', 'error'])
+
+# Measurements of one format, format_bytes, check or format_batch call, passed to
+# Astyle.stats_hook. 'op' is the name of the method; 'bytes_in' and 'bytes_out' count
+# the bytes copied to and from the linear memory. 'guest_time' is the part of
+# 'total_time' (in seconds) spent in the calls of astyle itself, most of the rest goes
+# to marshalling the data. 'guest_calls' counts all the calls into the WASM module,
+# including malloc and free.
+CallStats = namedtuple(
+    'CallStats',
+    ['op', 'bytes_in', 'bytes_out', 'total_time', 'guest_time', 'guest_calls'],
+)
+
+
+def _format_result(
+    source: typing.AnyStr,
+    formatted: typing.Optional[typing.AnyStr],
+    error: typing.Optional[str],
+) -> FormatResult:
+    return FormatResult(formatted, formatted is not None and formatted != source, error)
+
+
+# Lengths in the buffers passed to and returned from AStyleBatch
+_BATCH_U32 = struct.Struct('<I')
+_BATCH_ERROR = 0xFFFFFFFF
+
+
+def _pack_batch(sources: typing.Sequence[bytes]) -> bytes:
+    """
+    Pack the sources for AStyleBatch: their number, then each source as its length
+    followed by the NUL-terminated source.
+    """
+    parts = [_BATCH_U32.pack(len(sources))]
+    for source in sources:
+        parts += [_BATCH_U32.pack(len(source)), source, b'\x00']
+    return b''.join(parts)
+
+
+def _unpack_batch(data: memoryview, addr: int) -> typing.List[typing.Optional[bytes]]:
+    """
+    Unpack the result of AStyleBatch at the given address, None for the sources
+    which failed to format.
+    """
+    (count,) = _BATCH_U32.unpack_from(data, addr)
+    pos = addr + _BATCH_U32.size
+    results = []  # type: typing.List[typing.Optional[bytes]]
+    for _ in range(count):
+        (length,) = _BATCH_U32.unpack_from(data, pos)
+        pos += _BATCH_U32.size
+        if length == _BATCH_ERROR:
+            results.append(None)
+            continue
+        end = pos + length
+        results.append(bytes(data[pos:end]))
+        pos = end + 1
+    return results
+
+
+class _AstyleInstance:
+    """
+    Astyle module instance with its own store, used by one thread at a time.
+    See Astyle for the description of the methods.
+    """
+
+    def __init__(
+        self,
+        version: str,
+        timeout: typing.Optional[float],
+        memory_limit: typing.Optional[int],
+    ):
+        self._version = version
+        self._timeout = timeout
+        self.memory_limit = memory_limit
+        # Number of times the heap was restored from the snapshot
+        self.recycled = 0
+        # Called with the CallStats of each call if set, see Astyle.stats_hook
+        self.stats_hook = (
+            None
+        )  # type: typing.Optional[typing.Callable[[CallStats], None]]
+        # Totals for the CallStats. The time spent in the guest calls is only
+        # measured while stats_hook is set.
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.guest_time = 0.0
+        # Calls into the instances replaced so far
+        self._retired_guest_calls = 0
+        self._instantiate()
+
+    @property
+    def timeout(self) -> typing.Optional[float]:
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, timeout: typing.Optional[float]) -> None:
+        self._timeout = timeout
+        if timeout is not None and not self.context.interruptible:
+            self._reinstantiate()
+
+    @property
+    def guest_calls(self) -> int:
+        return self._retired_guest_calls + self.context.guest_calls
+
+    def _instantiate(self) -> None:
+        self.context = WasmContext(interruptible=self._timeout is not None)
         err_handler_type = FuncType([ValType.i32(), ValType.i32()], [])
-        err_handler_func = Func(self.context.store, err_handler_type, self._err_handler)
+        # wasmtime keeps the callback alive as long as the store, don't let it
+        # keep a reference to this object too.
+        err_handler = weakref.WeakMethod(self._err_handler)
+        err_handler_func = Func(
+            self.context.store,
+            err_handler_type,
+            lambda errno, errptr: err_handler()(errno, errptr),  # type: ignore
+        )
         self.context.linker.define(
             self.context.store, 'env', 'AStyleErrorHandler', err_handler_func
         )
 
-        wasm_file = os.path.join(
-            os.path.dirname(__file__), 'lib', version, 'libastyle.wasm'
-        )
-        module = Module.from_file(self.context.store.engine, wasm_file)
-        self.context.inst = self.context.linker.instantiate(self.context.store, module)
+        module = get_module(self._version, self.context.interruptible)
+        self.context.instantiate(module)
         self.context.call_func('_initialize')
-
-        self._opts_ptr = WasmString.from_str(self.context, '')
+        self._snapshot = self.context.take_snapshot()
+        # Modules built before AStyleCheck was added don't export it
+        self._has_check = self.context.has_func('AStyleCheck')
+        self._has_batch = self.context.has_func('AStyleBatch')
 
         self._delayed_err = None  # type: typing.Optional[str]
+        self._reset_heap_state()
+
+    def _reset_heap_state(self) -> None:
+        self._src_buf = 0
+        self._src_buf_size = 0
+        # Highest end address of the buffers seen in the linear memory
+        self._heap_top = len(self._snapshot.data)
+
+        self._options = (
+            collections.OrderedDict()
+        )  # type: typing.OrderedDict[str, _InternedOptions]
+        self._opts = self._intern_options('')
 
     def version(self) -> str:
-        res_addr = self.context.call_func('AStyleGetVersion')
-        self._handle_delayed_err()
-        return str(WasmString.from_addr(self.context, res_addr))
+        res_addr = self._call('AStyleGetVersion')
+        return WasmString.read(self.context, res_addr)
 
     def set_options(self, options: str) -> None:
-        self._opts_ptr = WasmString.from_str(self.context, options)
+        opts = self._options.get(options)
+        if opts is None:
+            opts = self._intern_options(options)
+        else:
+            self._options.move_to_end(options)
+        self._opts = opts
+
+    def release_options(self, options: typing.Optional[str] = None) -> None:
+        if options is None:
+            self._options.clear()
+        else:
+            self._options.pop(options, None)
 
     def format(self, source: str) -> str:
-        src_ptr = WasmString.from_str(self.context, source)
-        res_addr = self.context.call_func(
-            'AStyleWrapper', src_ptr.addr, self._opts_ptr.addr
+        if self.stats_hook is not None:
+            return self._measured('format', self._format, source)
+        return self._format(source)
+
+    def format_bytes(self, source: bytes) -> bytes:
+        if self.stats_hook is not None:
+            return self._measured('format_bytes', self._format_bytes, source)
+        return self._format_bytes(source)
+
+    def check(self, source: typing.Union[str, bytes]) -> int:
+        if self.stats_hook is not None:
+            return self._measured('check', self._check, source)
+        return self._check(source)
+
+    def format_batch(
+        self, sources: typing.Sequence[bytes]
+    ) -> typing.List[FormatResult]:
+        if self.stats_hook is not None:
+            return self._measured('format_batch', self._format_batch, sources)
+        return self._format_batch(sources)
+
+    def _measured(self, op: str, func: typing.Callable, arg):
+        hook = self.stats_hook
+        assert hook is not None
+        bytes_in = self.bytes_in
+        bytes_out = self.bytes_out
+        guest_time = self.guest_time
+        guest_calls = self.guest_calls
+        start = time.perf_counter()
+        try:
+            return func(arg)
+        finally:
+            # Also reported for the calls which fail, e.g. the ones timing out
+            hook(
+                CallStats(
+                    op,
+                    self.bytes_in - bytes_in,
+                    self.bytes_out - bytes_out,
+                    time.perf_counter() - start,
+                    self.guest_time - guest_time,
+                    self.guest_calls - guest_calls,
+                )
+            )
+
+    def _format(self, source: str) -> str:
+        if self._opts.error:
+            raise AstyleError(self._opts.error)
+        src_addr = self._write_source(source)
+        res_addr = self._call('AStyleWrapper', src_addr, self._opts.ptr.addr)
+        result = WasmString.from_addr(self.context, res_addr)
+        self._note_buffer(res_addr, result.n_bytes)
+        self.bytes_out += result.n_bytes
+        formatted = str(result)
+        del result
+        self._limit_memory()
+        return formatted
+
+    def _format_bytes(self, source: bytes) -> bytes:
+        if self._opts.error:
+            raise AstyleError(self._opts.error)
+        src_addr = self._write_source(source)
+        res_addr = self._call('AStyleWrapper', src_addr, self._opts.ptr.addr)
+        try:
+            formatted = WasmString.read_bytes(self.context, res_addr)
+        finally:
+            self.context.call_func('free', res_addr)
+        self._note_buffer(res_addr, len(formatted))
+        self.bytes_out += len(formatted)
+        self._limit_memory()
+        return formatted
+
+    def _check(self, source: typing.Union[str, bytes]) -> int:
+        if self._opts.error:
+            raise AstyleError(self._opts.error)
+        strb = source.encode('utf-8') if isinstance(source, str) else source
+        src_addr = self._write_source(strb)
+        if self._has_check:
+            line = self._call('AStyleCheck', src_addr, self._opts.ptr.addr)
+            if line < 0:
+                raise AstyleError('error: formatting failed')
+            if self.memory_limit is not None:
+                # The formatted source isn't returned, find out where it could have been
+                self._probe_heap(len(strb) + 1)
+                self._limit_memory()
+            return line
+        res_addr = self._call('AStyleWrapper', src_addr, self._opts.ptr.addr)
+        try:
+            # Copying into bytes is cheaper than comparing the memoryview directly
+            formatted = WasmString.read_bytes(self.context, res_addr)
+        finally:
+            self.context.call_func('free', res_addr)
+        self._note_buffer(res_addr, len(formatted))
+        self.bytes_out += len(formatted)
+        self._limit_memory()
+        if formatted == strb:
+            return 0
+        return strb.count(b'\n', 0, _common_prefix_len(strb, formatted)) + 1
+
+    def _format_batch(
+        self, sources: typing.Sequence[bytes]
+    ) -> typing.List[FormatResult]:
+        if self._opts.error:
+            raise AstyleError(self._opts.error)
+        if not self._has_batch:
+            return list(self._call_iter(self._format_bytes, sources, None))
+        batch_addr = self._write_source(_pack_batch(sources))
+        res_addr = self._guest_call('AStyleBatch', batch_addr, self._opts.ptr.addr)
+        if not res_addr:
+            raise AstyleError('error: out of memory')
+        try:
+            formatted = _unpack_batch(self.context.get_memory_view(), res_addr)
+        finally:
+            self.context.call_func('free', res_addr)
+        n_bytes = sum(len(res or b'') + 5 for res in formatted)
+        self._note_buffer(res_addr, n_bytes)
+        self.bytes_out += n_bytes
+        self._limit_memory()
+        results = []
+        for src, res in zip(sources, formatted):
+            if res is not None:
+                results.append(_format_result(src, res, None))
+                continue
+            # The errors reported during the batch can't be told apart: format
+            # the sources which failed one by one, to get the error of each of them.
+            try:
+                results.append(_format_result(src, self._format_bytes(src), None))
+            except AstyleError as e:
+                results.append(_format_result(src, None, str(e)))
+        return results
+
+    def format_many(
+        self, sources: typing.Iterable[str], options: typing.Optional[str] = None
+    ) -> typing.Generator[FormatResult, None, None]:
+        yield from self._call_iter(self.format, sources, options)
+
+    def check_many(
+        self, sources: typing.Iterable[str], options: typing.Optional[str] = None
+    ) -> typing.Generator[FormatResult, None, None]:
+        yield from self._call_iter(
+            self.check,
+            sources,
+            options,
+            lambda _, line, error: FormatResult(None, bool(line), error),
         )
-        self._handle_delayed_err()
-        return str(WasmString.from_addr(self.context, res_addr))
 
-    def _err_handler(self, errno: int, errptr: int):
-        errstr = WasmString.from_addr(self.context, errptr)
-        self._delayed_err = 'error: {} ({})'.format(errstr, errno)
+    def _call_iter(
+        self,
+        func: typing.Callable[[typing.Any], typing.Any],
+        sources: typing.Iterable,
+        options: typing.Optional[str],
+        make_result: typing.Callable[
+            [typing.Any, typing.Any, typing.Optional[str]], FormatResult
+        ] = _format_result,
+    ) -> typing.Generator[FormatResult, None, None]:
+        if options is not None:
+            self.set_options(options)
+        if self._opts.error:
+            raise AstyleError(self._opts.error)
+        for source in sources:
+            try:
+                yield make_result(source, func(source), None)
+            except (AstyleError, ValueError) as e:
+                yield make_result(source, None, str(e))
+
+    def _write_source(self, source: typing.Union[str, bytes]) -> int:
+        """
+        Copy the source to the buffer in the linear memory, growing it if necessary,
+        and return its address. The buffer is reused by all the format calls, and
+        never shrinks: the linear memory can't shrink anyway.
+        """
+        strb = source.encode('utf-8') if isinstance(source, str) else source
+        n_bytes = len(strb)
+        self.bytes_in += n_bytes
+        if n_bytes + 1 > self._src_buf_size and not self._alloc_source_buffer(
+            n_bytes + 1
+        ):
+            # The heap may be too fragmented, try again with a clean one
+            self._recycle()
+            if not self._alloc_source_buffer(n_bytes + 1):
+                raise AstyleError(
+                    'error: not enough memory for a source of {} bytes'.format(n_bytes)
+                )
+        addr = self._src_buf
+        end = addr + n_bytes
+        data = self.context.get_memory_view()
+        data[addr:end] = strb
+        data[end] = 0
+        return addr
+
+    def _alloc_source_buffer(self, min_size: int) -> bool:
+        if self._src_buf:
+            self.context.call_func('free', self._src_buf)
+            self._src_buf = 0
+        size = max(min_size, self._src_buf_size * 2, SOURCE_BUFFER_MIN_SIZE)
+        self._src_buf = int(self.context.call_func('malloc', size))
+        if not self._src_buf:
+            size = min_size
+            self._src_buf = int(self.context.call_func('malloc', size))
+        if not self._src_buf:
+            self._src_buf_size = 0
+            return False
+        self._src_buf_size = size
+        self._note_buffer(self._src_buf, size)
+        return True
 
-    def _handle_delayed_err(self):
+    def _note_buffer(self, addr: int, n_bytes: int) -> None:
+        end = addr + n_bytes
+        if end > self._heap_top:
+            self._heap_top = end
+
+    def _probe_heap(self, n_bytes: int) -> None:
+        addr = int(self.context.call_func('malloc', n_bytes))
+        if addr:
+            self._note_buffer(addr, n_bytes)
+            self.context.call_func('free', addr)
+
+    def _limit_memory(self) -> None:
+        if self.memory_limit is not None and self._heap_top > self.memory_limit:
+            self._recycle()
+
+    def _recycle(self) -> None:
+        """
+        Restore the heap from the snapshot taken after initialization, keeping
+        the current options.
+        """
+        options = str(self._opts.ptr)
+        self.context.restore_snapshot(self._snapshot)
+        self.recycled += 1
+        self._reset_heap_state()
+        self.set_options(options)
+
+    def _intern_options(self, options: str) -> _InternedOptions:
+        ptr = WasmString.from_str(self.context, options)
+        # Format an empty source to find out if the options are valid
+        src_addr = self._write_source('')
+        error = None
+        try:
+            res_addr = self._call('AStyleWrapper', src_addr, ptr.addr)
+            WasmString.from_addr(self.context, res_addr)
+        except AstyleError as e:
+            error = str(e)
+        opts = _InternedOptions(ptr, error)
+        self._options[options] = opts
+        while len(self._options) > OPTIONS_CACHE_SIZE:
+            self._options.popitem(last=False)
+        return opts
+
+    def _call(self, name: str, *args):
+        self._delayed_err = None
+        res = self._guest_call(name, *args)
         if self._delayed_err:
             raise AstyleError(self._delayed_err)
+        return res
+
+    def _reinstantiate(self) -> None:
+        options = str(self._opts.ptr)
+        self._retired_guest_calls += self.context.guest_calls
+        self._instantiate()
+        self.set_options(options)
+
+    def _guest_call(self, name: str, *args):
+        store = self.context.store
+        if self.timeout is not None:
+            start_epoch_ticker()
+            # The next tick may come right away, allow for one more
+            store.set_epoch_deadline(math.ceil(self.timeout / EPOCH_TICK) + 1)
+        start = time.perf_counter() if self.stats_hook is not None else None
+        try:
+            return self.context.call_func(name, *args)
+        except (Trap, WasmtimeError) as e:
+            # The call was stopped at an arbitrary point (interrupted, or aborted
+            # e.g. by running out of memory), the state of the instance can't be
+            # trusted anymore.
+            self.context.discarded = True
+            self._reinstantiate()
+            if isinstance(e, Trap) and e.trap_code == TrapCode.INTERRUPT:
+                raise AstyleTimeout(
+                    'error: formatting took longer than {}s'.format(self.timeout)
+                )
+            if isinstance(e, ExitTrap):
+                raise AstyleError('error: astyle exited with code {}'.format(e.code))
+            raise AstyleError('error: formatting aborted by a WASM trap') from e
+        finally:
+            if self.timeout is not None:
+                store.set_epoch_deadline(NO_EPOCH_DEADLINE)
+            if start is not None:
+                self.guest_time += time.perf_counter() - start
+
+    def _err_handler(self, errno: int, errptr: int):
+        errstr = WasmString.read(self.context, errptr)
+        self._delayed_err = 'error: {} ({})'.format(errstr, errno)
+
+
+class Astyle:
+    """
+    Formats sources with the given version of Astyle.
+
+    An Astyle object may be used by several threads at once: each thread gets its own
+    instance of the WASM module (with its own store), created on the first call from
+    that thread, while the compiled module is shared. The options, and the errors
+    reported by the module, are per thread: set_options only affects the calls made
+    by the same thread. The time and memory limits apply to all the threads.
+
+    'timeout', if not None, limits the time each format or check call may take,
+    in seconds. A call which takes longer raises AstyleTimeout; the WASM instance
+    is then replaced by a new one, keeping the current options.
+    'memory_limit', if not None, bounds the growth of the heap in the linear memory,
+    in bytes. Once the buffers passed to or from the module reach past this address,
+    the heap is restored from the snapshot taken after the module was initialized,
+    which also undoes its fragmentation. The heap is restored in the same way when
+    the module runs out of memory.
+    'stats_hook', if not None, is called with the CallStats of each format, format_bytes,
+    check and format_batch call (also of the ones made by format_many and check_many),
+    in the calling thread, e.g. to export them to a metrics system. Measuring the time
+    of the guest calls has a small cost, so it is only done while the hook is set.
+    """
+
+    def __init__(
+        self,
+        version: str = ASTYLE_COMPAT_VERSION,
+        timeout: typing.Optional[float] = None,
+        memory_limit: typing.Optional[int] = None,
+        stats_hook: typing.Optional[typing.Callable[[CallStats], None]] = None,
+    ):
+        check_astyle_version(version)
+        self._version = version
+        self._timeout = timeout
+        self._memory_limit = memory_limit
+        self._stats_hook = stats_hook
+        self._local = threading.local()
+        # Instantiate the module for the calling thread right away,
+        # most objects are only ever used by the thread which created them.
+        self._instance()
+
+    def _instance(self) -> _AstyleInstance:
+        """
+        Return the instance of the calling thread, creating it if necessary.
+        """
+        instance = getattr(self._local, 'instance', None)
+        if instance is None:
+            instance = _AstyleInstance(self._version, self._timeout, self._memory_limit)
+            instance.stats_hook = self._stats_hook
+            self._local.instance = instance
+            return instance
+        # The limits may have been changed by another thread meanwhile
+        if instance.timeout != self._timeout:
+            instance.timeout = self._timeout
+        instance.memory_limit = self._memory_limit
+        instance.stats_hook = self._stats_hook
+        return instance
+
+    @property
+    def timeout(self) -> typing.Optional[float]:
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, timeout: typing.Optional[float]) -> None:
+        self._timeout = timeout
+        self._instance()
+
+    @property
+    def memory_limit(self) -> typing.Optional[int]:
+        return self._memory_limit
+
+    @memory_limit.setter
+    def memory_limit(self, memory_limit: typing.Optional[int]) -> None:
+        self._memory_limit = memory_limit
+
+    @property
+    def stats_hook(self) -> typing.Optional[typing.Callable[[CallStats], None]]:
+        return self._stats_hook
+
+    @stats_hook.setter
+    def stats_hook(
+        self, stats_hook: typing.Optional[typing.Callable[[CallStats], None]]
+    ) -> None:
+        self._stats_hook = stats_hook
+
+    @property
+    def context(self) -> WasmContext:
+        """
+        WasmContext of the calling thread's instance.
+        """
+        return self._instance().context
+
+    @property
+    def recycled(self) -> int:
+        """
+        Number of times the heap of the calling thread's instance was restored
+        from the snapshot, see memory_limit.
+        """
+        return self._instance().recycled
+
+    def version(self) -> str:
+        return self._instance().version()
+
+    def set_options(self, options: str) -> None:
+        """
+        Set the options for the subsequent format calls.
+        The option strings are kept in the linear memory and validated when first seen,
+        so switching between a few sets of options is cheap. Invalid options are
+        reported by format().
+        """
+        self._instance().set_options(options)
+
+    def release_options(self, options: typing.Optional[str] = None) -> None:
+        """
+        Free the memory used by the given option string, or by all the option strings
+        which aren't currently set if 'options' is None.
+        """
+        self._instance().release_options(options)
+
+    def format(self, source: str) -> str:
+        return self._instance().format(source)
+
+    def format_bytes(self, source: bytes) -> bytes:
+        """
+        Same as format, but takes and returns the source as bytes. The source is passed
+        to astyle as is, without decoding and re-encoding it, so sources in any
+        ASCII-compatible encoding can be formatted.
+        """
+        return self._instance().format_bytes(source)
+
+    def check(self, source: typing.Union[str, bytes]) -> int:
+        """
+        Check if the source is formatted according to the current options.
+        Returns 0 if formatting doesn't change it, otherwise the (1-based) number of
+        the first line changed by formatting. The comparison happens inside the WASM
+        module where supported, so the formatted source isn't copied out of it.
+        """
+        return self._instance().check(source)
+
+    def format_batch(
+        self, sources: typing.Sequence[bytes]
+    ) -> typing.List[FormatResult]:
+        """
+        Format several sources (as bytes) with the current options, in a single call
+        into the WASM module where supported. Returns a FormatResult for each source,
+        in order; a source which fails to format doesn't affect the others.
+        """
+        return self._instance().format_batch(sources)
+
+    def format_many(
+        self, sources: typing.Iterable[str], options: typing.Optional[str] = None
+    ) -> typing.Generator[FormatResult, None, None]:
+        """
+        Format the sources one by one, yielding a FormatResult for each of them, in order.
+        A source which fails to format doesn't stop the batch, the error is reported
+        in its result instead. The sources are consumed lazily, so the iterable may be
+        an arbitrarily long stream.
+        If 'options' is given, it is set as with set_options, otherwise the current
+        options are used. Invalid options raise AstyleError before any source is consumed.
+        """
+        return self._instance().format_many(sources, options)
+
+    def check_many(
+        self, sources: typing.Iterable[str], options: typing.Optional[str] = None
+    ) -> typing.Generator[FormatResult, None, None]:
+        """
+        Same as format_many, but only reports whether each source would be changed
+        by formatting, without returning the formatted sources.
+        """
+        return self._instance().check_many(sources, options)
@@ -0,0 +1,139 @@
+# SPDX-FileCopyrightText: 2026 Ivan Grokhotkov <ivan@igrr.me>
+# SPDX-License-Identifier: MIT
+"""
+asyncio front-end: the formatting runs on a pool of worker threads, each call using
+one of a bounded set of Astyle instances, so that the event loop isn't blocked.
+wasmtime releases the GIL while executing WASM code, so the calls do run in parallel.
+"""
+import asyncio
+import os
+import threading
+import typing
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from .astyle_versions import ASTYLE_COMPAT_VERSION, check_astyle_version
+from .astyle_wrapper import Astyle
+
+# How many calls may wait for a free worker, per worker, before the callers are blocked
+ASYNC_QUEUE_FACTOR = 4
+
+
+class AsyncAstyle:
+    """
+    Formats sources asynchronously, using up to 'workers' Astyle instances in worker
+    threads (by default, one per CPU). At most 'max_pending' calls are queued or running
+    at any time, the other callers wait until one of them completes.
+    'timeout' is the default time limit of each call, in seconds, including the time
+    spent waiting for a worker. A call which times out raises asyncio.TimeoutError,
+    or AstyleTimeout if it was interrupted by the worker. A call which is cancelled
+    after it has started is finished by the worker in the background.
+    """
+
+    def __init__(
+        self,
+        version: str = ASTYLE_COMPAT_VERSION,
+        workers: typing.Optional[int] = None,
+        max_pending: typing.Optional[int] = None,
+        timeout: typing.Optional[float] = None,
+    ):
+        check_astyle_version(version)
+        self._version = version
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.workers * ASYNC_QUEUE_FACTOR
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix='astyle_py'
+        )
+        # The Astyle instance of each worker thread
+        self._local = threading.local()
+        self._semaphore = None  # type: typing.Optional[asyncio.Semaphore]
+        self._semaphore_loop = None  # type: typing.Optional[asyncio.AbstractEventLoop]
+
+    async def __aenter__(self) -> 'AsyncAstyle':
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def format(
+        self, source: str, options: str = '', timeout: typing.Optional[float] = None
+    ) -> str:
+        """
+        Format the source with the given options. Raises AstyleError on failure.
+        """
+        return await self._submit(self._format, source, options, timeout=timeout)
+
+    async def check(
+        self, source: str, options: str = '', timeout: typing.Optional[float] = None
+    ) -> bool:
+        """
+        Return True if the source would be changed by formatting it with the given options.
+        """
+        return await self._submit(self._check, source, options, timeout=timeout)
+
+    async def version(self) -> str:
+        return await self._submit(lambda astyle: astyle.version(), timeout=None)
+
+    async def close(self) -> None:
+        """
+        Wait for the running calls to complete, and release the workers.
+        """
+        await asyncio.get_running_loop().run_in_executor(
+            None, self._executor.shutdown, True
+        )
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_pending)
+            self._semaphore_loop = loop
+        return self._semaphore
+
+    async def _submit(self, func, *args, timeout: typing.Optional[float]):
+        if timeout is None:
+            timeout = self.timeout
+        loop = asyncio.get_running_loop()
+        semaphore = self._get_semaphore()
+        await semaphore.acquire()
+        try:
+            cfut = self._executor.submit(self._run, timeout, func, *args)
+        except BaseException:
+            semaphore.release()
+            raise
+
+        # Only free the slot once the worker is done with the call,
+        # even if the caller has given up on it.
+        def release(_: Future) -> None:
+            try:
+                loop.call_soon_threadsafe(semaphore.release)
+            except RuntimeError:
+                pass  # the event loop is already closed
+
+        cfut.add_done_callback(release)
+        try:
+            return await asyncio.wait_for(
+                asyncio.shield(asyncio.wrap_future(cfut)), timeout
+            )
+        except BaseException:
+            # Has no effect if the call is already running
+            cfut.cancel()
+            raise
+
+    def _run(self, timeout: typing.Optional[float], func, *args):
+        astyle = getattr(self._local, 'astyle', None)
+        if astyle is None:
+            astyle = Astyle(version=self._version)
+            self._local.astyle = astyle
+        # Also stops the worker itself, unlike the timeout of asyncio.wait_for
+        astyle.timeout = timeout
+        return func(astyle, *args)
+
+    @staticmethod
+    def _format(astyle: Astyle, source: str, options: str) -> str:
+        astyle.set_options(options)
+        return astyle.format(source)
+
+    @staticmethod
+    def _check(astyle: Astyle, source: str, options: str) -> bool:
+        astyle.set_options(options)
+        return astyle.check(source) != 0
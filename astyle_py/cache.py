@@ -0,0 +1,179 @@
+# SPDX-FileCopyrightText: 2026 Ivan Grokhotkov <ivan@igrr.me>
+# SPDX-License-Identifier: MIT
+import hashlib
+import os
+import sqlite3
+import time
+import typing
+
+from .version import __version__
+
+CACHE_DB_NAME = 'results.sqlite'
+CACHE_MAX_ENTRIES = 100000
+# Once there are more than max_entries entries, the least recently used ones
+# are evicted down to this fraction of max_entries, so that eviction is rare.
+CACHE_LOW_WATER_FRACTION = 0.9
+# The recorded keys are written in one short transaction per this many keys, so that
+# the processes sharing the cache (e.g. parallel pre-commit batches) don't hold its
+# write lock for the whole run.
+CACHE_RECORD_BATCH = 100
+# How long to wait for the write lock held by another process, in seconds. If it isn't
+# released by then, the keys of the transaction are not recorded.
+CACHE_BUSY_TIMEOUT = 0.2
+
+
+def default_cache_dir() -> str:
+    base = os.environ.get('XDG_CACHE_HOME') or os.environ.get('LOCALAPPDATA')
+    if not base:
+        base = os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'astyle_py')
+
+
+def cache_key(content: bytes, options: str, astyle_version: str) -> str:
+    """
+    Return the key under which the fact that 'content' is already formatted
+    with the given options and astyle version is recorded.
+    """
+    h = hashlib.sha256()
+    for part in (__version__, astyle_version, options):
+        h.update(part.encode('utf-8') + b'\x00')
+    h.update(content)
+    return h.hexdigest()
+
+
+class ResultCache:
+    """
+    Persistent set of keys (see cache_key) of the sources known to be formatted.
+    The least recently used entries are evicted once there are more than
+    max_entries of them (down to CACHE_LOW_WATER_FRACTION of max_entries, so that
+    the following runs don't have to evict anything). Any database error disables the cache instead of
+    failing the formatting, except for the write lock being held by another process
+    for too long: the keys which couldn't be written are just not recorded.
+
+    A read-only cache only answers lookups, that's what worker processes and threads
+    use, leaving all the updates to the main process.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        max_entries: int = CACHE_MAX_ENTRIES,
+        read_only: bool = False,
+    ):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.read_only = read_only
+        self._db = None  # type: typing.Optional[sqlite3.Connection]
+        # Whether any keys were recorded, which is the only way the cache can grow
+        self._recorded = False
+        # Access times of the keys not written to the database yet
+        self._pending = {}  # type: typing.Dict[str, float]
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            # A read-only cache may be closed by another thread than the one using it
+            # The transactions are started explicitly, see _write
+            self._db = sqlite3.connect(
+                os.path.join(cache_dir, CACHE_DB_NAME),
+                timeout=CACHE_BUSY_TIMEOUT,
+                isolation_level=None,
+                check_same_thread=not read_only,
+            )
+            if not read_only:
+                self._db.execute('PRAGMA journal_mode=WAL')
+                self._db.execute(
+                    'CREATE TABLE IF NOT EXISTS formatted '
+                    '(key TEXT PRIMARY KEY, atime REAL NOT NULL)'
+                )
+                self._db.execute(
+                    'CREATE INDEX IF NOT EXISTS formatted_atime ON formatted (atime)'
+                )
+        except (OSError, sqlite3.Error):
+            self._db = None
+
+    def lookup(self, key: str) -> bool:
+        if self._db is None:
+            return False
+        if key in self._pending:
+            return True
+        try:
+            row = self._db.execute(
+                'SELECT 1 FROM formatted WHERE key = ?', (key,)
+            ).fetchone()
+        except sqlite3.Error:
+            row = None
+        return row is not None
+
+    def record(self, key: str) -> None:
+        """
+        Record the key as formatted, or mark it as recently used if it is already known.
+        """
+        if self._db is None or self.read_only:
+            return
+        self._pending[key] = time.time()
+        if len(self._pending) >= CACHE_RECORD_BATCH:
+            self._flush()
+
+    def close(self) -> None:
+        if self._db is None:
+            return
+        self._flush()
+        if self._recorded:
+            self._write(self._evict)
+        if self._db is not None:
+            try:
+                self._db.close()
+            except sqlite3.Error:
+                pass
+        self._db = None
+
+    def _flush(self) -> None:
+        pending = self._pending
+        self._pending = {}
+        if pending and self._write(
+            lambda db: db.executemany(
+                'INSERT OR REPLACE INTO formatted (key, atime) VALUES (?, ?)',
+                pending.items(),
+            )
+        ):
+            self._recorded = True
+
+    def _write(self, func: typing.Callable[[sqlite3.Connection], typing.Any]) -> bool:
+        """
+        Run func in a write transaction. Returns False if it wasn't committed.
+        """
+        if self._db is None:
+            return False
+        try:
+            # Take the write lock right away, rather than when the first row is written
+            self._db.execute('BEGIN IMMEDIATE')
+        except sqlite3.OperationalError as e:
+            # Locked by another process for longer than CACHE_BUSY_TIMEOUT
+            if 'locked' not in str(e) and 'busy' not in str(e):
+                self._db = None
+            return False
+        except sqlite3.Error:
+            self._db = None
+            return False
+        try:
+            func(self._db)
+            self._db.execute('COMMIT')
+            return True
+        except sqlite3.Error:
+            try:
+                self._db.execute('ROLLBACK')
+            except sqlite3.Error:
+                pass
+            self._db = None
+            return False
+
+    def _evict(self, db: sqlite3.Connection) -> None:
+        (count,) = db.execute('SELECT COUNT(*) FROM formatted').fetchone()
+        if count <= self.max_entries:
+            return
+        keep = max(1, round(self.max_entries * CACHE_LOW_WATER_FRACTION))
+        # Uses the index on atime, rather than sorting the whole table
+        db.execute(
+            'DELETE FROM formatted WHERE atime < '
+            '(SELECT atime FROM formatted ORDER BY atime DESC LIMIT 1 OFFSET ?)',
+            (keep - 1,),
+        )
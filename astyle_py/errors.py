@@ -0,0 +1,16 @@
+# SPDX-FileCopyrightText: 2026 Ivan Grokhotkov <ivan@igrr.me>
+# SPDX-License-Identifier: MIT
+"""
+The exceptions raised by Astyle. Kept apart from astyle_wrapper, so that the clients
+of the formatting server can handle them without importing wasmtime.
+"""
+
+
+class AstyleError(RuntimeError):
+    pass
+
+
+class AstyleTimeout(AstyleError):
+    """
+    Raised when formatting takes longer than the time limit, see Astyle.timeout.
+    """
@@ -1,20 +1,49 @@
 # SPDX-FileCopyrightText: 2022 Ivan Grokhotkov <ivan@igrr.me>
 # SPDX-License-Identifier: MIT
+import itertools
 import os
 import re
 from collections import namedtuple
-from typing import Generator, List, Pattern
-
-import yaml
+from typing import (
+    Callable,
+    Generator,
+    Iterable,
+    List,
+    Optional,
+    Pattern,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 from .args import AstyleArgs
-from .utils import pattern_to_regex
+from .astyle_versions import check_astyle_version
+from .rules_snapshot import RULES_SNAPSHOT_DIR, load_snapshot, store_snapshot
+from .utils import ANY_DIRS_REGEX, iterate_file_list, pattern_to_regex
+
+# 'astyle_version' and 'version' are None unless set in the rules file,
+# in which case the default version (--astyle-version) is used.
+# The 'include' patterns of a Rule are compiled regexes, or regex sources for the rules
+# loaded from a snapshot (see rules_snapshot), which are only compiled as needed.
+FileItem = namedtuple(
+    'FileItem', ['filename', 'astyle_options', 'astyle_version'], defaults=(None,)
+)
+Rule = namedtuple('Rule', ['check', 'include', 'options', 'version'], defaults=(None,))
+
+# Extensions of the files found in the directories given on the command line,
+# same as in the 'files' pattern of the pre-commit hook.
+DEFAULT_EXTENSIONS = ['c', 'cpp', 'cxx', 'h', 'hpp', 'inc']
+
+# End of the regex produced by pattern_to_regex for a pattern ending with '/',
+# which matches everything in a directory.
+DIR_REGEX_SUFFIX = '/' + ANY_DIRS_REGEX + '[^/]*$'
 
-FileItem = namedtuple('FileItem', ['filename', 'astyle_options'])
-Rule = namedtuple('Rule', ['check', 'include', 'options'])
 
+def _regex_source(regex: Union[Pattern, str]) -> str:
+    return regex if isinstance(regex, str) else regex.pattern
 
-def file_matches_patterns(fname: str, patterns: List[Pattern]) -> bool:
+
+def path_for_matching(fname: str) -> str:
     # Normalize the path (remove any '..').
     fname_norm = os.path.normpath(fname)
     # Regex patterns are written with forward slashes in mind,
@@ -22,37 +51,303 @@ def file_matches_patterns(fname: str, patterns: List[Pattern]) -> bool:
     fname_fwdslash = fname_norm.replace(os.path.sep, '/')
     # Make the path 'absolute', with root being the root
     # of the project (where this tool is invoked)
-    fname_match = f'/{fname_fwdslash}'
+    return f'/{fname_fwdslash}'
+
 
+def file_matches_patterns(fname: str, patterns: Sequence[Union[Pattern, str]]) -> bool:
+    fname_match = path_for_matching(fname)
     return any((re.search(regex, fname_match) for regex in patterns))
 
 
-def iterate_files(args: AstyleArgs) -> Generator[FileItem, None, None]:
+def _anchored(regex: str) -> str:
+    # Returns a regex such that re.match(_anchored(r), s) is equivalent to
+    # re.search(r, s), for the regexes produced by pattern_to_regex.
+    if regex.startswith('^'):
+        return regex
+    # Searching for '(?:.*/)?X' is the same as searching for X
+    if regex.startswith(ANY_DIRS_REGEX):
+        regex = regex.replace(ANY_DIRS_REGEX, '', 1)
+    return '(?s:.*?)(?:{})'.format(regex)
+
+
+class PatternsMatcher:
+    """
+    Checks whether a path matches any of the patterns, with a single regular expression.
+    """
+
+    def __init__(self, patterns: Sequence[Union[Pattern, str]]):
+        self._regex = None  # type: Optional[Pattern]
+        if patterns:
+            self._regex = re.compile(
+                '|'.join(_anchored(_regex_source(p)) for p in patterns)
+            )
+
+    def matches(self, fname_match: str) -> bool:
+        """fname_match is the path returned by path_for_matching"""
+        return self._regex is not None and self._regex.match(fname_match) is not None
+
+
+class RulesMatcher:
+    """
+    Finds the last of the rules matching a path, with a single regular expression
+    for all the rules. The regex is an alternation of one named group per rule,
+    in reverse order: the first alternative which matches is the last matching rule.
+    """
+
+    def __init__(self, rules: List[Rule]):
+        self._regex = None  # type: Optional[Pattern]
+        alternatives = []
+        for idx in reversed(range(len(rules))):
+            if not rules[idx].include:
+                continue
+            alternatives.append(
+                '(?P<r{}>{})'.format(
+                    idx,
+                    '|'.join(_anchored(_regex_source(p)) for p in rules[idx].include),
+                )
+            )
+        if alternatives:
+            self._regex = re.compile('|'.join(alternatives))
+
+    def match(self, fname_match: str) -> Optional[int]:
+        """
+        Return the index of the last rule matching fname_match (the path returned
+        by path_for_matching), or None if no rule matches.
+        """
+        if self._regex is None:
+            return None
+        m = self._regex.match(fname_match)
+        if m is None:
+            return None
+        return int(m.lastgroup[1:])  # type: ignore
+
+
+def _matches_whole_dir(regex: Union[Pattern, str]) -> bool:
+    return _regex_source(regex).endswith(DIR_REGEX_SUFFIX)
+
+
+def _literal_prefix(regex: str) -> str:
+    # Leading part of a regex produced by pattern_to_regex which is matched literally
+    prefix = ''
+    while regex:
+        if regex.startswith('[.]'):
+            prefix += '.'
+            regex = regex[3:]
+        elif regex[0] in '[(.*?$\\':
+            break
+        else:
+            prefix += regex[0]
+            regex = regex[1:]
+    return prefix
+
+
+def _may_match_in_dir(regex: Union[Pattern, str], dir_match: str) -> bool:
+    # Whether the regex may match some path inside the directory,
+    # dir_match being the path_for_matching of the directory plus '/'.
+    source = _regex_source(regex)
+    if not source.startswith('^'):
+        return True
+    prefix = _literal_prefix(source[1:])
+    return prefix.startswith(dir_match) or dir_match.startswith(prefix)
+
+
+def _dir_for_matching(dirname: str) -> str:
+    dir_match = path_for_matching(dirname)
+    return '/' if dir_match == '/.' else dir_match + '/'
+
+
+def walk_files(
+    files: Iterable[str],
+    skip_dir: Callable[[str], bool],
+    extensions: Optional[List[str]] = None,
+) -> Generator[str, None, None]:
+    """
+    Yield the files, replacing each directory with the files found in it (recursively)
+    which have one of the given extensions. The files are yielded as soon as they are found.
+    Hidden directories, and the directories for which skip_dir(dir_match) returns True,
+    aren't entered. dir_match is the path_for_matching of the directory, plus '/'.
+    """
+    suffixes = tuple('.' + ext for ext in (extensions or DEFAULT_EXTENSIONS))
+    for fname in files:
+        if not os.path.isdir(fname):
+            yield fname
+            continue
+        dirs = [fname]
+        while dirs:
+            dirname = dirs.pop()
+            if skip_dir(_dir_for_matching(dirname)):
+                continue
+            with os.scandir(dirname) as it:
+                entries = sorted(it, key=lambda e: e.name)
+            subdirs = []
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if not entry.name.startswith('.'):
+                        subdirs.append(entry.path)
+                elif entry.name.endswith(suffixes) and entry.is_file():
+                    yield entry.path
+            # depth first, in alphabetical order
+            dirs.extend(reversed(subdirs))
+
+
+def iterate_files(
+    args: AstyleArgs, changed_files: Optional[List[str]] = None
+) -> Generator[FileItem, None, None]:
+    """
+    Yield the files to check, according to the arguments.
+    If changed_files is given, only these files are checked: when no files are specified
+    on the command line, the changed files with one of the extensions are used instead.
+    """
+    files = args.files  # type: Iterable[str]
+    if args.files_from is not None:
+        files = itertools.chain(
+            files, iterate_file_list(args.files_from, args.null_delimited)
+        )
+    elif changed_files is not None and not args.files:
+        suffixes = tuple('.' + ext for ext in (args.extensions or DEFAULT_EXTENSIONS))
+        files = sorted(f for f in changed_files if f.endswith(suffixes))
+
     if args.rules is None:
-        yield from iterate_files_simple(args.files, args.exclude_list, args.options)
+        items = iterate_files_simple(
+            files, args.exclude_list, args.options, args.extensions
+        )
     else:
-        yield from iterate_files_rules(args.files, args.rules)
+        snapshot_dir = None
+        if args.use_cache:
+            from .cache import default_cache_dir
+
+            snapshot_dir = os.path.join(
+                args.cache_dir or default_cache_dir(), RULES_SNAPSHOT_DIR
+            )
+        items = iterate_files_rules(files, args.rules, args.extensions, snapshot_dir)
+
+    if changed_files is None:
+        yield from items
+        return
+    changed = set(os.path.abspath(f) for f in changed_files)
+    for item in items:
+        if os.path.abspath(item.filename) in changed:
+            yield item
 
 
 def iterate_files_simple(
-    files: List[str], exclude_list: List[str], options: List[str]
+    files: Iterable[str],
+    exclude_list: List[str],
+    options: List[str],
+    extensions: Optional[List[str]] = None,
 ) -> Generator[FileItem, None, None]:
     exclude_regexes = [re.compile(pattern_to_regex(p)) for p in exclude_list]
+    exclude_matcher = PatternsMatcher(exclude_regexes)
+    exclude_dir_matcher = PatternsMatcher(
+        [r for r in exclude_regexes if _matches_whole_dir(r)]
+    )
 
-    for fname in files:
-        if file_matches_patterns(fname, exclude_regexes):
+    for fname in walk_files(files, exclude_dir_matcher.matches, extensions):
+        if exclude_matcher.matches(path_for_matching(fname)):
             continue
         yield FileItem(filename=fname, astyle_options=options)
 
 
+def _rules_skip_dir(rules: List[Rule]) -> Callable[[str], bool]:
+    # A directory can be skipped if the last rule matching the whole directory
+    # has check: false, and no later rule with check: true may match something in it.
+    dir_rules = [
+        r._replace(include=[p for p in r.include if _matches_whole_dir(p)])
+        for r in rules
+    ]
+    # Only compiled once a directory is walked, the files to check are often
+    # given one by one.
+    dir_matcher = None  # type: Optional[RulesMatcher]
+
+    def skip_dir(dir_match: str) -> bool:
+        nonlocal dir_matcher
+        if dir_matcher is None:
+            dir_matcher = RulesMatcher(dir_rules)
+        idx = dir_matcher.match(dir_match)
+        if idx is None or rules[idx].check:
+            return False
+        later_rules = itertools.islice(rules, idx + 1, None)
+        return not any(
+            r.check and any(_may_match_in_dir(p, dir_match) for p in r.include)
+            for r in later_rules
+        )
+
+    return skip_dir
+
+
 def iterate_files_rules(
-    files: List[str], rules_file: str
+    files: Iterable[str],
+    rules_file: str,
+    extensions: Optional[List[str]] = None,
+    snapshot_dir: Optional[str] = None,
 ) -> Generator[FileItem, None, None]:
-    with open(rules_file, 'r', encoding='utf-8') as rf:
-        rules_dict = yaml.safe_load(rf)
+    """
+    Yield the files to check with the options of the rules matching them.
+    See load_rules for snapshot_dir.
+    """
+    default_rule, rules = load_rules(rules_file, snapshot_dir)
+
+    # now process the files
+    matcher = RulesMatcher(rules)
+    for fname in walk_files(files, _rules_skip_dir(rules), extensions):
+        # search for a rule for this file
+        idx = matcher.match(path_for_matching(fname))
+        selected_rule = default_rule if idx is None else rules[idx]
+        if selected_rule.check:
+            yield FileItem(fname, selected_rule.options, selected_rule.version)
+
+
+def load_rules(
+    rules_file: str, snapshot_dir: Optional[str] = None
+) -> Tuple[Rule, List[Rule]]:
+    """
+    Return the default rule and the other rules of the rules file.
+    If snapshot_dir is given, the rules are loaded from the snapshot kept there if the
+    rules file hasn't changed since, otherwise they are parsed and a snapshot is saved.
+    """
+    with open(rules_file, 'rb') as rf:
+        content = rf.read()
+    if snapshot_dir is not None:
+        snapshot = load_snapshot(snapshot_dir, rules_file, content)
+        if snapshot is not None:
+            return Rule(*snapshot[0]), [Rule(*r) for r in snapshot[1]]
+
+    default_rule, rules = parse_rules(content.decode('utf-8'))
+    if snapshot_dir is not None:
+        store_snapshot(
+            snapshot_dir,
+            rules_file,
+            content,
+            _rule_data(default_rule),
+            [_rule_data(r) for r in rules],
+        )
+    return default_rule, rules
+
+
+def _rule_data(rule: Rule) -> tuple:
+    return (
+        rule.check,
+        [_regex_source(p) for p in rule.include],
+        rule.options,
+        rule.version,
+    )
+
+
+def parse_rules(rules_yaml: str) -> Tuple[Rule, List[Rule]]:
+    """
+    Parse the contents of a rules file, return the default rule and the other rules.
+    """
+    # Only imported when a rules file is parsed, it takes a while to import
+    import yaml
+
+    # The loader implemented in C (libyaml) is many times faster, where available
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    rules_dict = yaml.load(rules_yaml, Loader=loader)
 
     # set the default rule
-    default_rule = Rule(check=True, include=[pattern_to_regex('*')], options=[])
+    default_rule = Rule(
+        check=True, include=[re.compile(pattern_to_regex('*'))], options=[]
+    )
 
     # if 'DEFAULT' key is in the YAML file, use it to update the default rule
     default_rule_dict = rules_dict.get('DEFAULT')
@@ -66,17 +361,14 @@ def iterate_files_rules(
             continue
         r = get_rule_from_dict(rule_name, rule_dict, default_rule)
         rules.append(r)
-
-    # now process the files
-    for fname in files:
-        # search for a rule for this file
-        yield from process_rules_for_file(fname, rules, default_rule)
+    return default_rule, rules
 
 
 def get_rule_from_dict(rule_name: str, rule_dict, defaults: Rule) -> Rule:
     options = defaults.options
     check = defaults.check
     include = defaults.include
+    version = defaults.version
 
     for k, v in rule_dict.items():
         if k == 'options':
@@ -97,12 +389,28 @@ def get_rule_from_dict(rule_name: str, rule_dict, defaults: Rule) -> Rule:
                     f'Unexpected value of \'include\' in rule {rule_name}, expected a list of strings, found {v}'
                 )
             include = [re.compile(pattern_to_regex(x)) for x in v]
+        elif k == 'version':
+            # An unquoted version like 3.10 is loaded as a number, and would become 3.1
+            if isinstance(v, (int, float)) and not isinstance(v, bool):
+                raise ValueError(
+                    f'Unexpected value of \'version\' in rule {rule_name}, expected a string, found the number {v}. '
+                    f'Put the version in quotes, e.g. version: "3.4.7"'
+                )
+            if not isinstance(v, str):
+                raise ValueError(
+                    f'Unexpected value of \'version\' in rule {rule_name}, expected a string, found {v}'
+                )
+            version = v
+            try:
+                check_astyle_version(version)
+            except ValueError as e:
+                raise ValueError(f'{e} (in rule {rule_name})')
         else:
             raise ValueError(
-                f'Unexpected key \'{k}\' in rule {rule_name}, expected one of: options, check, include'
+                f'Unexpected key \'{k}\' in rule {rule_name}, expected one of: options, check, include, version'
             )
 
-    return Rule(check, include, options)
+    return Rule(check, include, options, version)
 
 
 def process_rules_for_file(
@@ -113,4 +421,4 @@ def process_rules_for_file(
         if file_matches_patterns(fname, rule.include):
             selected_rule = rule
     if selected_rule.check:
-        yield FileItem(filename=fname, astyle_options=selected_rule.options)
+        yield FileItem(fname, selected_rule.options, selected_rule.version)
@@ -0,0 +1,84 @@
+# SPDX-FileCopyrightText: 2026 Ivan Grokhotkov <ivan@igrr.me>
+# SPDX-License-Identifier: MIT
+"""
+Snapshots of the parsed rules files, so that the runs which use an unchanged rules file
+don't parse its YAML again. A snapshot holds the rules with the regex sources
+of their patterns (compiled regexes can't be stored: unpickling them recompiles them),
+and is only used if the path, the modification time and the hash of the rules file
+all match the ones it was made from.
+"""
+import hashlib
+import json
+import os
+import typing
+
+from .version import __version__
+
+# Subdirectory of the cache directory where the snapshots are kept
+RULES_SNAPSHOT_DIR = 'rules'
+
+# Version of the layout of the snapshot files, also bumped when the rules files are
+# validated differently, so that the snapshots of the rejected ones are dropped
+RULES_SNAPSHOT_FORMAT = 2
+
+# check, include (regex sources), options, version of one rule
+RuleData = typing.Tuple[bool, typing.List[str], typing.List[str], typing.Optional[str]]
+
+
+def _snapshot_file(snapshot_dir: str, rules_path: str) -> str:
+    name = hashlib.sha256(rules_path.encode('utf-8')).hexdigest()[:32]
+    return os.path.join(snapshot_dir, name + '.json')
+
+
+def _source_key(rules_file: str, content: bytes) -> typing.Dict[str, typing.Any]:
+    return {
+        'format': RULES_SNAPSHOT_FORMAT,
+        # the patterns are translated differently by other versions
+        'astyle_py': __version__,
+        'path': os.path.abspath(rules_file),
+        'mtime_ns': os.stat(rules_file).st_mtime_ns,
+        'sha256': hashlib.sha256(content).hexdigest(),
+    }
+
+
+def load_snapshot(
+    snapshot_dir: str, rules_file: str, content: bytes
+) -> typing.Optional[typing.Tuple[RuleData, typing.List[RuleData]]]:
+    """
+    Return the default rule and the other rules from the snapshot of the rules file
+    with the given content, or None if there is no such snapshot.
+    """
+    try:
+        key = _source_key(rules_file, content)
+        with open(_snapshot_file(snapshot_dir, key['path']), 'r') as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(snapshot, dict) or snapshot.get('key') != key:
+        return None
+    default_rule = tuple(snapshot['default'])  # type: typing.Any
+    return default_rule, [tuple(r) for r in snapshot['rules']]  # type: ignore
+
+
+def store_snapshot(
+    snapshot_dir: str,
+    rules_file: str,
+    content: bytes,
+    default_rule: RuleData,
+    rules: typing.List[RuleData],
+) -> None:
+    """
+    Save the snapshot of the rules file with the given content. Failures are ignored,
+    the rules file is parsed again next time.
+    """
+    try:
+        key = _source_key(rules_file, content)
+        path = _snapshot_file(snapshot_dir, key['path'])
+        os.makedirs(snapshot_dir, exist_ok=True)
+        # Replace the file atomically, other processes may be reading it
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump({'key': key, 'default': default_rule, 'rules': rules}, f)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
@@ -0,0 +1,373 @@
+# SPDX-FileCopyrightText: 2026 Ivan Grokhotkov <ivan@igrr.me>
+# SPDX-License-Identifier: MIT
+import collections
+import itertools
+import multiprocessing
+import os
+import sys
+import threading
+import typing
+from collections import namedtuple
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Generator, Iterable
+
+from .cache import ResultCache, cache_key
+from .errors import AstyleError, AstyleTimeout
+from .files_iter import FileItem
+from .stats import FileTimer, record_call
+from .vcs import LineRange, formatting_changes_lines
+
+if typing.TYPE_CHECKING:
+    from .astyle_wrapper import Astyle
+
+FileResult = namedtuple(
+    'FileResult',
+    [
+        'filename',
+        'changed',
+        'formatted',
+        'error',
+        'cache_hit',
+        'formatted_key',
+        'timed_out',
+        'stats',
+    ],
+    defaults=(False, None),
+)
+
+# How many files may be queued per worker before the results are consumed
+JOBS_QUEUE_FACTOR = 4
+
+# Total size of the files, in bytes, from which formatting them in a pool of workers
+# pays off. Each worker process imports wasmtime and instantiates the module, which
+# takes about as long as formatting a few hundred kB; worker threads only instantiate
+# the module. Smaller workloads, like the batches of files passed by pre-commit,
+# are formatted in the calling thread.
+PARALLEL_MIN_BYTES = {'process': 512 * 1024, 'thread': 64 * 1024}
+
+
+def _file_size(fname: str) -> int:
+    try:
+        return os.path.getsize(fname)
+    except OSError:
+        # reported when the file is formatted
+        return 0
+
+
+def default_jobs() -> int:
+    return os.cpu_count() or 1
+
+
+def default_jobs_backend() -> str:
+    """
+    Threads only run in parallel while they are executing WASM code (wasmtime releases
+    the GIL then), unless the GIL is disabled. Use threads only in the latter case.
+    """
+    gil_enabled = getattr(sys, '_is_gil_enabled', lambda: True)()
+    return 'process' if gil_enabled else 'thread'
+
+
+class AstyleInstances:
+    """
+    Astyle instances by astyle version, each created when first needed.
+    'default_version' is used for the files which don't specify a version.
+    Instances are created by 'factory' if given, otherwise they are local instances
+    with the given time limit. With 'stats', the local instances report their calls
+    to stats.record_call, for format_file.
+    """
+
+    def __init__(
+        self,
+        default_version: str,
+        timeout: typing.Optional[float] = None,
+        factory: typing.Optional[typing.Callable[[str], 'Astyle']] = None,
+        stats: bool = False,
+    ):
+        self.default_version = default_version
+        self.timeout = timeout
+        self.stats = stats
+        self._factory = factory
+        self._instances = {}  # type: typing.Dict[str, Astyle]
+        self._lock = threading.Lock()
+
+    def version_for(self, file_item: FileItem) -> str:
+        return file_item.astyle_version or self.default_version
+
+    def get(self, version: str) -> 'Astyle':
+        """
+        Return the instance for the given version. Astyle objects are thread-safe,
+        so the same instance is returned to all threads.
+        """
+        with self._lock:
+            astyle = self._instances.get(version)
+            if astyle is None:
+                if self._factory is not None:
+                    astyle = self._factory(version)
+                else:
+                    # Imports wasmtime, which the clients of the server don't need
+                    from .astyle_wrapper import Astyle
+
+                    astyle = Astyle(version=version, timeout=self.timeout)
+                if self.stats and hasattr(astyle, 'stats_hook'):
+                    astyle.stats_hook = record_call
+                self._instances[version] = astyle
+            return astyle
+
+
+def format_file(
+    astyle: 'Astyle',
+    astyle_version: str,
+    file_item: FileItem,
+    fix_formatting: bool,
+    cache: typing.Optional[ResultCache] = None,
+    changed_lines: typing.Optional[typing.List[LineRange]] = None,
+    stats: bool = False,
+) -> FileResult:
+    """
+    Format one file and report whether it has changed.
+    The formatted text is only returned if it has to be written back.
+    The file itself is never modified here, and the cache is only queried:
+    formatted_key is the key to record once the result has been handled.
+    If changed_lines is given, the file is only reported as changed if formatting
+    modifies some of these lines.
+    With 'stats', the time spent in each phase is measured and returned in the stats
+    field of the result. The time spent in the WASM module is only known if the
+    instance reports its calls to stats.record_call, see AstyleInstances.
+    """
+    timer = FileTimer() if stats else None
+    result, n_bytes = _format_file(
+        astyle, astyle_version, file_item, fix_formatting, cache, changed_lines, timer
+    )
+    if timer is not None:
+        result = result._replace(stats=timer.finish(n_bytes))
+    return result
+
+
+def _format_file(
+    astyle: 'Astyle',
+    astyle_version: str,
+    file_item: FileItem,
+    fix_formatting: bool,
+    cache: typing.Optional[ResultCache],
+    changed_lines: typing.Optional[typing.List[LineRange]],
+    timer: typing.Optional[FileTimer],
+) -> typing.Tuple[FileResult, int]:
+    fname = file_item.filename
+    options = ' '.join(file_item.astyle_options)
+    with open(fname, 'rb') as f:
+        original = f.read()
+    n_bytes = len(original)
+    if timer is not None:
+        timer.lap('read')
+
+    key = None
+    if cache is not None:
+        key = cache_key(original, options, astyle_version)
+        hit = cache.lookup(key)
+        if timer is not None:
+            timer.lap('cache')
+        if hit:
+            return FileResult(fname, False, None, None, True, key), n_bytes
+
+    astyle.set_options(options)
+    formatted = None  # type: typing.Optional[bytes]
+    try:
+        if fix_formatting or changed_lines is not None:
+            formatted = astyle.format_bytes(original)
+            changed = formatted != original
+        else:
+            # Only the verdict is needed, don't copy the formatted source out of astyle
+            changed = astyle.check(original) != 0
+    except AstyleTimeout as e:
+        return FileResult(fname, False, None, str(e), False, None, True), n_bytes
+    except AstyleError as e:
+        return FileResult(fname, False, None, str(e), False, None), n_bytes
+    finally:
+        if timer is not None:
+            timer.lap('format')
+    if changed and changed_lines is not None:
+        assert formatted is not None
+        if not formatting_changes_lines(original, formatted, changed_lines):
+            # not formatted, but the remaining issues are outside of the changed lines
+            return FileResult(fname, False, None, None, False, None), n_bytes
+    if changed:
+        key = None
+    if changed and fix_formatting and cache is not None:
+        assert formatted is not None
+        # Formatting isn't always idempotent: only record the formatted source
+        # if formatting it again doesn't change it, so that the cache never changes
+        # the verdict of a later run.
+        try:
+            stable = astyle.check(formatted) == 0
+        except AstyleError:
+            stable = False
+        if timer is not None:
+            timer.lap('format')
+        if stable:
+            key = cache_key(formatted, options, astyle_version)
+            if timer is not None:
+                timer.lap('cache')
+    result = FileResult(
+        fname,
+        changed,
+        formatted if changed and fix_formatting else None,
+        None,
+        False,
+        key,
+    )
+    return result, n_bytes
+
+
+_worker_instances = None  # type: typing.Optional[AstyleInstances]
+_worker_cache = None  # type: typing.Optional[ResultCache]
+_worker_stats = False
+
+
+def _worker_init(
+    default_version: str,
+    cache_dir: typing.Optional[str],
+    timeout: typing.Optional[float],
+    stats: bool,
+) -> None:
+    global _worker_instances, _worker_cache, _worker_stats
+    _worker_instances = AstyleInstances(default_version, timeout, stats=stats)
+    _worker_stats = stats
+    if cache_dir is not None:
+        _worker_cache = ResultCache(cache_dir, read_only=True)
+
+
+def _worker_format_file(
+    file_item: FileItem,
+    fix_formatting: bool,
+    changed_lines: typing.Optional[typing.List[LineRange]],
+) -> FileResult:
+    assert _worker_instances is not None
+    version = _worker_instances.version_for(file_item)
+    return format_file(
+        _worker_instances.get(version),
+        version,
+        file_item,
+        fix_formatting,
+        _worker_cache,
+        changed_lines,
+        _worker_stats,
+    )
+
+
+def format_files(
+    instances: AstyleInstances,
+    file_items: Iterable[FileItem],
+    fix_formatting: bool,
+    jobs: int = 1,
+    cache: typing.Optional[ResultCache] = None,
+    changed_lines: typing.Optional[typing.Dict[str, typing.List[LineRange]]] = None,
+    backend: str = 'process',
+    stats: bool = False,
+    thread_instances: typing.Optional[AstyleInstances] = None,
+) -> Generator[FileResult, None, None]:
+    """
+    Format the files, yielding the results in the same order as file_items.
+    Each file is formatted with the astyle version of its rule, if any, or the default one.
+    With jobs > 1, and at least PARALLEL_MIN_BYTES of files to format,
+    the files are distributed among a pool of workers, each with
+    a read-only view of the cache. With the 'process' backend, these are worker
+    processes, each with its own Astyle instances. With the 'thread' backend, they are
+    threads sharing the instances from 'thread_instances' (or 'instances' if not given),
+    and the compiled modules. Otherwise, the instances from 'instances' are used directly.
+    changed_lines maps absolute file paths to the changed line ranges, see format_file.
+    With 'stats', each result carries the measurements of its file, see format_file.
+    """
+
+    def lines_for(file_item: FileItem) -> typing.Optional[typing.List[LineRange]]:
+        if changed_lines is None:
+            return None
+        return changed_lines.get(os.path.abspath(file_item.filename), [])
+
+    items = iter(file_items)
+    # Look ahead until it is clear that starting the workers is worth it
+    head = []  # type: typing.List[FileItem]
+    head_bytes = 0
+    min_bytes = PARALLEL_MIN_BYTES.get(backend, 0)
+    if jobs > 1:
+        for file_item in items:
+            head.append(file_item)
+            head_bytes += _file_size(file_item.filename)
+            if len(head) >= 2 and head_bytes >= min_bytes:
+                break
+    items = itertools.chain(head, items)
+
+    if jobs <= 1 or len(head) < 2 or head_bytes < min_bytes:
+        for file_item in items:
+            version = instances.version_for(file_item)
+            yield format_file(
+                instances.get(version),
+                version,
+                file_item,
+                fix_formatting,
+                cache,
+                lines_for(file_item),
+                stats,
+            )
+        return
+
+    # Read-only views of the cache used by the worker threads, one per thread:
+    # sqlite3 connections can't be used by several threads at once.
+    thread_caches = []  # type: typing.List[ResultCache]
+    local = threading.local()
+    shared_instances = thread_instances or instances
+
+    def thread_format_file(
+        file_item: FileItem,
+        fix_formatting: bool,
+        changed_lines: typing.Optional[typing.List[LineRange]],
+    ) -> FileResult:
+        thread_cache = getattr(local, 'cache', None)
+        if thread_cache is None and cache is not None:
+            thread_cache = ResultCache(cache.cache_dir, read_only=True)
+            thread_caches.append(thread_cache)
+            local.cache = thread_cache
+        version = shared_instances.version_for(file_item)
+        return format_file(
+            shared_instances.get(version),
+            version,
+            file_item,
+            fix_formatting,
+            thread_cache,
+            changed_lines,
+            stats,
+        )
+
+    if backend == 'thread':
+        pool = ThreadPoolExecutor(
+            max_workers=jobs, thread_name_prefix='astyle_py'
+        )  # type: Executor
+        func = thread_format_file
+    else:
+        # Use 'spawn' rather than 'fork': the parent process may already have
+        # wasmtime runtime threads, which don't survive forking.
+        pool = ProcessPoolExecutor(
+            max_workers=jobs,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_worker_init,
+            initargs=(
+                instances.default_version,
+                cache.cache_dir if cache else None,
+                instances.timeout,
+                instances.stats,
+            ),
+        )
+        func = _worker_format_file
+    try:
+        pending = collections.deque()  # type: typing.Deque
+        for file_item in items:
+            pending.append(
+                pool.submit(func, file_item, fix_formatting, lines_for(file_item))
+            )
+            if len(pending) >= jobs * JOBS_QUEUE_FACTOR:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        for thread_cache in thread_caches:
+            thread_cache.close()
@@ -0,0 +1,298 @@
+# SPDX-FileCopyrightText: 2026 Ivan Grokhotkov <ivan@igrr.me>
+# SPDX-License-Identifier: MIT
+"""
+Formatting daemon: keeps Astyle instances warm and serves requests over a Unix domain socket.
+
+Each message, in both directions, is a 4-byte big-endian length followed by a JSON object.
+Requests: {"op": "format" | "check" | "version", "version": <astyle version>,
+"options": <options string>, "source": <source>, "bytes": <bool>,
+"timeout": <time limit in seconds, or null>}.
+With "bytes": true, the source and the result are byte strings, decoded as UTF-8
+with the 'surrogateescape' error handler to be sent as JSON.
+Responses: {"result": <formatted source>}, {"changed": <bool>, "line": <first changed line>} or
+{"result": <astyle version>, "astyle_py": <astyle_py version>} on success,
+{"error": <message>, "type": "AstyleError" | "AstyleTimeout" | "ValueError"} on failure.
+"""
+import json
+import os
+import signal
+import socket
+import socketserver
+import struct
+import sys
+import tempfile
+import threading
+import typing
+from concurrent.futures import ThreadPoolExecutor
+
+from .errors import AstyleError, AstyleTimeout
+from .version import __version__
+
+# astyle_wrapper imports wasmtime, which the clients don't need
+if typing.TYPE_CHECKING:
+    from .astyle_wrapper import Astyle
+
+HEADER = struct.Struct('>I')
+
+# Heap size past which the instances of the server restore their heap from a snapshot,
+# see Astyle.memory_limit
+SERVER_MEMORY_LIMIT = 8 * 1024 * 1024
+
+
+def unix_sockets_supported() -> bool:
+    return hasattr(socket, 'AF_UNIX') and hasattr(socketserver, 'UnixStreamServer')
+
+
+def default_socket_path() -> str:
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return os.path.join(runtime_dir, 'astyle_py.sock')
+    uid = os.getuid() if hasattr(os, 'getuid') else 0
+    return os.path.join(tempfile.gettempdir(), 'astyle_py-{}.sock'.format(uid))
+
+
+def _recv_exact(sock: socket.socket, n: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise ConnectionError('Connection closed')
+        buf += chunk
+    return bytes(buf)
+
+
+def send_message(sock: socket.socket, msg: dict) -> None:
+    data = json.dumps(msg).encode('utf-8')
+    sock.sendall(HEADER.pack(len(data)) + data)
+
+
+def recv_message(sock: socket.socket) -> dict:
+    (length,) = HEADER.unpack(_recv_exact(sock, HEADER.size))
+    return json.loads(_recv_exact(sock, length).decode('utf-8'))
+
+
+class AstyleServer:
+    """
+    Serves format and check requests, with one lazily created Astyle instance per version.
+    Requests from all connections are handled one at a time, by a single worker thread:
+    an Astyle object instantiates the WASM module once per calling thread, so running
+    the requests in the thread of each connection would instantiate it again for every
+    connection.
+    """
+
+    def __init__(self, socket_path: str):
+        if not unix_sockets_supported():
+            raise ValueError('--serve is not supported on this platform')
+        self.socket_path = socket_path
+        self._instances = {}  # type: typing.Dict[str, Astyle]
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+        if os.path.exists(socket_path):
+            sock = connect(socket_path)
+            if sock is not None:
+                sock.close()
+                raise ValueError('Server is already running at {}'.format(socket_path))
+            os.unlink(socket_path)
+
+        server = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                while True:
+                    try:
+                        request = recv_message(self.request)
+                    except (ConnectionError, ValueError):
+                        return
+                    send_message(self.request, server.handle_request(request))
+
+        self._server = socketserver.ThreadingUnixStreamServer(  # type: ignore
+            socket_path, Handler
+        )
+        self._server.daemon_threads = True
+        os.chmod(socket_path, 0o600)
+
+    def handle_request(self, request: dict) -> dict:
+        return self._executor.submit(self._handle_request, request).result()
+
+    def _handle_request(self, request: dict) -> dict:
+        try:
+            astyle = self._get_instance(request.get('version', ''))
+            op = request.get('op')
+            if op == 'version':
+                return {'result': astyle.version(), 'astyle_py': __version__}
+            if op not in ('format', 'check'):
+                raise ValueError('Unknown request: {}'.format(op))
+            astyle.set_options(request.get('options', ''))
+            astyle.timeout = request.get('timeout')
+            source = request.get('source', '')
+            is_bytes = request.get('bytes', False)
+            if is_bytes:
+                source = source.encode('utf-8', 'surrogateescape')
+            if op == 'check':
+                line = astyle.check(source)
+                return {'changed': line != 0, 'line': line}
+            if is_bytes:
+                result = astyle.format_bytes(source).decode('utf-8', 'surrogateescape')
+            else:
+                result = astyle.format(source)
+            return {'result': result}
+        except (AstyleError, ValueError) as e:
+            return {'error': str(e), 'type': type(e).__name__}
+
+    def _get_instance(self, version: str) -> 'Astyle':
+        from .astyle_wrapper import Astyle
+
+        astyle = self._instances.get(version)
+        if astyle is None:
+            astyle = Astyle(version=version, memory_limit=SERVER_MEMORY_LIMIT)
+            self._instances[version] = astyle
+        return astyle
+
+    def serve_forever(self) -> None:
+        try:
+            self._server.serve_forever()
+        finally:
+            self.close()
+
+    def shutdown(self) -> None:
+        self._server.shutdown()
+
+    def close(self) -> None:
+        self._server.server_close()
+        self._executor.shutdown()
+        try:
+            os.unlink(self.socket_path)
+        except OSError:
+            pass
+
+
+def connect(socket_path: str) -> typing.Optional[socket.socket]:
+    """
+    Connect to the server, if it is running and the socket belongs to the current user.
+    """
+    if not unix_sockets_supported():
+        return None
+    try:
+        if hasattr(os, 'getuid') and os.stat(socket_path).st_uid != os.getuid():
+            return None
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)  # type: ignore
+    except OSError:
+        return None
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+class RemoteAstyle:
+    """
+    Client side of the server, with the same interface as Astyle.
+    Raises ConnectionError if the server can't be used. If the connection is lost later
+    (e.g. the server is stopped), the requests are handled by a local Astyle instance.
+    """
+
+    def __init__(self, sock: socket.socket, version: str):
+        self._sock = sock  # type: typing.Optional[socket.socket]
+        self._version = version
+        self._options = ''
+        self._local = None  # type: typing.Optional[Astyle]
+        self.timeout = None  # type: typing.Optional[float]
+        # Make sure the version is supported, and the server is not an outdated one
+        response = self._request(op='version')
+        if response is None:
+            raise ConnectionError('Connection closed')
+        if response.get('astyle_py') != __version__:
+            raise ConnectionError(
+                'Server runs astyle_py {}'.format(response.get('astyle_py'))
+            )
+
+    def _request(self, **kwargs) -> typing.Optional[dict]:
+        """
+        Return the response of the server, or None if the connection is lost.
+        """
+        if self._sock is None:
+            return None
+        kwargs['version'] = self._version
+        kwargs['timeout'] = self.timeout
+        try:
+            send_message(self._sock, kwargs)
+            response = recv_message(self._sock)
+        except (OSError, ValueError):
+            self.close()
+            return None
+        if 'error' in response:
+            if response.get('type') == 'ValueError':
+                raise ValueError(response['error'])
+            if response.get('type') == 'AstyleTimeout':
+                raise AstyleTimeout(response['error'])
+            raise AstyleError(response['error'])
+        return response
+
+    def _local_astyle(self) -> 'Astyle':
+        if self._local is None:
+            from .astyle_wrapper import Astyle
+
+            self._local = Astyle(version=self._version)
+        self._local.set_options(self._options)
+        self._local.timeout = self.timeout
+        return self._local
+
+    def version(self) -> str:
+        response = self._request(op='version')
+        if response is None:
+            return self._local_astyle().version()
+        return response['result']
+
+    def set_options(self, options: str) -> None:
+        self._options = options
+
+    def format(self, source: str) -> str:
+        response = self._request(op='format', options=self._options, source=source)
+        if response is None:
+            return self._local_astyle().format(source)
+        return response['result']
+
+    def format_bytes(self, source: bytes) -> bytes:
+        response = self._request(
+            op='format',
+            options=self._options,
+            source=source.decode('utf-8', 'surrogateescape'),
+            bytes=True,
+        )
+        if response is None:
+            return self._local_astyle().format_bytes(source)
+        return response['result'].encode('utf-8', 'surrogateescape')
+
+    def check(self, source: typing.Union[str, bytes]) -> int:
+        if isinstance(source, bytes):
+            response = self._request(
+                op='check',
+                options=self._options,
+                source=source.decode('utf-8', 'surrogateescape'),
+                bytes=True,
+            )
+        else:
+            response = self._request(op='check', options=self._options, source=source)
+        if response is None:
+            return self._local_astyle().check(source)
+        return response['line']
+
+    def close(self) -> None:
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+
+def serve(socket_path: str) -> None:
+    server = AstyleServer(socket_path)
+    print('astyle_py server listening on {}'.format(socket_path), file=sys.stderr)
+    # Remove the socket when terminated; shutdown() must be called from another thread
+    signal.signal(
+        signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start()
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
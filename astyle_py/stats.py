@@ -0,0 +1,185 @@
+# SPDX-FileCopyrightText: 2026 Ivan Grokhotkov <ivan@igrr.me>
+# SPDX-License-Identifier: MIT
+"""
+Timing and throughput statistics of a run, reported with --stats and --stats-json.
+"""
+import heapq
+import threading
+import time
+import typing
+from collections import namedtuple
+
+if typing.TYPE_CHECKING:
+    from .astyle_wrapper import CallStats
+
+# Phases of the run, in the order they are reported:
+# files   - finding the files and matching them against the rules
+# read    - reading the files
+# cache   - hashing the files and looking them up in the cache
+# marshal - setting the options, and copying the data to and from the WASM module
+# guest   - formatting in the WASM module
+# write   - writing the formatted files back
+PHASES = ['files', 'read', 'cache', 'marshal', 'guest', 'write']
+
+# Number of the slowest files listed in the report
+STATS_SLOWEST_FILES = 10
+
+# Measurements of one file: its size, the time spent in each phase (in seconds),
+# and the number of calls into the WASM module.
+FileStats = namedtuple('FileStats', ['n_bytes', 'times', 'guest_calls'])
+
+# Totals of the CallStats reported in each thread, see record_call
+_thread_totals = threading.local()
+
+
+def record_call(stats: 'CallStats') -> None:
+    """
+    stats_hook of the Astyle instances used with FileTimer.
+    """
+    guest_time, guest_calls = _guest_totals()
+    _thread_totals.guest_time = guest_time + stats.guest_time
+    _thread_totals.guest_calls = guest_calls + stats.guest_calls
+
+
+def _guest_totals() -> typing.Tuple[float, int]:
+    return (
+        getattr(_thread_totals, 'guest_time', 0.0),
+        getattr(_thread_totals, 'guest_calls', 0),
+    )
+
+
+class FileTimer:
+    """
+    Measures the phases of processing one file in the calling thread. Each call of lap
+    adds the time elapsed since the previous one to the given phase. The time spent
+    in the WASM module is taken from the calls reported to record_call meanwhile,
+    and subtracted from the 'format' phase, the rest of which is marshalling.
+    """
+
+    def __init__(self):
+        self.times = {}  # type: typing.Dict[str, float]
+        self._guest_start = _guest_totals()
+        self._last = time.perf_counter()
+
+    def lap(self, phase: str) -> None:
+        now = time.perf_counter()
+        self.times[phase] = self.times.get(phase, 0.0) + now - self._last
+        self._last = now
+
+    def finish(self, n_bytes: int) -> FileStats:
+        guest_time, guest_calls = _guest_totals()
+        guest_time -= self._guest_start[0]
+        guest_calls -= self._guest_start[1]
+        times = dict(self.times)
+        if 'format' in times:
+            times['marshal'] = max(times.pop('format') - guest_time, 0.0)
+            times['guest'] = guest_time
+        return FileStats(n_bytes, times, guest_calls)
+
+
+class RunStats:
+    """
+    Statistics of a run: the time spent in each phase, the throughput, and the slowest
+    files. With several jobs, the times of the phases which run in the workers are
+    summed over the workers, so they may add up to more than the wall time.
+    """
+
+    def __init__(self, n_slowest: int = STATS_SLOWEST_FILES):
+        self.start = time.perf_counter()
+        self.times = dict.fromkeys(PHASES, 0.0)
+        self.files = 0
+        self.cache_hits = 0
+        self.n_bytes = 0
+        self.guest_calls = 0
+        self._n_slowest = n_slowest
+        # Min-heap of (time, filename, n_bytes) of the slowest files so far
+        self._slowest = []  # type: typing.List[typing.Tuple[float, str, int]]
+
+    def add_time(self, phase: str, seconds: float) -> None:
+        self.times[phase] += seconds
+
+    def timed_iter(
+        self, iterable: typing.Iterable, phase: str
+    ) -> typing.Generator[typing.Any, None, None]:
+        """
+        Yield the items of the iterable, adding the time spent producing them to the phase.
+        """
+        it = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                self.add_time(phase, time.perf_counter() - start)
+                return
+            self.add_time(phase, time.perf_counter() - start)
+            yield item
+
+    def add_file(
+        self, filename: str, stats: typing.Optional[FileStats], cache_hit: bool
+    ) -> None:
+        self.files += 1
+        if cache_hit:
+            self.cache_hits += 1
+        if stats is None:
+            return
+        self.n_bytes += stats.n_bytes
+        self.guest_calls += stats.guest_calls
+        for phase, seconds in stats.times.items():
+            self.times[phase] += seconds
+        entry = (sum(stats.times.values()), filename, stats.n_bytes)
+        if len(self._slowest) < self._n_slowest:
+            heapq.heappush(self._slowest, entry)
+        elif self._slowest and entry > self._slowest[0]:
+            heapq.heapreplace(self._slowest, entry)
+
+    def report(self) -> dict:
+        """
+        Return the statistics as a JSON-serializable dict.
+        """
+        wall_time = time.perf_counter() - self.start
+        return {
+            'wall_time': wall_time,
+            'files': self.files,
+            'cache_hits': self.cache_hits,
+            'bytes': self.n_bytes,
+            'files_per_second': self.files / wall_time if wall_time else 0.0,
+            'bytes_per_second': self.n_bytes / wall_time if wall_time else 0.0,
+            'guest_calls': self.guest_calls,
+            'phases': dict(self.times),
+            'slowest_files': [
+                {'filename': filename, 'time': seconds, 'bytes': n_bytes}
+                for seconds, filename, n_bytes in sorted(self._slowest, reverse=True)
+            ],
+        }
+
+    @staticmethod
+    def format_report(report: dict) -> str:
+        """
+        Format the dict returned by report() for printing.
+        """
+        lines = [
+            'Stats: {} files ({} cache hits), {} bytes in {:.3f}s: '
+            '{:.1f} files/s, {:.1f} kB/s, {} guest calls'.format(
+                report['files'],
+                report['cache_hits'],
+                report['bytes'],
+                report['wall_time'],
+                report['files_per_second'],
+                report['bytes_per_second'] / 1024,
+                report['guest_calls'],
+            )
+        ]
+        lines += [
+            '  {:<8} {:8.3f}s'.format(phase, seconds)
+            for phase, seconds in report['phases'].items()
+        ]
+        if report['slowest_files']:
+            lines.append('Slowest files:')
+            lines += [
+                '  {:8.3f}s {:>10} bytes  {}'.format(
+                    entry['time'], entry['bytes'], entry['filename']
+                )
+                for entry in report['slowest_files']
+            ]
+        return '\n'.join(lines)
@@ -1,7 +1,12 @@
 # SPDX-FileCopyrightText: 2022 Ivan Grokhotkov <ivan@igrr.me>
 # SPDX-License-Identifier: MIT
+import os
+import sys
 import typing
 
+# Regex which '**/' in a pattern is converted to
+ANY_DIRS_REGEX = '(?:.*/)?'
+
 
 def get_lines_from_file(fname: str) -> typing.List[str]:
     with open(fname) as f:
@@ -12,6 +17,33 @@ def get_lines_from_file(fname: str) -> typing.List[str]:
         ]
 
 
+def iterate_file_list(
+    fname: str, null_delimited: bool = False, chunk_size: int = 64 * 1024
+) -> typing.Generator[str, None, None]:
+    """
+    Lazily read the list of file names from a file ('-' for stdin), one name per line,
+    or separated by NUL characters if null_delimited is set. Empty names are skipped.
+    """
+    sep = b'\x00' if null_delimited else b'\n'
+    f = sys.stdin.buffer if fname == '-' else open(fname, 'rb')
+    try:
+        rest = b''
+        while True:
+            chunk = f.read(chunk_size)
+            names = (rest + chunk).split(sep)
+            rest = names.pop() if chunk else b''
+            for name in names:
+                if not null_delimited:
+                    name = name.rstrip(b'\r')
+                if name:
+                    yield os.fsdecode(name)
+            if not chunk:
+                break
+    finally:
+        if f is not sys.stdin.buffer:
+            f.close()
+
+
 def pattern_to_regex(pattern: str) -> str:
     """
     Convert the CODEOWNERS-style path pattern into a regular expression string
@@ -43,7 +75,7 @@ def pattern_to_regex(pattern: str) -> str:
 
     # then into the final regex pattern:
     re_pattern = (
-        pattern.replace(':REGLOB:', '(?:.*/)?')
+        pattern.replace(':REGLOB:', ANY_DIRS_REGEX)
         .replace(':GLOB:', '[^/]*')
         .replace(':DOT:', '[.]')
         .replace(':ANY:', '.')
@@ -0,0 +1,106 @@
+# SPDX-FileCopyrightText: 2026 Ivan Grokhotkov <ivan@igrr.me>
+# SPDX-License-Identifier: MIT
+import difflib
+import os
+import re
+import subprocess
+import typing
+
+# Range of line numbers, 1-based, end exclusive
+LineRange = typing.Tuple[int, int]
+
+_HUNK_RE = re.compile(r'^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@')
+
+
+def _git(args: typing.List[str]) -> str:
+    try:
+        res = subprocess.run(
+            ['git'] + args, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+    except OSError as e:
+        raise ValueError('Failed to run git: {}'.format(e))
+    if res.returncode != 0:
+        raise ValueError(
+            'git {} failed: {}'.format(
+                ' '.join(args), res.stderr.decode('utf-8', 'replace').strip()
+            )
+        )
+    return os.fsdecode(res.stdout)
+
+
+def git_changed_files(rev: str) -> typing.List[str]:
+    """
+    Return the files in the working tree which differ from the given revision,
+    relative to the current directory. Deleted files aren't included.
+    """
+    out = _git(
+        ['diff', '--name-only', '-z', '--relative', '--diff-filter=d', rev, '--']
+    )
+    return [os.path.normpath(name) for name in out.split('\0') if name]
+
+
+def git_changed_lines(rev: str) -> typing.Dict[str, typing.List[LineRange]]:
+    """
+    Return the ranges of lines changed in the working tree since the given revision,
+    for each changed file (relative to the current directory). Where lines were only
+    deleted, the range covers the lines around the deletion.
+    """
+    out = _git(
+        [
+            '-c',
+            'core.quotepath=off',
+            'diff',
+            '-U0',
+            '--relative',
+            '--no-color',
+            '--no-ext-diff',
+            '--src-prefix=a/',
+            '--dst-prefix=b/',
+            rev,
+            '--',
+        ]
+    )
+    result = {}  # type: typing.Dict[str, typing.List[LineRange]]
+    ranges = None  # type: typing.Optional[typing.List[LineRange]]
+    for line in out.splitlines():
+        if line.startswith('+++ '):
+            path = line[4:]
+            if path.startswith('b/'):
+                ranges = result.setdefault(os.path.normpath(path[2:]), [])
+            else:
+                ranges = None  # /dev/null, the file was deleted
+            continue
+        m = _HUNK_RE.match(line)
+        if m and ranges is not None:
+            start = int(m.group(1))
+            count = int(m.group(2)) if m.group(2) is not None else 1
+            if count == 0:
+                # lines were deleted after line 'start'
+                ranges.append((max(start, 1), start + 2))
+            else:
+                ranges.append((start, start + count))
+    return result
+
+
+def formatting_changes_lines(
+    original: typing.AnyStr,
+    formatted: typing.AnyStr,
+    line_ranges: typing.List[LineRange],
+) -> bool:
+    """
+    Whether the difference between the original and the formatted source touches
+    any of the given ranges of lines of the original source.
+    """
+    if not line_ranges:
+        return False
+    matcher = difflib.SequenceMatcher(
+        None, original.splitlines(True), formatted.splitlines(True), autojunk=False
+    )
+    for tag, i1, i2, _, _ in matcher.get_opcodes():
+        if tag == 'equal':
+            continue
+        # 1-based line numbers; an insertion touches the line it is inserted before
+        start, end = i1 + 1, max(i2, i1 + 1) + 1
+        if any(start < r_end and r_start < end for r_start, r_end in line_ranges):
+            return True
+    return False
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# SPDX-FileCopyrightText: 2026 Ivan Grokhotkov <ivan@igrr.me>
+# SPDX-License-Identifier: MIT
+"""
+Compare formatting many small sources with one call per source (format_bytes)
+and with batched calls (format_batch). Batching only reduces the number of calls
+into the WASM module if it exports AStyleBatch, otherwise format_batch falls back
+to one call per source.
+"""
+import argparse
+import time
+
+from astyle_py import Astyle
+
+SOURCE = b'#pragma once\nint foo(int a, int b);\nstruct s { int x; };\n'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--version', default='3.4.7')
+    parser.add_argument('--sources', type=int, default=5000)
+    parser.add_argument('--batch-size', type=int, default=64)
+    args = parser.parse_args()
+
+    astyle = Astyle(version=args.version)
+    astyle.set_options('--style=otbs')
+    sources = [SOURCE] * args.sources
+    print('AStyleBatch exported: {}'.format(astyle._instance()._has_batch))
+
+    def per_file():
+        return [astyle.format_bytes(s) for s in sources]
+
+    def batched():
+        res = []
+        for i in range(0, len(sources), args.batch_size):
+            end = i + args.batch_size
+            batch = sources[i:end]
+            res += [r.formatted for r in astyle.format_batch(batch)]
+        return res
+
+    results = []
+    for name, func in [('per file', per_file), ('batched', batched)]:
+        t = time.perf_counter()
+        results.append(func())
+        elapsed = time.perf_counter() - t
+        print(
+            '{:>10}: {:8.3f}s, {:8.1f}us per source'.format(
+                name, elapsed, elapsed / len(sources) * 1e6
+            )
+        )
+    assert results[0] == results[1]
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# SPDX-FileCopyrightText: 2026 Ivan Grokhotkov <ivan@igrr.me>
+# SPDX-License-Identifier: MIT
+"""
+Compare the latency of checking one file with a cold CLI invocation, with a CLI
+invocation which uses the server (astyle_py --serve), and with a bare request
+sent to the server from an already running process.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from astyle_py.server import RemoteAstyle, connect, unix_sockets_supported
+
+SOURCE = 'int main(int argc, char** argv) {\n  return 0;\n}\n' * 50
+
+
+def median_time(func, repeat):
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t)
+    times.sort()
+    return times[len(times) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    if not unix_sockets_supported():
+        print('Unix domain sockets are not supported on this platform')
+        return
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        src_file = os.path.join(tmpdir, 'file.c')
+        with open(src_file, 'w') as f:
+            f.write(SOURCE)
+        socket_path = os.path.join(tmpdir, 'astyle_py.sock')
+        cli = [sys.executable, '-m', 'astyle_py', f'--socket={socket_path}']
+        cli_args = ['--dry-run', '--quiet', '--no-cache', '--style=otbs', src_file]
+
+        def cold_cli():
+            subprocess.run(cli + ['--no-daemon'] + cli_args)
+
+        def server_cli():
+            subprocess.run(cli + cli_args)
+
+        server = subprocess.Popen(cli + ['--serve'], stderr=subprocess.DEVNULL)
+        try:
+            while not os.path.exists(socket_path):
+                time.sleep(0.01)
+            sock = connect(socket_path)
+            assert sock is not None
+            client = RemoteAstyle(sock, '3.1')
+            client.set_options('--style=otbs')
+
+            def round_trip():
+                client.check(SOURCE)
+
+            results = [
+                ('cold CLI', median_time(cold_cli, args.repeat)),
+                ('CLI with server', median_time(server_cli, args.repeat)),
+                ('server round-trip', median_time(round_trip, args.repeat * 10)),
+            ]
+            client.close()
+        finally:
+            server.terminate()
+            server.wait()
+
+    for name, t in results:
+        print('{:>20}: {:8.2f}ms'.format(name, t * 1e3))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# SPDX-FileCopyrightText: 2026 Ivan Grokhotkov <ivan@igrr.me>
+# SPDX-License-Identifier: MIT
+"""
+Measure the number of calls into the WASM module per formatted source, and the time
+per source for small sources, where the cost of these calls dominates.
+"""
+import argparse
+import time
+
+from astyle_py.astyle_wrapper import Astyle
+
+SOURCE = b'#pragma once\nint foo(int a, int b);\n'
+
+
+def measure(n: int):
+    astyle = Astyle()
+    astyle.set_options('--style=otbs')
+    astyle.format_bytes(SOURCE)
+    calls = astyle.context.guest_calls
+    t = time.perf_counter()
+    for _ in range(n):
+        astyle.format_bytes(SOURCE)
+    elapsed = time.perf_counter() - t
+    return elapsed / n, (astyle.context.guest_calls - calls) / n
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sources', type=int, default=5000)
+    args = parser.parse_args()
+
+    per_source, calls = measure(args.sources)
+    print(
+        '{:.1f}us per source, {:.1f} guest calls per source'.format(
+            per_source * 1e6, calls
+        )
+    )
+
+
+if __name__ == '__main__':
+    main()
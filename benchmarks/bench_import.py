@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# SPDX-FileCopyrightText: 2026 Ivan Grokhotkov <ivan@igrr.me>
+# SPDX-License-Identifier: MIT
+"""
+Measure the wall time of trivial invocations, each in a fresh interpreter: importing
+the package, 'astyle_py --version' and 'astyle_py' without files. None of these should
+import wasmtime or PyYAML, nor load a WASM module. With --max-ms, exits with a non-zero
+code if the median time of any of them exceeds the given number of milliseconds, to be
+used as a regression check.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+CASES = [
+    ('python (baseline)', ['-c', 'pass']),
+    ('import astyle_py', ['-c', 'import astyle_py']),
+    ('astyle_py --version', ['-m', 'astyle_py', '--version']),
+    ('astyle_py (no files)', ['-m', 'astyle_py']),
+]
+
+
+def measure(args, count: int, env) -> float:
+    times = []
+    for _ in range(count):
+        t = time.perf_counter()
+        subprocess.run(
+            [sys.executable] + args,
+            check=True,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        times.append(time.perf_counter() - t)
+    times.sort()
+    return times[len(times) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=20)
+    parser.add_argument('--max-ms', type=float, default=None)
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    with tempfile.TemporaryDirectory() as tmp:
+        # don't connect to a running server
+        env['XDG_RUNTIME_DIR'] = tmp
+        failed = False
+        for name, case_args in CASES:
+            median = measure(case_args, args.count, env) * 1e3
+            slow = args.max_ms is not None and median > args.max_ms
+            failed = failed or slow
+            print(
+                '{:>22}: {:8.1f}ms{}'.format(
+                    name, median, ' (too slow)' if slow else ''
+                )
+            )
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
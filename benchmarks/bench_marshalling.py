@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# SPDX-FileCopyrightText: 2026 Ivan Grokhotkov <ivan@igrr.me>
+# SPDX-License-Identifier: MIT
+"""
+Measure the cost of copying strings between Python and WASM linear memory,
+as a function of the string size. Astyle itself is not called.
+"""
+import argparse
+import timeit
+
+from astyle_py import Astyle
+from astyle_py.astyle_wrapper import WasmString
+
+SIZES = [1024, 16 * 1024, 64 * 1024, 300 * 1024, 1024 * 1024]
+
+
+def bench_size(astyle: Astyle, size: int, repeat: int):
+    ctx = astyle.context
+    source = ('x' * 79 + '\n') * (size // 80)
+
+    def to_wasm():
+        WasmString.from_str(ctx, source)
+
+    ptr = WasmString.from_str(ctx, source)
+
+    def from_wasm():
+        # Not owned by the returned object, prevent a double free
+        s = WasmString.from_addr(ctx, ptr.addr)
+        s._addr = 0
+
+    t_to = min(timeit.repeat(to_wasm, number=1, repeat=repeat))
+    t_from = min(timeit.repeat(from_wasm, number=1, repeat=repeat))
+    return t_to, t_from
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    astyle = Astyle()
+    print('{:>10} {:>12} {:>12} {:>10}'.format('size', 'to wasm', 'from wasm', 'MB/s'))
+    for size in SIZES:
+        t_to, t_from = bench_size(astyle, size, args.repeat)
+        mbps = 2 * size / (t_to + t_from) / 1e6
+        print(
+            '{:>10} {:>10.3f}ms {:>10.3f}ms {:>10.1f}'.format(
+                size, t_to * 1e3, t_from * 1e3, mbps
+            )
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# SPDX-FileCopyrightText: 2026 Ivan Grokhotkov <ivan@igrr.me>
+# SPDX-License-Identifier: MIT
+"""
+Compare rule matching with one combined regular expression (RulesMatcher)
+against matching every rule separately, on synthetic rules and file lists.
+"""
+import argparse
+import random
+import re
+import time
+
+from astyle_py.files_iter import (
+    Rule,
+    RulesMatcher,
+    file_matches_patterns,
+    path_for_matching,
+)
+from astyle_py.utils import pattern_to_regex
+
+
+def make_rules(n_rules: int, rnd: random.Random):
+    rules = []
+    for i in range(n_rules):
+        kind = rnd.randrange(3)
+        if kind == 0:
+            pattern = '/components/comp_{}/'.format(i)
+        elif kind == 1:
+            pattern = 'test_{}/'.format(i)
+        else:
+            pattern = '/components/comp_{}/**/*_{}.c'.format(rnd.randrange(n_rules), i)
+        rules.append(
+            Rule(
+                check=rnd.random() > 0.2,
+                include=[re.compile(pattern_to_regex(pattern))],
+                options=[],
+            )
+        )
+    return rules
+
+
+def make_files(n_files: int, n_rules: int, rnd: random.Random):
+    files = []
+    for i in range(n_files):
+        parts = ['components', 'comp_{}'.format(rnd.randrange(n_rules))]
+        parts += ['dir_{}'.format(rnd.randrange(10)) for _ in range(rnd.randrange(4))]
+        if rnd.random() < 0.1:
+            parts.append('test_{}'.format(rnd.randrange(n_rules)))
+        parts.append('file_{}.c'.format(i))
+        files.append('/'.join(parts))
+    return files
+
+
+def linear(files, rules):
+    res = []
+    for fname in files:
+        selected = None
+        for idx, rule in enumerate(rules):
+            if file_matches_patterns(fname, rule.include):
+                selected = idx
+        res.append(selected)
+    return res
+
+
+def combined(files, rules):
+    matcher = RulesMatcher(rules)
+    return [matcher.match(path_for_matching(fname)) for fname in files]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rules', type=int, default=200)
+    parser.add_argument('--files', type=int, default=40000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    rules = make_rules(args.rules, rnd)
+    files = make_files(args.files, args.rules, rnd)
+
+    results = []
+    for name, func in [('linear', linear), ('combined', combined)]:
+        t = time.perf_counter()
+        results.append(func(files, rules))
+        elapsed = time.perf_counter() - t
+        print(
+            '{:>10}: {:8.3f}s, {:8.1f}us per file'.format(
+                name, elapsed, elapsed / len(files) * 1e6
+            )
+        )
+    assert results[0] == results[1]
+
+
+if __name__ == '__main__':
+    main()
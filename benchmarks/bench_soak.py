@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# SPDX-FileCopyrightText: 2026 Ivan Grokhotkov <ivan@igrr.me>
+# SPDX-License-Identifier: MIT
+"""
+Format many sources of varying sizes with one long-lived Astyle instance, and report
+the resident set size of the process and the highest address of the heap in the linear
+memory as the iterations go, with and without a memory limit (see Astyle.memory_limit).
+"""
+import argparse
+import random
+import time
+
+from memory import rss_kb
+
+from astyle_py import Astyle
+
+LINE = 'int main() { if (x) { return %d; } }\n'
+
+
+def soak(memory_limit, iterations: int, report_every: int, max_lines: int) -> None:
+    astyle = Astyle(memory_limit=memory_limit)
+    astyle.set_options('--style=otbs')
+    rng = random.Random(0)
+    t = time.perf_counter()
+    for i in range(1, iterations + 1):
+        source = LINE % i * rng.randint(1, max_lines)
+        astyle.format_bytes(source.encode())
+        if i % report_every == 0:
+            print(
+                '{:>10} {:>10}: RSS {:8d} kB, heap top {:8d} kB, recycled {:5d}, {:.1f}s'.format(
+                    str(memory_limit),
+                    i,
+                    rss_kb(),
+                    astyle._instance()._heap_top // 1024,
+                    astyle.recycled,
+                    time.perf_counter() - t,
+                )
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--report-every', type=int, default=500)
+    parser.add_argument('--max-lines', type=int, default=300)
+    parser.add_argument('--memory-limit', type=int, default=256 * 1024)
+    args = parser.parse_args()
+
+    for memory_limit in [None, args.memory_limit]:
+        soak(memory_limit, args.iterations, args.report_every, args.max_lines)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# SPDX-FileCopyrightText: 2026 Ivan Grokhotkov <ivan@igrr.me>
+# SPDX-License-Identifier: MIT
+"""
+Measure Astyle() construction latency: the first construction for each version
+(which loads the module) and the subsequent ones (which reuse it).
+Each version is measured in a fresh interpreter.
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+from astyle_py.astyle_versions import ASTYLE_SUPPORTED_VERSIONS
+
+CHILD_CODE = '''
+import json, sys, time
+from astyle_py import Astyle
+
+def main(version, count):
+    t = time.perf_counter()
+    Astyle(version=version)
+    first = time.perf_counter() - t
+    times = []
+    for _ in range(count):
+        t = time.perf_counter()
+        Astyle(version=version)
+        times.append(time.perf_counter() - t)
+    times.sort()
+    print(json.dumps({'first': first, 'median': times[len(times) // 2]}))
+
+main(sys.argv[1], int(sys.argv[2]))
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=20)
+    args = parser.parse_args()
+
+    print('{:>8} {:>12} {:>12}'.format('version', 'first', 'subsequent'))
+    for version in sorted(ASTYLE_SUPPORTED_VERSIONS):
+        out = subprocess.check_output(
+            [sys.executable, '-c', CHILD_CODE, version, str(args.count)]
+        )
+        res = json.loads(out)
+        print(
+            '{:>8} {:>10.2f}ms {:>10.2f}ms'.format(
+                version, res['first'] * 1e3, res['median'] * 1e3
+            )
+        )
+
+
+if __name__ == '__main__':
+    main()
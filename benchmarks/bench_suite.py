@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# SPDX-FileCopyrightText: 2026 Ivan Grokhotkov <ivan@igrr.me>
+# SPDX-License-Identifier: MIT
+"""
+Benchmark suite. Generates the synthetic corpus (see corpus.py) and measures, for each
+bundled astyle version: the Astyle() construction latency, the latency of formatting
+one source of each of several sizes, and the throughput and peak RSS of the CLI on the
+whole corpus. Each measurement runs in a fresh interpreter. The results are written
+to a JSON file; with --compare, the metrics which got worse than in an earlier results
+file by more than --threshold are reported, and the exit code is non-zero.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import typing
+
+from corpus import RULES_FILE, generate_corpus, make_source
+from memory import max_rss_kb
+
+from astyle_py import __version__
+from astyle_py.astyle_versions import ASTYLE_SUPPORTED_VERSIONS
+
+# Version of the layout of the results file
+RESULTS_FORMAT = 1
+
+# Sizes of the sources formatted one at a time, in bytes
+SOURCE_SIZES = [1024, 16 * 1024, 256 * 1024, 1024 * 1024]
+
+# Throughput metrics get better as they grow, all the others as they shrink
+HIGHER_IS_BETTER_SUFFIX = '_per_s'
+
+
+def _median(values: typing.List[float]) -> float:
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def measure_api(version: str, count: int) -> dict:
+    """
+    Runs in the child process: constructor latency and format latency by size.
+    """
+    from astyle_py import Astyle
+
+    t = time.perf_counter()
+    astyle = Astyle(version=version)
+    first = time.perf_counter() - t
+    times = []
+    for _ in range(count):
+        t = time.perf_counter()
+        Astyle(version=version)
+        times.append(time.perf_counter() - t)
+
+    astyle.set_options('--style=otbs --indent=spaces=4')
+    format_ms = {}
+    for size in SOURCE_SIZES:
+        source = make_source(random.Random(size), size).encode()
+        astyle.format_bytes(source)
+        # Fewer repetitions for the larger sources, which take longer anyway
+        repeat = max(3, count * SOURCE_SIZES[0] // size)
+        size_times = []
+        for _ in range(repeat):
+            t = time.perf_counter()
+            astyle.format_bytes(source)
+            size_times.append(time.perf_counter() - t)
+        format_ms[str(size)] = _median(size_times) * 1e3
+
+    return {
+        'constructor': {
+            'first_ms': first * 1e3,
+            'median_ms': _median(times) * 1e3,
+        },
+        'format_ms_by_size': format_ms,
+        'peak_rss_kb': max_rss_kb(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss),
+    }
+
+
+def measure_cli(
+    version: str, corpus_dir: str, corpus: dict, jobs: int, repeat: int, env
+) -> dict:
+    args = [
+        sys.executable,
+        '-m',
+        'astyle_py',
+        '--no-daemon',
+        '--no-cache',
+        '--dry-run',
+        '--quiet',
+        '--jobs={}'.format(jobs),
+        '--astyle-version={}'.format(version),
+        '--rules={}'.format(RULES_FILE),
+        '.',
+    ]
+    times = []
+    peak_rss = 0
+    for _ in range(repeat):
+        t = time.perf_counter()
+        proc = subprocess.Popen(args, cwd=corpus_dir, env=env)
+        # wait4 reports the resources used by this child alone
+        _, status, rusage = os.wait4(proc.pid, 0)
+        times.append(time.perf_counter() - t)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        # 1 means that some files aren't formatted, which is expected
+        if proc.returncode not in (0, 1):
+            raise SystemExit('astyle_py exited with code {}'.format(proc.returncode))
+        peak_rss = max(peak_rss, max_rss_kb(rusage.ru_maxrss))
+    wall = _median(times)
+    return {
+        'wall_s': wall,
+        'files_per_s': corpus['files'] / wall,
+        'bytes_per_s': corpus['bytes'] / wall,
+        'peak_rss_kb': peak_rss,
+    }
+
+
+def flatten(results: dict, prefix: str = '') -> typing.Dict[str, float]:
+    flat = {}
+    for key, value in results.items():
+        name = prefix + key
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + '.'))
+        else:
+            flat[name] = value
+    return flat
+
+
+def compare(
+    results: dict, baseline: dict, threshold: float
+) -> typing.List[typing.Tuple[str, float, float]]:
+    """
+    Return the metrics which regressed by more than threshold (a fraction),
+    with their baseline and current values.
+    """
+    current = flatten(results['results'])
+    regressions = []
+    for name, old in flatten(baseline['results']).items():
+        new = current.get(name)
+        if new is None or not old:
+            continue
+        change = (new - old) / old
+        if name.endswith(HIGHER_IS_BETTER_SUFFIX):
+            change = -change
+        if change > threshold:
+            regressions.append((name, old, new))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument(
+        '--version',
+        action='append',
+        choices=ASTYLE_SUPPORTED_VERSIONS,
+        help='astyle version to measure, may be repeated (default: all of them)',
+    )
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--scale', type=float, default=0.5)
+    parser.add_argument('--count', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--jobs', type=int, default=1)
+    parser.add_argument('--compare', metavar='BASELINE_JSON')
+    parser.add_argument('--threshold', type=float, default=0.2)
+    parser.add_argument('--child-api', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child_api:
+        print(json.dumps(measure_api(args.child_api, args.count)))
+        return
+
+    versions = sorted(args.version or ASTYLE_SUPPORTED_VERSIONS)
+    env = dict(os.environ)
+    results = {}  # type: typing.Dict[str, typing.Any]
+    with tempfile.TemporaryDirectory() as tmp:
+        # don't connect to a running server
+        env['XDG_RUNTIME_DIR'] = tmp
+        corpus_dir = os.path.join(tmp, 'corpus')
+        corpus = generate_corpus(corpus_dir, args.seed, args.scale)
+        print('Corpus: {files} files, {bytes} bytes'.format(**corpus))
+        for version in versions:
+            out = subprocess.check_output(
+                [
+                    sys.executable,
+                    __file__,
+                    '--child-api',
+                    version,
+                    '--count',
+                    str(args.count),
+                ],
+                env=env,
+            )
+            res = json.loads(out)
+            res['cli'] = measure_cli(
+                version, corpus_dir, corpus, args.jobs, args.repeat, env
+            )
+            results[version] = res
+            print(
+                '{:>8}: constructor {:.2f}ms (first {:.2f}ms), format {}, '
+                'CLI {:.1f} files/s, {:.0f} kB/s, peak RSS {} kB'.format(
+                    version,
+                    res['constructor']['median_ms'],
+                    res['constructor']['first_ms'],
+                    ', '.join(
+                        '{}B {:.2f}ms'.format(size, ms)
+                        for size, ms in res['format_ms_by_size'].items()
+                    ),
+                    res['cli']['files_per_s'],
+                    res['cli']['bytes_per_s'] / 1024,
+                    res['cli']['peak_rss_kb'],
+                )
+            )
+
+    report = {
+        'format': RESULTS_FORMAT,
+        'astyle_py': __version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'scale': args.scale,
+        'jobs': args.jobs,
+        'corpus': corpus,
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('Results written to {}'.format(args.output))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if (baseline.get('seed'), baseline.get('scale')) != (args.seed, args.scale):
+            print('Warning: the baseline was measured on a different corpus')
+        regressions = compare(report, baseline, args.threshold)
+        for name, old, new in regressions:
+            print('Regression: {}: {:.4g} -> {:.4g}'.format(name, old, new))
+        if regressions:
+            raise SystemExit(1)
+        print('No regressions over {:.0%}'.format(args.threshold))
+
+
+if __name__ == '__main__':
+    main()
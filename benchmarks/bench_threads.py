@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# SPDX-FileCopyrightText: 2026 Ivan Grokhotkov <ivan@igrr.me>
+# SPDX-License-Identifier: MIT
+"""
+Compare the 'process' and 'thread' backends of --jobs: the time to format a set of
+generated files with 1, 2 and 4 workers, and the memory used (the resident set size
+of this process plus the peak one of the worker processes). The thread backend only
+scales on a free-threaded Python build, see runner.default_jobs_backend.
+"""
+import argparse
+import os
+import resource
+import tempfile
+import time
+
+from memory import max_rss_kb, rss_kb
+
+from astyle_py.files_iter import FileItem
+from astyle_py.runner import AstyleInstances, default_jobs_backend, format_files
+
+LINE = 'int main() { if (x) { return %d; } }\n'
+
+
+def children_peak_rss_kb() -> int:
+    return max_rss_kb(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, default=200)
+    parser.add_argument('--lines', type=int, default=200)
+    parser.add_argument('--backend', choices=['process', 'thread'], action='append')
+    args = parser.parse_args()
+    backends = args.backend or ['process', 'thread']
+    print('Default backend: {}'.format(default_jobs_backend()))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        file_items = []
+        for i in range(args.files):
+            name = os.path.join(tmp, 'f{}.c'.format(i))
+            with open(name, 'w') as f:
+                f.write(LINE % i * args.lines)
+            file_items.append(FileItem(name, ['--style=otbs']))
+
+        for backend in backends:
+            for jobs in (1, 2, 4):
+                instances = AstyleInstances('3.1')
+                instances.get('3.1')
+                t = time.perf_counter()
+                results = list(
+                    format_files(instances, file_items, False, jobs, backend=backend)
+                )
+                elapsed = time.perf_counter() - t
+                assert all(r.changed for r in results)
+                print(
+                    '{:>8} jobs={}: {:7.3f}s, rss {:7d} kB, worker processes peak {:7d} kB'.format(
+                        backend, jobs, elapsed, rss_kb(), children_peak_rss_kb()
+                    )
+                )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# SPDX-FileCopyrightText: 2026 Ivan Grokhotkov <ivan@igrr.me>
+# SPDX-License-Identifier: MIT
+"""
+Generate a deterministic synthetic C/C++ corpus for the benchmarks: many small headers,
+a few huge generated sources, and a deep directory tree covered by a rules file.
+The same seed and scale always produce the same files, byte for byte.
+"""
+import argparse
+import os
+import random
+import typing
+
+RULES_FILE = 'rules.yml'
+
+RULES = '''\
+DEFAULT:
+    options: "--style=otbs --indent=spaces=4 --convert-tabs"
+
+tree_linux:
+    options: "--style=linux --indent=tab"
+    include:
+        - "/tree/d0_1/"
+
+tree_allman:
+    options: "--style=allman --pad-oper"
+    include:
+        - "/tree/**/d3_0/"
+
+tree_ignored:
+    check: false
+    include:
+        - "/tree/d0_2/d1_2/"
+'''
+
+TYPES = ['int', 'unsigned', 'size_t', 'char *', 'const char *', 'float', 'uint32_t']
+
+
+def _ident(rnd: random.Random, prefix: str) -> str:
+    return '{}_{}'.format(prefix, rnd.randrange(1 << 20))
+
+
+def make_function(rnd: random.Random, cpp: bool = False) -> str:
+    """
+    One function with a body of nested statements, deliberately formatted
+    in a compact style which the formatting options above change.
+    """
+    name = _ident(rnd, 'func')
+    params = ', '.join(
+        '{} {}'.format(rnd.choice(TYPES), _ident(rnd, 'arg'))
+        for _ in range(rnd.randrange(4))
+    )
+    lines = ['{} {}({}) {{'.format(rnd.choice(TYPES), name, params or 'void')]
+    for _ in range(rnd.randrange(2, 8)):
+        var = _ident(rnd, 'v')
+        kind = rnd.randrange(4)
+        if kind == 0:
+            lines.append('  int {}={};'.format(var, rnd.randrange(1000)))
+        elif kind == 1:
+            lines.append(
+                'if({} > {}){{ {}(); }} else {{ return {}; }}'.format(
+                    var, rnd.randrange(100), _ident(rnd, 'call'), rnd.randrange(10)
+                )
+            )
+        elif kind == 2:
+            lines.append(
+                '\tfor(int i=0;i<{};i++){{\n{}+=i*{};\n\t}}'.format(
+                    rnd.randrange(100), var, rnd.randrange(10)
+                )
+            )
+        elif cpp:
+            lines.append(
+                'auto {} = [&](int x){{return x+{};}};'.format(var, rnd.randrange(10))
+            )
+        else:
+            lines.append(
+                'switch({}) {{ case 1: break; default: {}(); }}'.format(
+                    var, _ident(rnd, 'call')
+                )
+            )
+    lines.append('  return 0;\n}\n')
+    return '\n'.join(lines)
+
+
+def make_header(rnd: random.Random) -> str:
+    guard = _ident(rnd, 'GUARD').upper()
+    parts = ['#pragma once\n#ifndef {0}\n#define {0}\n'.format(guard)]
+    for _ in range(rnd.randrange(2, 8)):
+        fields = ''.join(
+            '  {} {};\n'.format(rnd.choice(TYPES), _ident(rnd, 'f'))
+            for _ in range(rnd.randrange(1, 6))
+        )
+        parts.append('typedef struct {{\n{}}} {}_t;\n'.format(fields, _ident(rnd, 's')))
+    for _ in range(rnd.randrange(2, 10)):
+        parts.append(
+            '{} {}(int a,int b);\n'.format(rnd.choice(TYPES), _ident(rnd, 'func'))
+        )
+    parts.append('static inline ' + make_function(rnd))
+    parts.append('#endif\n')
+    return '\n'.join(parts)
+
+
+def make_source(rnd: random.Random, n_bytes: int, cpp: bool = False) -> str:
+    """
+    A source of about n_bytes bytes (at least one function).
+    """
+    parts = ['#include <stdint.h>\n#include <stddef.h>\n']
+    size = len(parts[0])
+    while size < n_bytes:
+        func = make_function(rnd, cpp)
+        parts.append(func)
+        size += len(func) + 1
+    return '\n'.join(parts)
+
+
+def _write(path: str, content: str) -> int:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    data = content.encode()
+    with open(path, 'wb') as f:
+        f.write(data)
+    return len(data)
+
+
+def generate_corpus(
+    path: str, seed: int = 0, scale: float = 1.0
+) -> typing.Dict[str, typing.Any]:
+    """
+    Generate the corpus in the given directory, and return the number of files
+    and bytes of each part of it. 'scale' multiplies the number of headers and huge
+    files; the directory tree is always the same.
+    """
+    rnd = random.Random(seed)
+    summary = {}  # type: typing.Dict[str, typing.Any]
+
+    def count(part: str, n_bytes: int) -> None:
+        entry = summary.setdefault(part, {'files': 0, 'bytes': 0})
+        entry['files'] += 1
+        entry['bytes'] += n_bytes
+
+    for i in range(max(1, int(400 * scale))):
+        name = os.path.join(path, 'headers', 'h{}'.format(i // 100), 'h{}.h'.format(i))
+        count('headers', _write(name, make_header(rnd)))
+
+    for i in range(max(1, int(3 * scale))):
+        name = os.path.join(path, 'huge', 'huge{}.cpp'.format(i))
+        count('huge', _write(name, make_source(rnd, 1024 * 1024, cpp=True)))
+
+    def tree(rel: str, depth: int) -> None:
+        for i in range(rnd.randrange(1, 4)):
+            name = os.path.join(path, rel, 'f{}.{}'.format(i, rnd.choice(['c', 'cpp'])))
+            count('tree', _write(name, make_source(rnd, rnd.randrange(500, 8000))))
+        if depth < 6:
+            for i in range(3 if depth < 3 else 1):
+                tree(os.path.join(rel, 'd{}_{}'.format(depth, i)), depth + 1)
+
+    tree('tree', 0)
+
+    _write(os.path.join(path, RULES_FILE), RULES)
+    parts = list(summary.values())
+    summary['files'] = sum(part['files'] for part in parts)
+    summary['bytes'] = sum(part['bytes'] for part in parts)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('path')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--scale', type=float, default=1.0)
+    args = parser.parse_args()
+    summary = generate_corpus(args.path, args.seed, args.scale)
+    print('{files} files, {bytes} bytes'.format(**summary))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,25 @@
+# SPDX-FileCopyrightText: 2026 Ivan Grokhotkov <ivan@igrr.me>
+# SPDX-License-Identifier: MIT
+"""
+Memory usage measurements shared by the benchmarks.
+"""
+import resource
+import sys
+
+
+def max_rss_kb(ru_maxrss: int) -> int:
+    """
+    Convert ru_maxrss of getrusage to kB: macOS reports it in bytes.
+    """
+    return ru_maxrss // 1024 if sys.platform == 'darwin' else ru_maxrss
+
+
+def rss_kb() -> int:
+    """
+    Current resident set size in kB where available (Linux), otherwise the peak one.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize() // 1024
+    except OSError:
+        return max_rss_kb(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
@@ -19,10 +19,72 @@ cd astyle
 
 if [ ! -f .main.patched ]; then
     cat << 'EOF' >> src/astyle_main.cpp
+#include <cstdint>
+#include <cstring>
 extern "C" void AStyleErrorHandler(int errorNumber, const char* errorMessage);
 extern "C" EXPORT char* AStyleWrapper(const char* pSourceIn, const char* pOptions) {
     return AStyleMain(pSourceIn, pOptions, &AStyleErrorHandler, (fpAlloc) malloc);
 }
+extern "C" EXPORT int AStyleCheck(const char* pSourceIn, const char* pOptions) {
+    char* pOut = AStyleMain(pSourceIn, pOptions, &AStyleErrorHandler, (fpAlloc) malloc);
+    if (pOut == NULL) {
+        return -1;
+    }
+    const char* pIn = pSourceIn;
+    const char* p = pOut;
+    int line = 1;
+    while (*pIn == *p && *pIn != '\0') {
+        if (*pIn == '\n') {
+            line++;
+        }
+        pIn++;
+        p++;
+    }
+    int result = (*pIn == *p) ? 0 : line;
+    free(pOut);
+    return result;
+}
+extern "C" EXPORT char* AStyleBatch(const char* pBatch, const char* pOptions) {
+    uint32_t count;
+    memcpy(&count, pBatch, sizeof(count));
+    const char* pIn = pBatch + sizeof(count);
+    char** results = (char**) malloc(count * sizeof(char*));
+    uint32_t* lengths = (uint32_t*) malloc(count * sizeof(uint32_t));
+    if (results == NULL || lengths == NULL) {
+        free(results);
+        free(lengths);
+        return NULL;
+    }
+    size_t total = sizeof(count);
+    for (uint32_t i = 0; i < count; i++) {
+        uint32_t len;
+        memcpy(&len, pIn, sizeof(len));
+        results[i] = AStyleMain(pIn + sizeof(len), pOptions, &AStyleErrorHandler, (fpAlloc) malloc);
+        pIn += sizeof(len) + len + 1;
+        lengths[i] = results[i] ? (uint32_t) strlen(results[i]) : UINT32_MAX;
+        total += sizeof(len) + (results[i] ? lengths[i] + 1 : 0);
+    }
+    char* pOut = (char*) malloc(total);
+    char* p = pOut;
+    if (pOut != NULL) {
+        memcpy(p, &count, sizeof(count));
+        p += sizeof(count);
+    }
+    for (uint32_t i = 0; i < count; i++) {
+        if (pOut != NULL) {
+            memcpy(p, &lengths[i], sizeof(uint32_t));
+            p += sizeof(uint32_t);
+            if (results[i] != NULL) {
+                memcpy(p, results[i], lengths[i] + 1);
+                p += lengths[i] + 1;
+            }
+        }
+        free(results[i]);
+    }
+    free(results);
+    free(lengths);
+    return pOut;
+}
 EOF
     touch .main.patched
 fi
@@ -45,7 +107,7 @@ emmake make static
 
 # link it as a wasm module
 emcc -o bin/libastyle.wasm \
-    -s EXPORTED_FUNCTIONS=["_AStyleGetVersion","_AStyleWrapper","_malloc","_free"] \
+    -s EXPORTED_FUNCTIONS=["_AStyleGetVersion","_AStyleWrapper","_AStyleCheck","_AStyleBatch","_malloc","_free"] \
     -s STANDALONE_WASM=1 \
     -s ERROR_ON_UNDEFINED_SYMBOLS=0 \
     --no-entry \
@@ -1,4 +1,6 @@
+#include <stdint.h>
 #include <stdlib.h>
+#include <string.h>
 void AStyleErrorHandler(int errorNumber, const char* errorMessage);
 char* AStyleMain(const char* pSourceIn, const char* pOptions, void (*fpError)(int, const char*), void* (*fpAlloc)(unsigned long));
 
@@ -6,3 +8,77 @@ char* AStyleWrapper(const char* pSourceIn, const char* pOptions)
 {
     return AStyleMain(pSourceIn, pOptions, &AStyleErrorHandler, malloc);
 }
+
+/* Format the source and compare the result with it, without returning the result.
+ * Returns 0 if the source is already formatted, otherwise the (1-based) number
+ * of the first line which is changed by formatting. Returns -1 on error.
+ */
+int AStyleCheck(const char* pSourceIn, const char* pOptions)
+{
+    char* pOut = AStyleMain(pSourceIn, pOptions, &AStyleErrorHandler, malloc);
+    if (pOut == NULL) {
+        return -1;
+    }
+    const char* pIn = pSourceIn;
+    const char* p = pOut;
+    int line = 1;
+    while (*pIn == *p && *pIn != '\0') {
+        if (*pIn == '\n') {
+            line++;
+        }
+        pIn++;
+        p++;
+    }
+    int result = (*pIn == *p) ? 0 : line;
+    free(pOut);
+    return result;
+}
+
+/* Format several sources with the same options in one call.
+ * pBatch holds the number of sources (uint32), followed by each source: its length
+ * (uint32) and the source itself, NUL-terminated. Returns a buffer with the same
+ * layout holding the formatted sources, to be freed by the caller. The length of
+ * a source which failed to format is UINT32_MAX, and no data follows it.
+ */
+char* AStyleBatch(const char* pBatch, const char* pOptions)
+{
+    uint32_t count;
+    memcpy(&count, pBatch, sizeof(count));
+    const char* pIn = pBatch + sizeof(count);
+    char** results = malloc(count * sizeof(char*));
+    uint32_t* lengths = malloc(count * sizeof(uint32_t));
+    if (results == NULL || lengths == NULL) {
+        free(results);
+        free(lengths);
+        return NULL;
+    }
+    size_t total = sizeof(count);
+    for (uint32_t i = 0; i < count; i++) {
+        uint32_t len;
+        memcpy(&len, pIn, sizeof(len));
+        results[i] = AStyleMain(pIn + sizeof(len), pOptions, &AStyleErrorHandler, malloc);
+        pIn += sizeof(len) + len + 1;
+        lengths[i] = results[i] ? (uint32_t) strlen(results[i]) : UINT32_MAX;
+        total += sizeof(len) + (results[i] ? lengths[i] + 1 : 0);
+    }
+    char* pOut = malloc(total);
+    char* p = pOut;
+    if (pOut != NULL) {
+        memcpy(p, &count, sizeof(count));
+        p += sizeof(count);
+    }
+    for (uint32_t i = 0; i < count; i++) {
+        if (pOut != NULL) {
+            memcpy(p, &lengths[i], sizeof(uint32_t));
+            p += sizeof(uint32_t);
+            if (results[i] != NULL) {
+                memcpy(p, results[i], lengths[i] + 1);
+                p += lengths[i] + 1;
+            }
+        }
+        free(results[i]);
+    }
+    free(results);
+    free(lengths);
+    return pOut;
+}
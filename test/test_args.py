@@ -52,3 +52,66 @@ def test_options_from_file(tmp_path: pathlib.Path):
 
     assert args.exclude_list == ['bar.c', '*.inc', '/sub/**/*.c']
     assert args.options == ['--cmdline-arg=foo', '--style=otbs', '--attach-namespace']
+
+
+def test_args_jobs():
+    assert parse_args(['foo.c']).jobs is None
+    assert parse_args(['--jobs=4', 'foo.c']).jobs == 4
+    for value in ['0', '-1', 'many']:
+        with pytest.raises(ValueError) as exp:
+            parse_args([f'--jobs={value}'])
+        assert 'Option --jobs requires a positive number' in str(exp.value)
+
+
+def test_args_files_from():
+    args = parse_args(['--files-from=list.txt', '-0', '--style=otbs', 'a.c'])
+    assert args.files_from == 'list.txt'
+    assert args.null_delimited
+    assert args.options == ['--style=otbs']
+    assert args.files == ['a.c']
+
+    args = parse_args(['--files-from=-'])
+    assert args.files_from == '-'
+    assert not args.null_delimited
+    assert args.files == []
+
+    with pytest.raises(ValueError) as exp:
+        parse_args(['-0', 'a.c'])
+    assert 'can only be used with --files-from' in str(exp.value)
+
+
+def test_args_changed_since():
+    args = parse_args(['--changed-since=origin/main', '--lines-changed-only'])
+    assert args.changed_since == 'origin/main'
+    assert args.lines_changed_only
+    assert args.options == []
+    assert not parse_args(['a.c']).lines_changed_only
+
+
+def test_args_jobs_backend():
+    assert parse_args(['a.c']).jobs_backend is None
+    assert parse_args(['--jobs-backend=thread', 'a.c']).jobs_backend == 'thread'
+    with pytest.raises(ValueError) as exp:
+        parse_args(['--jobs-backend=fibers'])
+    assert 'requires \'process\' or \'thread\', found fibers' in str(exp.value)
+
+
+def test_args_stats():
+    args = parse_args(['a.c'])
+    assert not args.stats
+    assert args.stats_json is None
+    args = parse_args(['--stats', '--stats-json=stats.json', 'a.c'])
+    assert args.stats
+    assert args.stats_json == 'stats.json'
+    assert args.options == []
+    with pytest.raises(ValueError):
+        parse_args(['--stats-json'])
+
+
+def test_args_timeout_per_file():
+    assert parse_args(['a.c']).timeout_per_file is None
+    assert parse_args(['--timeout-per-file=1.5', 'a.c']).timeout_per_file == 1.5
+    for value in ['0', '-1', 'long']:
+        with pytest.raises(ValueError) as exp:
+            parse_args([f'--timeout-per-file={value}'])
+        assert 'requires a positive number of seconds' in str(exp.value)
@@ -1,8 +1,133 @@
 # SPDX-FileCopyrightText: 2022 Ivan Grokhotkov <ivan@igrr.me>
 # SPDX-License-Identifier: MIT
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
+from wasmtime import Module
+
+from astyle_py import Astyle, AstyleError, AstyleTimeout, astyle_wrapper
+from astyle_py.astyle_wrapper import (
+    _BATCH_ERROR,
+    _BATCH_U32,
+    OPTIONS_CACHE_SIZE,
+    PRECOMPILED_DIR_ENV,
+    _load_module,
+    _pack_batch,
+    _unpack_batch,
+    get_engine,
+    get_module,
+    get_precompiled_file,
+    precompile,
+)
+
+# Stand-in for the astyle modules, exporting the same functions, AStyleCheck and
+# AStyleBatch included. "Formatting" replaces each 'x' with 'y'; a source containing
+# '!' fails, and the error message reported for it is the source itself. malloc is a bump allocator, free does nothing.
+STUB_MODULE_WAT = '''
+(module
+  (import "env" "AStyleErrorHandler" (func $error (param i32 i32)))
+  (memory (export "memory") 64)
+  (global $top (mut i32) (i32.const 1024))
+  (data (i32.const 16) "stub\\00")
+  (func (export "_initialize"))
+  (func $malloc (export "malloc") (param $n i32) (result i32)
+    (local $p i32)
+    (local.set $p (global.get $top))
+    (if (i32.gt_u (i32.add (local.get $p) (local.get $n))
+                  (i32.mul (memory.size) (i32.const 65536)))
+      (then (return (i32.const 0))))
+    (global.set $top (i32.and (i32.add (i32.add (local.get $p) (local.get $n))
+                                       (i32.const 7))
+                              (i32.const -8)))
+    (local.get $p))
+  (func (export "free") (param i32))
+  (func (export "AStyleGetVersion") (result i32) (i32.const 16))
+  (func $format (export "AStyleWrapper") (param $src i32) (param $opts i32) (result i32)
+    (local $out i32) (local $i i32) (local $c i32)
+    (local.set $out (call $malloc (i32.add (call $strlen (local.get $src)) (i32.const 1))))
+    (loop $next
+      (local.set $c (i32.load8_u (i32.add (local.get $src) (local.get $i))))
+      (if (i32.eq (local.get $c) (i32.const 33))
+        (then (call $error (i32.const 1) (local.get $src)) (return (i32.const 0))))
+      (if (i32.eq (local.get $c) (i32.const 120))
+        (then (local.set $c (i32.const 121))))
+      (i32.store8 (i32.add (local.get $out) (local.get $i)) (local.get $c))
+      (local.set $i (i32.add (local.get $i) (i32.const 1)))
+      (br_if $next (local.get $c)))
+    (local.get $out))
+  (func $strlen (param $s i32) (result i32)
+    (local $i i32)
+    (block $end
+      (loop $next
+        (br_if $end (i32.eqz (i32.load8_u (i32.add (local.get $s) (local.get $i)))))
+        (local.set $i (i32.add (local.get $i) (i32.const 1)))
+        (br $next)))
+    (local.get $i))
+;; Same as AStyleCheck in build-scripts/3.3+/wrapper.c
+  (func (export "AStyleCheck") (param $src i32) (param $opts i32) (result i32)
+    (local $out i32) (local $i i32) (local $c i32) (local $line i32)
+    (local.set $out (call $format (local.get $src) (local.get $opts)))
+    (if (i32.eqz (local.get $out)) (then (return (i32.const -1))))
+    (local.set $line (i32.const 1))
+    (loop $next
+      (local.set $c (i32.load8_u (i32.add (local.get $src) (local.get $i))))
+      (if (i32.ne (local.get $c) (i32.load8_u (i32.add (local.get $out) (local.get $i))))
+        (then (return (local.get $line))))
+      (if (i32.eq (local.get $c) (i32.const 10))
+        (then (local.set $line (i32.add (local.get $line) (i32.const 1)))))
+      (local.set $i (i32.add (local.get $i) (i32.const 1)))
+      (br_if $next (local.get $c)))
+    (i32.const 0))
+    (func (export "AStyleBatch") (param $batch i32) (param $opts i32) (result i32)
+    (local $count i32) (local $k i32) (local $in i32) (local $len i32)
+    (local $out i32) (local $p i32) (local $res i32)
+    (local.set $count (i32.load (local.get $batch)))
+    ;; The formatted sources are as long as the sources, the result fits in
+    ;; as many bytes as the batch
+    (local.set $in (i32.add (local.get $batch) (i32.const 4)))
+    (block $end
+      (loop $next
+        (br_if $end (i32.ge_u (local.get $k) (local.get $count)))
+        (local.set $in (i32.add (local.get $in)
+                                (i32.add (i32.load (local.get $in)) (i32.const 5))))
+        (local.set $k (i32.add (local.get $k) (i32.const 1)))
+        (br $next)))
+    (local.set $out (call $malloc (i32.sub (local.get $in) (local.get $batch))))
+    (i32.store (local.get $out) (local.get $count))
+    (local.set $in (i32.add (local.get $batch) (i32.const 4)))
+    (local.set $p (i32.add (local.get $out) (i32.const 4)))
+    (local.set $k (i32.const 0))
+    (block $end
+      (loop $next
+        (br_if $end (i32.ge_u (local.get $k) (local.get $count)))
+        (local.set $len (i32.load (local.get $in)))
+        (local.set $res (call $format (i32.add (local.get $in) (i32.const 4))
+                                      (local.get $opts)))
+        (if (local.get $res)
+          (then
+            (i32.store (local.get $p) (local.get $len))
+            (memory.copy (i32.add (local.get $p) (i32.const 4)) (local.get $res)
+                         (i32.add (local.get $len) (i32.const 1)))
+            (local.set $p (i32.add (local.get $p) (i32.add (local.get $len) (i32.const 5)))))
+          (else
+            (i32.store (local.get $p) (i32.const -1))
+            (local.set $p (i32.add (local.get $p) (i32.const 4)))))
+        (local.set $in (i32.add (local.get $in) (i32.add (local.get $len) (i32.const 5))))
+        (local.set $k (i32.add (local.get $k) (i32.const 1)))
+        (br $next)))
+    (local.get $out))
+)
+'''
 
-from astyle_py import Astyle, AstyleError
+
+@pytest.fixture
+def stub_module(monkeypatch: pytest.MonkeyPatch):
+    def get_stub_module(version: str, interruptible: bool = False) -> Module:
+        return Module(get_engine(interruptible), STUB_MODULE_WAT)
+
+    monkeypatch.setattr(astyle_wrapper, 'get_module', get_stub_module)
 
 
 def test_version():
@@ -16,8 +141,390 @@ def test_version():
         Astyle(version='1.2.3')
 
 
+def test_moved_names_importable():
+    # defined by astyle_wrapper before they were moved to lighter modules
+    from astyle_py import astyle_versions, errors
+    from astyle_py.astyle_wrapper import (
+        ASTYLE_COMPAT_VERSION,
+        ASTYLE_SUPPORTED_VERSIONS,
+        AstyleError,
+    )
+
+    assert ASTYLE_SUPPORTED_VERSIONS is astyle_versions.ASTYLE_SUPPORTED_VERSIONS
+    assert ASTYLE_COMPAT_VERSION == astyle_versions.ASTYLE_COMPAT_VERSION
+    assert AstyleError is errors.AstyleError
+
+
 def test_astyle_invalid_option():
     obj = Astyle()
     obj.set_options('--invalid-option')
     with pytest.raises(AstyleError):
         obj.format('int main() {}')
+    with pytest.raises(AstyleError) as e:
+        obj.format('int main() {}')
+    assert 'invalid-option' in str(e.value)
+
+    # the error doesn't stick to the instance
+    obj.set_options('--style=otbs')
+    assert obj.format('int main() {}') == 'int main() {}'
+
+
+def test_astyle_options_interned():
+    obj = Astyle()
+    source = 'int main() { return 0; }\n'
+    for _ in range(3):
+        obj.set_options('--style=otbs')
+        assert obj.format(source) == 'int main()\n{\n    return 0;\n}\n'
+        obj.set_options('--style=otbs --indent=spaces=2')
+        assert obj.format(source) == 'int main()\n{\n  return 0;\n}\n'
+    assert len(obj._instance()._options) == 3  # including the initial empty options
+
+    for i in range(OPTIONS_CACHE_SIZE + 5):
+        obj.set_options(f'--indent=spaces=3 --max-code-length={50 + i}')
+    assert len(obj._instance()._options) == OPTIONS_CACHE_SIZE
+
+    # the current options stay usable after being released
+    obj.release_options()
+    assert len(obj._instance()._options) == 0
+    assert obj.format('{\nfoo();\n}\n') == '{\n   foo();\n}\n'
+
+
+def test_astyle_large_unicode_source():
+    obj = Astyle()
+    obj.set_options('--style=otbs')
+    source = 'int fé(void) { return 0; }  // привет\n'
+    expected = 'int fé(void)\n{\n    return 0;    // привет\n}\n'
+    assert obj.format(source) == expected
+    result = obj.format(source * 2000)
+    assert len(result) == len(expected) * 2000
+    assert result == expected * 2000
+
+
+def test_module_shared_between_instances():
+    obj_a = Astyle(version='3.4.7')
+    obj_b = Astyle(version='3.4.7')
+    assert get_module('3.4.7') is get_module('3.4.7')
+    assert obj_a.context.store is not obj_b.context.store
+
+    obj_a.set_options('--style=otbs')
+    obj_b.set_options('--style=otbs --indent=spaces=2')
+    source = 'int main() { return 0; }\n'
+    assert obj_a.format(source) == 'int main()\n{\n    return 0;\n}\n'
+    assert obj_b.format(source) == 'int main()\n{\n  return 0;\n}\n'
+
+
+def test_format_many():
+    obj = Astyle()
+    sources = ['int main() { return 0; }\n', 'int x;\n', '\ud800', '{\nfoo();\n}\n']
+    results = list(obj.format_many(iter(sources), options='--style=otbs'))
+    assert [r.formatted for r in results] == [
+        'int main()\n{\n    return 0;\n}\n',
+        'int x;\n',
+        None,
+        '{\n    foo();\n}\n',
+    ]
+    assert [r.changed for r in results] == [True, False, False, True]
+    assert [r.error is not None for r in results] == [False, False, True, False]
+
+    results = list(obj.check_many(sources))
+    assert [r.changed for r in results] == [True, False, False, True]
+    assert all(r.formatted is None for r in results)
+
+    with pytest.raises(AstyleError):
+        next(obj.format_many(sources, options='--invalid-option'))
+
+
+def test_source_buffer_reused():
+    obj = Astyle()
+    obj.set_options('--style=otbs')
+    source = 'int main() { return 0; }\n'
+    obj.format(source)
+    buf = obj._instance()._src_buf
+    for result in obj.format_many(source for _ in range(100)):
+        assert result.formatted == 'int main()\n{\n    return 0;\n}\n'
+    assert obj._instance()._src_buf == buf
+
+    # grows for larger sources
+    assert obj.format(source * 5000) == 'int main()\n{\n    return 0;\n}\n' * 5000
+    assert obj._instance()._src_buf_size > len(source) * 5000
+
+
+def test_format_bytes():
+    obj = Astyle()
+    obj.set_options('--style=otbs')
+    source = 'int fé(void) { return 0; }  // привет\n'
+    assert obj.format_bytes(source.encode('utf-8')) == obj.format(source).encode()
+    # the encoding doesn't matter, and the line endings are kept
+    latin1 = b'int f\xe9(void) { return 0; } // \xe9\r\n'
+    expected = b'int f\xe9(void)\r\n{\r\n    return 0;    // \xe9\r\n}\r\n'
+    assert obj.format_bytes(latin1) == expected
+
+    obj.set_options('--invalid-option')
+    with pytest.raises(AstyleError):
+        obj.format_bytes(b'int main() {}')
+
+
+def test_check():
+    obj = Astyle()
+    obj.set_options('--style=otbs')
+    formatted = 'int main()\n{\n    return 0;\n}\n'
+    assert obj.check(formatted) == 0
+    assert obj.check(formatted.encode()) == 0
+    assert obj.check('') == 0
+    # the number of the first line changed by formatting
+    assert obj.check('int main() { return 0; }\n') == 1
+    assert obj.check(formatted + 'int x(){\nreturn 1;\n}\n') == 5
+    assert obj.check(formatted.rstrip('\n')) == 0
+    assert obj.check(formatted + '\n\nint y() {\nreturn 1;\n}\n') == 7
+
+    obj.set_options('--invalid-option')
+    with pytest.raises(AstyleError):
+        obj.check(formatted)
+
+
+def test_format_batch():
+    obj = Astyle()
+    obj.set_options('--style=otbs')
+    sources = [b'int main() { return 0; }\n', b'', b'int x;\n']
+    assert obj.format_batch(sources) == [
+        (b'int main()\n{\n    return 0;\n}\n', True, None),
+        (b'', False, None),
+        (b'int x;\n', False, None),
+    ]
+    assert obj.format_batch([]) == []
+
+    obj.set_options('--invalid-option')
+    with pytest.raises(AstyleError):
+        obj.format_batch(sources)
+
+
+@pytest.mark.parametrize('memory_limit', [None, 1024 * 1024])
+def test_check_in_module(stub_module, memory_limit):
+    obj = Astyle(memory_limit=memory_limit)
+    instance = obj._instance()
+    funcs = instance.context._funcs
+    sources = ['', 'a;\nb;\n', 'a;\nx;\n', b'x', 'a;\nb;\nc;\nbad!\n']
+    expected = [0, 0, 2, 1, 'error: a;\nb;\nc;\nbad!\n (1)']
+
+    def checked():
+        results = []
+        for source in sources:
+            try:
+                results.append(obj.check(source))
+            except AstyleError as e:
+                results.append(str(e))
+        return results
+
+    wrapper_calls = funcs['AStyleWrapper'].calls
+    check_calls = funcs['AStyleCheck'].calls
+    assert checked() == expected
+    # The formatted sources are compared inside the module
+    assert funcs['AStyleWrapper'].calls == wrapper_calls
+    assert funcs['AStyleCheck'].calls == check_calls + len(sources)
+    # Same results when comparing them in Python, as with the modules without AStyleCheck
+    instance._has_check = False
+    assert checked() == expected
+    assert funcs['AStyleCheck'].calls == check_calls + len(sources)
+
+
+def test_format_batch_in_module(stub_module):
+    obj = Astyle()
+    assert obj.version() == 'stub'
+    sources = [b'x = 1;\n', b'', b'bad 1!\n', b'y;\n', b'bad 2!\n']
+    expected = [
+        (b'y = 1;\n', True, None),
+        (b'', False, None),
+        (None, False, 'error: bad 1!\n (1)'),
+        (b'y;\n', False, None),
+        (None, False, 'error: bad 2!\n (1)'),
+    ]
+    instance = obj._instance()
+    batch_calls = instance.context._funcs['AStyleBatch'].calls
+    assert obj.format_batch(sources) == expected
+    assert instance.context._funcs['AStyleBatch'].calls == batch_calls + 1
+    assert obj.format_batch([]) == []
+    # Same results one source at a time, as with the modules without AStyleBatch
+    instance._has_batch = False
+    assert obj.format_batch(sources) == expected
+
+
+def test_batch_packing():
+    sources = [b'int a;', b'', b'\xe9']
+    packed = _pack_batch(sources)
+    assert packed == (
+        b'\x03\x00\x00\x00'
+        b'\x06\x00\x00\x00int a;\x00'
+        b'\x00\x00\x00\x00\x00'
+        b'\x01\x00\x00\x00\xe9\x00'
+    )
+    # the result has the same layout, with errors marked by the length
+    result = bytearray(b'xx') + packed[:-6] + _BATCH_U32.pack(_BATCH_ERROR)
+    assert _unpack_batch(memoryview(result), 2) == [b'int a;', b'', None]
+
+
+def test_guest_calls():
+    obj = Astyle()
+    obj.set_options('--style=otbs')
+    ctx = obj.context
+    obj.format_bytes(b'int x;\n')
+    calls = ctx.guest_calls
+    # AStyleWrapper, and free for the result: the source buffer and options are reused
+    obj.format_bytes(b'int y;\n')
+    assert ctx.guest_calls - calls == 2
+    calls = ctx.guest_calls
+    assert obj.format('int  z;\n') == 'int  z;\n'
+    assert ctx.guest_calls - calls == 2
+
+
+def test_memory_view_cached():
+    obj = Astyle()
+    view = obj.context.get_memory_view()
+    assert obj.context.get_memory_view() is view
+    obj.set_options('--style=otbs')
+    obj.format('int main() { return 0; }\n')
+    assert obj.context.get_memory_view() is view
+
+
+def test_source_too_large():
+    obj = Astyle()
+    size = len(obj.context.get_memory_view())
+    with pytest.raises(AstyleError) as e:
+        obj.format_bytes(b' ' * size)
+    assert 'not enough memory' in str(e.value)
+    # the heap was restored from the snapshot before giving up
+    assert obj.recycled == 1
+    # the instance is still usable
+    assert obj.format('int x;\n') == 'int x;\n'
+
+
+def test_timeout():
+    obj = Astyle(timeout=0.02)
+    obj.set_options('--style=otbs')
+    source = 'int main() { if (x) { return 0; } }\n' * 20000
+    with pytest.raises(AstyleTimeout):
+        obj.format(source)
+    # the instance is replaced, keeping the options; a generous limit for the small
+    # source, so that a slow machine doesn't make it time out too
+    obj.timeout = 10
+    assert (
+        obj.format('int main() { return 0; }\n') == 'int main()\n{\n    return 0;\n}\n'
+    )
+
+    # the time limit can be set later too
+    obj = Astyle()
+    assert not obj.context.interruptible
+    obj.set_options('--style=otbs')
+    obj.timeout = 0.02
+    assert obj.context.interruptible
+    with pytest.raises(AstyleTimeout):
+        obj.check(source)
+    obj.timeout = None
+    assert obj.check(source) == 1
+
+
+def test_memory_limit():
+    obj = Astyle(memory_limit=256 * 1024)
+    ref = Astyle()
+    options = ['--style=otbs', '--style=allman', '--indent=spaces=2']
+    for i in range(60):
+        source = 'int main() { if (x) { return %d; } }\n' % i * (i * 10 + 1)
+        # switching options after the heap is restored uses valid option strings
+        obj.set_options(options[i % 3])
+        ref.set_options(options[i % 3])
+        assert obj.format(source) == ref.format(source)
+        assert obj.check(source) == ref.check(source)
+    assert obj.recycled > 0
+    assert ref.recycled == 0
+
+
+def test_precompiled_module(tmp_path, monkeypatch):
+    monkeypatch.setenv(PRECOMPILED_DIR_ENV, str(tmp_path))
+    path = precompile('3.1')
+    assert path == get_precompiled_file('3.1')
+    assert path.startswith(str(tmp_path / '3.1'))
+
+    def compile_module(*_):
+        raise AssertionError('the module should not be compiled')
+
+    with monkeypatch.context() as m:
+        m.setattr('astyle_py.astyle_wrapper.Module.from_file', compile_module)
+        module = _load_module(get_engine(), '3.1', False)
+        # the interruptible engine needs a module compiled for it
+        with pytest.raises(AssertionError):
+            _load_module(get_engine(interruptible=True), '3.1', True)
+    assert [e.name for e in module.exports] == [
+        e.name for e in get_module('3.1').exports
+    ]
+
+    # a precompiled module which can't be loaded is compiled instead.
+    # (the loaded module maps the file, so it is replaced rather than overwritten)
+    (tmp_path / 'invalid').write_bytes(b'not a module')
+    os.replace(tmp_path / 'invalid', path)
+    module = _load_module(get_engine(), '3.1', False)
+    assert [e.name for e in module.exports] == [
+        e.name for e in get_module('3.1').exports
+    ]
+
+
+def test_threads():
+    obj = Astyle()
+    ref = Astyle()
+    options = ['--style=otbs', '--style=allman', '--indent=spaces=2', '--invalid']
+    sources = [
+        'int main() { if (x) { return %d; } }\n' % i * (i + 1) for i in range(20)
+    ]
+    expected = {}
+    for opts in options[:3]:
+        ref.set_options(opts)
+        expected[opts] = [ref.format(source) for source in sources]
+    contexts = set()
+    barrier = threading.Barrier(len(options))
+
+    def run(opts):
+        # the options and the errors are per thread
+        obj.set_options(opts)
+        barrier.wait()
+        contexts.add(id(obj.context))
+        if opts == '--invalid':
+            with pytest.raises(AstyleError):
+                obj.format(sources[0])
+            return None
+        return [obj.format(source) for source in sources]
+
+    with ThreadPoolExecutor(len(options)) as pool:
+        results = list(pool.map(run, options))
+    assert results[:3] == [expected[opts] for opts in options[:3]]
+    # each thread has its own instance
+    assert len(contexts) == len(options)
+    assert id(obj.context) not in contexts
+
+    # a time limit set by one thread applies to the instances of the other threads
+    obj.timeout = 0.02
+    with ThreadPoolExecutor(1) as pool:
+        assert pool.submit(lambda: obj.context.interruptible).result()
+
+
+def test_stats_hook():
+    calls = []
+    obj = Astyle(stats_hook=calls.append)
+    obj.set_options('--style=otbs')
+    source = 'int main() { return 0; }\n'
+    formatted = obj.format(source)
+    assert obj.check(formatted.encode()) == 0
+    list(obj.format_many([source, source]))
+    assert [c.op for c in calls] == ['format', 'check', 'format', 'format']
+    assert calls[0].bytes_in == len(source)
+    assert calls[0].bytes_out == len(formatted)
+    assert calls[0].guest_calls > 0
+    assert 0 < calls[0].guest_time <= calls[0].total_time
+
+    # failed calls are reported as well
+    obj.set_options('--invalid')
+    with pytest.raises(AstyleError):
+        obj.format_bytes(b'')
+    assert calls[-1].op == 'format_bytes'
+
+    obj.stats_hook = None
+    obj.set_options('--style=otbs')
+    obj.format(source)
+    assert len(calls) == 5
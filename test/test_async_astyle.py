@@ -0,0 +1,61 @@
+# SPDX-FileCopyrightText: 2026 Ivan Grokhotkov <ivan@igrr.me>
+# SPDX-License-Identifier: MIT
+import asyncio
+
+import pytest
+
+from astyle_py import AstyleError
+from astyle_py.async_astyle import AsyncAstyle
+
+SOURCE = 'int main() { return 0; }\n'
+FORMATTED = 'int main()\n{\n    return 0;\n}\n'
+
+
+def test_async_format():
+    async def run():
+        async with AsyncAstyle(workers=2) as astyle:
+            assert await astyle.version() == '3.1'
+            results = await asyncio.gather(
+                *[astyle.format(SOURCE * i, '--style=otbs') for i in range(20)]
+            )
+            assert results == [FORMATTED * i for i in range(20)]
+            assert await astyle.check(SOURCE, '--style=otbs')
+            assert not await astyle.check(FORMATTED, '--style=otbs')
+            with pytest.raises(AstyleError):
+                await astyle.format(SOURCE, '--invalid-option')
+            # the error doesn't affect the other calls
+            assert await astyle.format(SOURCE, '--style=otbs') == FORMATTED
+
+    asyncio.run(run())
+
+
+def test_async_backpressure():
+    async def run():
+        async with AsyncAstyle(workers=1, max_pending=2) as astyle:
+            tasks = [
+                asyncio.ensure_future(astyle.format(SOURCE, '--style=otbs'))
+                for _ in range(10)
+            ]
+            await asyncio.sleep(0)
+            # only max_pending calls are submitted to the workers
+            assert astyle._semaphore is not None
+            assert astyle._semaphore.locked()
+            assert await asyncio.gather(*tasks) == [FORMATTED] * 10
+
+    asyncio.run(run())
+
+
+def test_async_timeout():
+    async def run():
+        async with AsyncAstyle(workers=1) as astyle:
+            with pytest.raises(asyncio.TimeoutError):
+                await astyle.format(SOURCE * 20000, '--style=otbs', timeout=0.001)
+            # the worker becomes available again once the call completes
+            assert await astyle.format(SOURCE, '--style=otbs') == FORMATTED
+
+    asyncio.run(run())
+
+
+def test_async_invalid_version():
+    with pytest.raises(ValueError):
+        AsyncAstyle(version='1.2.3')
@@ -0,0 +1,94 @@
+# SPDX-FileCopyrightText: 2026 Ivan Grokhotkov <ivan@igrr.me>
+# SPDX-License-Identifier: MIT
+import pathlib
+import sqlite3
+import time
+
+from astyle_py.cache import CACHE_DB_NAME, CACHE_RECORD_BATCH, ResultCache, cache_key
+
+
+def test_cache_key():
+    key = cache_key(b'int a;\n', '--style=otbs', '3.1')
+    assert key == cache_key(b'int a;\n', '--style=otbs', '3.1')
+    assert key != cache_key(b'int a; \n', '--style=otbs', '3.1')
+    assert key != cache_key(b'int a;\n', '--style=gnu', '3.1')
+    assert key != cache_key(b'int a;\n', '--style=otbs', '3.4.7')
+
+
+def test_cache_lru_eviction(tmp_path: pathlib.Path):
+    cache = ResultCache(str(tmp_path), max_entries=2)
+    for key in ['a', 'b', 'c']:
+        cache.record(key)
+    # 'a' becomes the most recently used
+    cache.record('a')
+    cache.close()
+
+    cache = ResultCache(str(tmp_path), max_entries=2)
+    assert cache.lookup('a')
+    assert not cache.lookup('b')
+    assert cache.lookup('c')
+
+    # read-only caches don't record anything
+    ro_cache = ResultCache(str(tmp_path), read_only=True)
+    ro_cache.record('d')
+    ro_cache.close()
+    assert not cache.lookup('d')
+    cache.close()
+
+
+def test_cache_low_water_mark(tmp_path: pathlib.Path):
+    cache = ResultCache(str(tmp_path), max_entries=10)
+    keys = [str(i) for i in range(11)]
+    for key in keys:
+        cache.record(key)
+    cache.close()
+
+    # evicted down to 9 entries, the most recently used ones
+    cache = ResultCache(str(tmp_path), max_entries=10)
+    assert [k for k in keys if cache.lookup(k)] == keys[2:]
+    # nothing to evict until there are more than 10 entries again
+    cache.record('a')
+    cache.close()
+    cache = ResultCache(str(tmp_path), max_entries=10)
+    assert [k for k in keys if cache.lookup(k)] == keys[2:]
+    cache.close()
+
+
+def test_cache_shared(tmp_path: pathlib.Path):
+    cache = ResultCache(str(tmp_path))
+    other = ResultCache(str(tmp_path))
+    keys = [str(i) for i in range(CACHE_RECORD_BATCH)]
+    for key in keys:
+        cache.record(key)
+    # written in a batch, without waiting for close()
+    assert all(other.lookup(key) for key in keys)
+
+    # another process holds the write lock
+    db = sqlite3.connect(str(tmp_path / CACHE_DB_NAME), isolation_level=None)
+    db.execute('BEGIN IMMEDIATE')
+    start = time.perf_counter()
+    for key in keys:
+        other.record('other ' + key)
+    assert time.perf_counter() - start < 2
+    # the keys which couldn't be written are not recorded, the cache still works
+    assert other.lookup('0')
+    assert not cache.lookup('other 0')
+    db.execute('COMMIT')
+    db.close()
+    other.record('a')
+    other.close()
+    cache.close()
+
+    cache = ResultCache(str(tmp_path))
+    assert cache.lookup('a')
+    assert not cache.lookup('other 0')
+    cache.close()
+
+
+def test_cache_unusable_dir(tmp_path: pathlib.Path):
+    not_a_dir = tmp_path / 'file'
+    not_a_dir.touch()
+    cache = ResultCache(str(not_a_dir))
+    cache.record('a')
+    assert not cache.lookup('a')
+    cache.close()
@@ -1,11 +1,26 @@
 # SPDX-FileCopyrightText: 2022 Ivan Grokhotkov <ivan@igrr.me>
 # SPDX-License-Identifier: MIT
+import itertools
 import os
 import pathlib
+import re
 import textwrap
 from contextlib import contextmanager
 
-from astyle_py.files_iter import FileItem, iterate_files_rules, iterate_files_simple
+import pytest
+
+from astyle_py import files_iter
+from astyle_py.files_iter import (
+    FileItem,
+    PatternsMatcher,
+    Rule,
+    RulesMatcher,
+    file_matches_patterns,
+    iterate_files_rules,
+    iterate_files_simple,
+    path_for_matching,
+)
+from astyle_py.utils import pattern_to_regex
 
 
 @contextmanager
@@ -107,3 +122,267 @@ def test_iter_rules(tmp_path: pathlib.Path):
     assert len(items) == 3
     assert FileItem('file_a.c', ['--opt1', '--opt2=foo']) in items
     assert FileItem('file_b.c', ['--opt3', '--opt4=bar']) in items
+
+
+def test_iter_rules_default_include(tmp_path: pathlib.Path):
+    rules_file = tmp_path / 'rules'
+    rules_file.write_text(
+        textwrap.dedent(
+            """
+            DEFAULT:
+                options: "--opt1"
+
+            rule_1:
+                options: "--opt2"
+            """
+        )
+    )
+    # rule_1 inherits the default include pattern, which matches everything
+    items = list(iterate_files_rules(['file_a.c'], str(rules_file)))
+    assert items == [FileItem('file_a.c', ['--opt2'])]
+
+
+def test_iter_rules_version(tmp_path: pathlib.Path):
+    rules_file = tmp_path / 'rules'
+    rules_file.write_text(
+        textwrap.dedent(
+            """
+            DEFAULT:
+                version: "3.1"
+
+            vendor:
+                include:
+                    - "/vendor/"
+                version: "3.4.7"
+
+            vendor_tests:
+                include:
+                    - "/vendor/tests/"
+                options: "--opt1"
+            """
+        )
+    )
+    files = ['file_a.c', 'vendor/file_b.c', 'vendor/tests/file_c.c']
+    items = list(iterate_files_rules(files, str(rules_file)))
+    assert items == [
+        FileItem('file_a.c', [], '3.1'),
+        FileItem('vendor/file_b.c', [], '3.4.7'),
+        # rules inherit the version from DEFAULT, not from the previous rules
+        FileItem('vendor/tests/file_c.c', ['--opt1'], '3.1'),
+    ]
+
+    rules_file.write_text('vendor:\n    version: "1.2.3"\n')
+    with pytest.raises(ValueError) as e:
+        list(iterate_files_rules(files, str(rules_file)))
+    assert 'Unsupported astyle version: 1.2.3' in str(e.value)
+    assert 'in rule vendor' in str(e.value)
+
+    # unquoted versions are loaded as numbers, 3.10 as 3.1
+    rules_file.write_text('vendor:\n    version: 3.10\n')
+    with pytest.raises(ValueError) as e:
+        list(iterate_files_rules(files, str(rules_file)))
+    assert 'found the number 3.1. Put the version in quotes' in str(e.value)
+
+
+def test_rules_matcher_same_as_linear_search():
+    patterns = [
+        '*.c',
+        '*_b.c',
+        '/sub/',
+        'sub2/',
+        '/**/sub2/',
+        '/sub/file_?.c',
+        'file_a.c',
+        '/*.h',
+        'sub*/',
+        '/other/**/x.c',
+    ]
+    paths = [
+        'file_a.c',
+        'file_b.c',
+        'x.h',
+        os.path.join('sub', 'file_c.c'),
+        os.path.join('sub', 'sub2', 'file_d.c'),
+        os.path.join('mysub2', 'file_e.c'),
+        os.path.join('other', 'deep', 'er', 'x.c'),
+        os.path.join('other', 'x.c'),
+        os.path.join('a', '..', 'sub', 'x.h'),
+    ]
+    regexes = [re.compile(pattern_to_regex(p)) for p in patterns]
+    rules = [
+        Rule(check=True, include=list(combo), options=[])
+        for combo in itertools.combinations(regexes, 2)
+    ]
+    rules.append(Rule(check=True, include=[], options=[]))
+    matcher = RulesMatcher(rules)
+
+    for path in paths:
+        expected = None
+        for idx, rule in enumerate(rules):
+            if file_matches_patterns(path, rule.include):
+                expected = idx
+        assert matcher.match(path_for_matching(path)) == expected, path
+
+        assert PatternsMatcher(regexes).matches(
+            path_for_matching(path)
+        ) == file_matches_patterns(path, regexes)
+    assert not PatternsMatcher([]).matches('/file_a.c')
+
+
+def make_tree(base: pathlib.Path, files):
+    for f in files:
+        path = base / f
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.touch()
+
+
+def scandir_spy(monkeypatch):
+    scanned = []
+    orig_scandir = os.scandir
+
+    def scandir(path):
+        scanned.append(os.path.normpath(path))
+        return orig_scandir(path)
+
+    monkeypatch.setattr(files_iter.os, 'scandir', scandir)
+    return scanned
+
+
+def test_iter_directories(tmp_path: pathlib.Path, monkeypatch):
+    make_tree(
+        tmp_path,
+        [
+            'a.c',
+            'a.txt',
+            'b.h',
+            '.hidden/x.c',
+            'sub/c.cpp',
+            'sub/sub2/d.c',
+            'sub/sub2/d.py',
+            'sub3/e.c',
+        ],
+    )
+    scanned = scandir_spy(monkeypatch)
+
+    with chdir_ctx(tmp_path):
+        items = list(iterate_files_simple(['.'], [], []))
+        assert [it.filename for it in items] == [
+            os.path.join('.', 'a.c'),
+            os.path.join('.', 'b.h'),
+            os.path.join('.', 'sub', 'c.cpp'),
+            os.path.join('.', 'sub', 'sub2', 'd.c'),
+            os.path.join('.', 'sub3', 'e.c'),
+        ]
+
+        # files and directories can be mixed, custom extensions
+        items = list(iterate_files_simple(['a.txt', 'sub'], [], [], ['py', 'cpp']))
+        assert [it.filename for it in items] == [
+            'a.txt',
+            os.path.join('sub', 'c.cpp'),
+            os.path.join('sub', 'sub2', 'd.py'),
+        ]
+
+        # excluded directories aren't entered
+        scanned.clear()
+        items = list(iterate_files_simple(['.'], ['sub2/', '*.h', 'sub3/*'], []))
+        assert [it.filename for it in items] == [
+            os.path.join('.', 'a.c'),
+            os.path.join('.', 'sub', 'c.cpp'),
+        ]
+        assert scanned == ['.', 'sub', 'sub3']
+
+
+def test_iter_directories_rules(tmp_path: pathlib.Path, monkeypatch):
+    make_tree(
+        tmp_path,
+        ['a.c', 'sub/c.c', 'sub/sub2/d.c', 'sub/sub3/e.c', 'other/f.c', 'other/g.c'],
+    )
+    rules_file = tmp_path / 'rules'
+    rules_file.write_text(
+        textwrap.dedent(
+            """
+            check_g:
+                include:
+                    - "g.c"
+            ignore_sub:
+                check: false
+                include:
+                    - "/sub/"
+            check_sub2:
+                include:
+                    - "/sub/sub2/"
+            ignore_other:
+                check: false
+                include:
+                    - "other/"
+            """
+        )
+    )
+    scanned = scandir_spy(monkeypatch)
+
+    with chdir_ctx(tmp_path):
+        items = list(iterate_files_rules(['.'], 'rules'))
+    assert [it.filename for it in items] == [
+        os.path.join('.', 'a.c'),
+        os.path.join('.', 'sub', 'sub2', 'd.c'),
+    ]
+    # 'sub' has to be entered because of the later "/sub/sub2/" rule,
+    # but 'sub/sub3' doesn't.
+    assert scanned == ['.', 'sub', os.path.join('sub', 'sub2')]
+
+    # a later rule with a pattern which may match anywhere prevents skipping
+    with rules_file.open('a') as f:
+        f.write('check_g_again:\n    include:\n        - "g.c"\n')
+    scanned.clear()
+    with chdir_ctx(tmp_path):
+        items = list(iterate_files_rules(['.'], 'rules'))
+    assert os.path.join('.', 'other', 'g.c') in [it.filename for it in items]
+    assert os.path.join('sub', 'sub3') in scanned
+
+
+def test_iter_rules_snapshot(tmp_path: pathlib.Path, monkeypatch):
+    make_tree(tmp_path, ['a.c', 'sub/b.c', 'sub/sub2/c.c', 'vendor/d.c'])
+    rules_file = tmp_path / 'rules'
+    rules_file.write_text(
+        textwrap.dedent(
+            """
+            DEFAULT:
+                options: "--opt1"
+            ignore_sub:
+                check: false
+                include:
+                    - "/sub/"
+            vendor:
+                include:
+                    - "/vendor/"
+                options: "--opt2"
+                version: "3.4.7"
+            """
+        )
+    )
+    snapshot_dir = tmp_path / 'snapshots'
+
+    def run():
+        with chdir_ctx(tmp_path):
+            return list(iterate_files_rules(['.'], 'rules', None, str(snapshot_dir)))
+
+    expected = [
+        FileItem(os.path.join('.', 'a.c'), ['--opt1']),
+        FileItem(os.path.join('.', 'vendor', 'd.c'), ['--opt2'], '3.4.7'),
+    ]
+    assert run() == expected
+    assert len(list(snapshot_dir.iterdir())) == 1
+
+    # the rules are loaded from the snapshot, without parsing the rules file,
+    # and excluded directories are still skipped
+    parse_rules = files_iter.parse_rules
+    monkeypatch.setattr(files_iter, 'parse_rules', None)
+    scanned = scandir_spy(monkeypatch)
+    assert run() == expected
+    assert 'sub' not in scanned
+
+    # a modified rules file is parsed again
+    monkeypatch.setattr(files_iter, 'parse_rules', parse_rules)
+    rules_file.write_text('DEFAULT:\n    options: "--opt3"\n')
+    assert [it.astyle_options for it in run()] == [['--opt3']] * 4
+    assert len(list(snapshot_dir.iterdir())) == 1
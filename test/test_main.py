@@ -1,12 +1,18 @@
 # SPDX-FileCopyrightText: 2023 Ivan Grokhotkov <ivan@igrr.me>
 # SPDX-License-Identifier: MIT
+import io
+import json
 import pathlib
+import subprocess
+import sys
+import textwrap
 
 import pytest
 from test_files_iter import chdir_ctx
 
-from astyle_py import __version__
+from astyle_py import Astyle, __version__, runner
 from astyle_py.__main__ import astyle_py_main
+from astyle_py.astyle_versions import ASTYLE_SUPPORTED_VERSIONS
 
 # tmp_path: pathlib.Path
 
@@ -30,6 +36,27 @@ def test_main_specific_version(capfd: pytest.CaptureFixture[str]):
     assert err == ''
 
 
+def test_main_version_matches_module():
+    # --version doesn't load the module to find out its version
+    for ver in ASTYLE_SUPPORTED_VERSIONS:
+        assert Astyle(version=ver).version() == ver
+
+
+@pytest.mark.parametrize(
+    'code',
+    [
+        'import astyle_py',
+        'from astyle_py.__main__ import main; sys.argv[1:] = ["--version"]; main()',
+        'from astyle_py.__main__ import main; sys.argv[1:] = []; main()',
+    ],
+)
+def test_main_lazy_imports(code: str):
+    check = 'import sys\ntry:\n    {}\nfinally:\n    print(sorted(set(sys.modules) & {{{}}}))'
+    heavy = "'wasmtime', 'yaml', 'asyncio', 'sqlite3'"
+    out = subprocess.check_output([sys.executable, '-c', check.format(code, heavy)])
+    assert out.decode().splitlines()[-1] == '[]'
+
+
 def test_main_invalid_version(capfd: pytest.CaptureFixture[str]):
     ver = '1.2.3'
     with pytest.raises(SystemExit) as e:
@@ -164,3 +191,244 @@ def test_all_files_excluded_warning(
         out, err = capfd.readouterr()
         assert out == ''
         assert 'No files checked, excluded by --exclude/--exclude-list option' in err
+
+
+def test_parallel_same_as_serial(
+    capfd: pytest.CaptureFixture[str],
+    tmp_path: pathlib.Path,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    # use the workers even for these small files
+    monkeypatch.setattr(runner, 'PARALLEL_MIN_BYTES', {})
+    base = str(tmp_path.absolute())
+    files = []
+    for i in range(10):
+        fname = f'file_{i}.c'
+        if i % 3 == 0:
+            (tmp_path / fname).write_text('int main() { foo(); }\n')
+        else:
+            (tmp_path / fname).write_text('int main()\n{\n    foo();\n}\n')
+        files.append(fname)
+
+    outputs = []
+    for jobs, backend in [(1, 'process'), (3, 'process'), (3, 'thread')]:
+        with chdir_ctx(base):
+            with pytest.raises(SystemExit) as e:
+                astyle_py_main(
+                    ['--style=otbs', '--dry-run', '--no-cache', f'--jobs={jobs}']
+                    + [f'--jobs-backend={backend}']
+                    + files
+                )
+            assert e.value.code == 1
+            outputs.append(capfd.readouterr())
+
+    assert outputs[0] == outputs[1] == outputs[2]
+    assert 'Formatting errors found in 4 files' in outputs[1].err
+    assert outputs[1].err.index('file_3.c') < outputs[1].err.index('file_6.c')
+
+    with chdir_ctx(base):
+        with pytest.raises(SystemExit) as e:
+            astyle_py_main(
+                ['--style=otbs', '--quiet', '--jobs=3', '--jobs-backend=thread'] + files
+            )
+        assert e.value.code == 0
+    for fname in files:
+        assert (tmp_path / fname).read_text() == 'int main()\n{\n    foo();\n}\n'
+
+
+def test_main_rules_versions(
+    capfd: pytest.CaptureFixture[str],
+    tmp_path: pathlib.Path,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setattr(runner, 'PARALLEL_MIN_BYTES', {})
+    # --squeeze-lines is only supported since Astyle 3.2
+    (tmp_path / 'rules.yml').write_text(
+        textwrap.dedent(
+            """
+            DEFAULT:
+                options: "--style=otbs"
+
+            vendor:
+                include:
+                    - "/vendor/"
+                version: "3.4.7"
+                options: "--style=otbs --squeeze-lines=1"
+            """
+        )
+    )
+    (tmp_path / 'vendor').mkdir()
+    source = 'int main() { foo(); }\n\n\n\nint x;\n'
+    files = ['file_a.c', 'vendor/file_b.c']
+    for jobs in (1, 2):
+        for fname in files:
+            (tmp_path / fname).write_text(source)
+        with chdir_ctx(str(tmp_path)):
+            with pytest.raises(SystemExit) as e:
+                astyle_py_main(
+                    ['--rules=rules.yml', '--no-cache', '--quiet', f'--jobs={jobs}']
+                    + files
+                )
+        assert e.value.code == 0
+        formatted = 'int main()\n{\n    foo();\n}\n'
+        assert (tmp_path / files[0]).read_text() == formatted + '\n\n\nint x;\n'
+        assert (tmp_path / files[1]).read_text() == formatted + '\nint x;\n'
+
+
+def test_cache(capfd: pytest.CaptureFixture[str], tmp_path: pathlib.Path):
+    base = str(tmp_path.absolute())
+    (tmp_path / 'file_a.c').write_text('int main() { foo(); }\n')
+    (tmp_path / 'file_b.c').write_text('int main()\n{\n    foo();\n}\n')
+    args = ['--style=otbs', '--cache-dir=cache', '--jobs=1']
+
+    def run(extra_args, expected_code):
+        with chdir_ctx(base):
+            with pytest.raises(SystemExit) as e:
+                astyle_py_main(args + extra_args + ['file_a.c', 'file_b.c'])
+            assert e.value.code == expected_code
+        return capfd.readouterr().err
+
+    assert 'Cache: 0 hits, 2 misses' in run(['--dry-run'], 1)
+    # file_b.c is known to be formatted, file_a.c still isn't
+    err = run(['--dry-run'], 1)
+    assert 'Cache: 1 hits, 1 misses' in err
+    assert 'Formatting error in file_a.c' in err
+    # the formatted file_a.c gets recorded as well
+    assert 'Cache: 1 hits, 1 misses' in run([], 0)
+    assert 'Cache: 2 hits, 0 misses' in run(['--dry-run'], 0)
+    # the options are a part of the key; file_a.c and file_b.c now have
+    # the same contents, so only the first one is a miss.
+    assert 'Cache: 1 hits, 1 misses' in run(['--dry-run', '--indent=spaces=4'], 0)
+    # no cache, no statistics
+    assert 'Cache:' not in run(['--dry-run', '--no-cache'], 0)
+
+
+def test_main_directory(capfd: pytest.CaptureFixture[str], tmp_path: pathlib.Path):
+    (tmp_path / 'src').mkdir()
+    (tmp_path / 'src' / 'file_a.c').write_text('int main() { foo(); }\n')
+    (tmp_path / 'src' / 'notes.txt').write_text('int main() { foo(); }\n')
+    (tmp_path / 'empty').mkdir()
+
+    with chdir_ctx(str(tmp_path)):
+        with pytest.raises(SystemExit) as e:
+            astyle_py_main(['--style=otbs', '--dry-run', 'src'])
+        assert e.value.code == 1
+        err = capfd.readouterr().err
+        assert f'Formatting error in {pathlib.Path("src", "file_a.c")}' in err
+        assert 'notes.txt' not in err
+
+        with pytest.raises(SystemExit) as e:
+            astyle_py_main(['--style=otbs', '--dry-run', 'empty'])
+        assert e.value.code == 0
+        err = capfd.readouterr().err
+        assert 'No files checked, no matching files found' in err
+
+
+def test_main_non_utf8_source(
+    capfd: pytest.CaptureFixture[str], tmp_path: pathlib.Path
+):
+    src = tmp_path / 'latin1.c'
+    src.write_bytes(b'int f\xe9() { foo(); } // \xe9\r\n')
+    with pytest.raises(SystemExit) as e:
+        astyle_py_main(['--style=otbs', '--no-cache', str(src)])
+    assert e.value.code == 0
+    assert src.read_bytes() == (b'int f\xe9()\r\n{\r\n    foo();    // \xe9\r\n}\r\n')
+    capfd.readouterr()
+
+
+def test_main_timeout_per_file(
+    capfd: pytest.CaptureFixture[str], tmp_path: pathlib.Path
+):
+    slow = tmp_path / 'slow.c'
+    slow.write_text('int main() { if (x) { return 0; } }\n' * 20000)
+    fast = tmp_path / 'fast.c'
+    fast.write_text('int main() { foo(); }\n')
+    args = ['--style=otbs', '--no-cache', '--timeout-per-file=0.02']
+    with pytest.raises(SystemExit) as e:
+        astyle_py_main(args + [str(slow), str(fast)])
+    assert e.value.code == 1
+    err = capfd.readouterr().err
+    assert f'Timeout formatting {slow}: took longer than 0.02s' in err
+    # The small file is still processed. It normally takes well under the limit, but
+    # may not on a loaded machine, so only check that it was formatted if it didn't
+    # time out as well.
+    fast_timed_out = f'Timeout formatting {fast}' in err
+    assert fast_timed_out or f'Formatting {fast}' in err
+    timed_out = 2 if fast_timed_out else 1
+    assert f'{timed_out} files took longer than 0.02s to format' in err
+    if not fast_timed_out:
+        assert fast.read_text() == 'int main()\n{\n    foo();\n}\n'
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_main_stats(
+    capfd: pytest.CaptureFixture[str], tmp_path: pathlib.Path, jobs: int
+):
+    base = str(tmp_path.absolute())
+    (tmp_path / 'file_a.c').write_text('int main() { foo(); }\n' * 200)
+    (tmp_path / 'file_b.c').write_text('int main()\n{\n    foo();\n}\n')
+    args = ['--style=otbs', '--cache-dir=cache', f'--jobs={jobs}', '--stats']
+    with chdir_ctx(base):
+        with pytest.raises(SystemExit) as e:
+            astyle_py_main(args + ['--stats-json=stats.json', 'file_a.c', 'file_b.c'])
+        assert e.value.code == 0
+    err = capfd.readouterr().err
+    assert 'Stats: 2 files (0 cache hits), 4426 bytes in' in err
+    slowest = err.split('Slowest files:\n', 1)[1]
+    assert slowest.index('file_a.c') < slowest.index('file_b.c')
+    report = json.loads((tmp_path / 'stats.json').read_text())
+    assert report['files'] == 2
+    assert report['bytes'] == 4426
+    assert report['guest_calls'] > 0
+    assert list(report['phases']) == [
+        'files',
+        'read',
+        'cache',
+        'marshal',
+        'guest',
+        'write',
+    ]
+    assert report['phases']['guest'] > 0
+    assert report['phases']['write'] > 0
+    assert [f['filename'] for f in report['slowest_files']] == ['file_a.c', 'file_b.c']
+
+    # the files are in the cache now
+    with chdir_ctx(base):
+        with pytest.raises(SystemExit) as e:
+            astyle_py_main(args + ['file_a.c', 'file_b.c'])
+        assert e.value.code == 0
+    assert 'Stats: 2 files (2 cache hits), 5226 bytes in' in capfd.readouterr().err
+
+
+def test_main_precompile(
+    capfd: pytest.CaptureFixture[str],
+    tmp_path: pathlib.Path,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setenv('ASTYLE_PY_PRECOMPILED_DIR', str(tmp_path))
+    with pytest.raises(SystemExit) as e:
+        astyle_py_main(['--precompile', '--astyle-version=3.4.7'])
+    assert e.value.code == 0
+    files = sorted(p.name for p in (tmp_path / '3.4.7').iterdir())
+    assert len(files) == 2
+    assert all(f.endswith('.cwasm') for f in files)
+    err = capfd.readouterr().err
+    assert err.count('Precompiled Astyle v3.4.7 to {}'.format(tmp_path)) == 2
+
+
+def test_main_files_from_stdin(
+    capfd: pytest.CaptureFixture[str], tmp_path: pathlib.Path, monkeypatch
+):
+    (tmp_path / 'file_a.c').write_text('int main() { foo(); }\n')
+    (tmp_path / 'file_b.c').write_text('int main() { foo(); }\n')
+    monkeypatch.setattr(
+        'sys.stdin', io.TextIOWrapper(io.BytesIO(b'file_a.c\0file_b.c\0'))
+    )
+
+    with chdir_ctx(str(tmp_path)):
+        with pytest.raises(SystemExit) as e:
+            astyle_py_main(['--style=otbs', '--dry-run', '--files-from=-', '-0'])
+        assert e.value.code == 1
+        err = capfd.readouterr().err
+        assert 'Formatting error in file_a.c' in err
+        assert 'Formatting errors found in 2 files' in err
@@ -0,0 +1,76 @@
+# SPDX-FileCopyrightText: 2026 Ivan Grokhotkov <ivan@igrr.me>
+# SPDX-License-Identifier: MIT
+import pathlib
+
+import pytest
+
+from astyle_py import Astyle, runner
+from astyle_py.cache import ResultCache, cache_key
+from astyle_py.files_iter import FileItem
+from astyle_py.runner import AstyleInstances, format_file, format_files
+
+SOURCE = b'int main() { return 0; }\n'
+FORMATTED = b'int main()\n{\n    return 0;\n}\n'
+
+
+class NonIdempotentAstyle:
+    """
+    Changes the source every time it is formatted.
+    """
+
+    def set_options(self, options: str) -> None:
+        pass
+
+    def format_bytes(self, source: bytes) -> bytes:
+        return source + b'\n'
+
+    def check(self, source: bytes) -> int:
+        return 1
+
+
+def test_format_file_cache_keys(tmp_path: pathlib.Path):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    fname = tmp_path / 'a.c'
+    fname.write_bytes(SOURCE)
+    item = FileItem(str(fname), ['--style=otbs'])
+
+    res = format_file(Astyle(), '3.1', item, True, cache)
+    assert res.changed
+    assert res.formatted == FORMATTED
+    # formatting the result again doesn't change it, so it can be recorded
+    assert res.formatted_key == cache_key(FORMATTED, '--style=otbs', '3.1')
+
+    # a formatted source which would still change isn't recorded as formatted
+    res = format_file(NonIdempotentAstyle(), '3.1', item, True, cache)
+    assert res.changed
+    assert res.formatted_key is None
+
+    # in dry runs, only the sources seen unchanged are recorded
+    res = format_file(NonIdempotentAstyle(), '3.1', item, False, cache)
+    assert res.changed
+    assert res.formatted_key is None
+    fname.write_bytes(FORMATTED)
+    res = format_file(Astyle(), '3.1', item, False, cache)
+    assert not res.changed
+    assert res.formatted_key == cache_key(FORMATTED, '--style=otbs', '3.1')
+    cache.close()
+
+
+@pytest.mark.parametrize('backend', ['process', 'thread'])
+def test_format_files_small_workload_serial(
+    tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch, backend: str
+):
+    def no_pool(*args, **kwargs):
+        raise AssertionError('a pool of workers was started')
+
+    monkeypatch.setattr(runner, 'ProcessPoolExecutor', no_pool)
+    monkeypatch.setattr(runner, 'ThreadPoolExecutor', no_pool)
+    items = []
+    for i in range(3):
+        fname = tmp_path / 'f{}.c'.format(i)
+        fname.write_bytes(SOURCE)
+        items.append(FileItem(str(fname), ['--style=otbs']))
+    results = list(
+        format_files(AstyleInstances('3.1'), items, False, jobs=4, backend=backend)
+    )
+    assert [r.changed for r in results] == [True] * 3
@@ -0,0 +1,195 @@
+# SPDX-FileCopyrightText: 2026 Ivan Grokhotkov <ivan@igrr.me>
+# SPDX-License-Identifier: MIT
+import pathlib
+import socket
+import subprocess
+import sys
+import threading
+
+import pytest
+from test_files_iter import chdir_ctx
+
+from astyle_py import AstyleError, astyle_wrapper, runner
+from astyle_py.__main__ import astyle_py_main, connect_to_server
+from astyle_py.server import AstyleServer, RemoteAstyle, connect, unix_sockets_supported
+
+pytestmark = pytest.mark.skipif(
+    not unix_sockets_supported(), reason='Unix domain sockets not supported'
+)
+
+
+@pytest.fixture
+def server(tmp_path: pathlib.Path):
+    server = AstyleServer(str(tmp_path / 'astyle_py.sock'))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield server
+    server.shutdown()
+    thread.join()
+
+
+def remote(server: AstyleServer, version: str = '3.1') -> RemoteAstyle:
+    sock = connect(server.socket_path)
+    assert sock is not None
+    return RemoteAstyle(sock, version)
+
+
+def test_server_requests(server: AstyleServer):
+    client = remote(server, '3.4.7')
+    assert client.version() == '3.4.7'
+
+    client.set_options('--style=otbs')
+    assert client.format('int main() { foo(); }\n') == 'int main()\n{\n    foo();\n}\n'
+    assert client.check('int main() { foo(); }\n') == 1
+    assert client.check('int main()\n{\n    foo();\n}\n') == 0
+    assert client.check(b'int x;\nint f\xe9() { foo(); }\n') == 2
+    # not valid UTF-8
+    assert client.format_bytes(b'int f\xe9() { foo(); }\n') == (
+        b'int f\xe9()\n{\n    foo();\n}\n'
+    )
+
+    client.set_options('--invalid-option')
+    with pytest.raises(AstyleError):
+        client.format('int main() {}')
+
+    with pytest.raises(ValueError) as e:
+        remote(server, '1.2.3')
+    assert 'Unsupported astyle version: 1.2.3' in str(e.value)
+    client.close()
+
+
+def test_server_reuses_instances(server: AstyleServer, monkeypatch: pytest.MonkeyPatch):
+    created = []
+
+    class CountingInstance(astyle_wrapper._AstyleInstance):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            created.append(self)
+
+    monkeypatch.setattr(astyle_wrapper, '_AstyleInstance', CountingInstance)
+    for _ in range(3):
+        client = remote(server)
+        client.set_options('--style=otbs')
+        assert client.format('int main() { foo(); }\n') == (
+            'int main()\n{\n    foo();\n}\n'
+        )
+        client.close()
+    # Each connection is served by its own thread, the requests by the same one
+    assert len(created) == 1
+
+
+def test_remote_connection_lost(server: AstyleServer):
+    client = remote(server)
+    client.set_options('--style=otbs')
+    client.timeout = 10
+    assert client.check('int main() { foo(); }\n') == 1
+    # As if the server was stopped: the next requests are handled locally
+    client._sock.shutdown(socket.SHUT_RDWR)
+    assert client.format('int main() { foo(); }\n') == (
+        'int main()\n{\n    foo();\n}\n'
+    )
+    assert client.check(b'int main() { foo(); }\n') == 1
+    assert client.version() == '3.1'
+    client.set_options('--invalid-option')
+    with pytest.raises(AstyleError):
+        client.format_bytes(b'int main() {}')
+    client.close()
+
+
+def test_connect_to_server_rejected(
+    server: AstyleServer, monkeypatch: pytest.MonkeyPatch
+):
+    def unavailable(version: str):
+        raise ValueError('Unsupported astyle version: {}'.format(version))
+
+    # as if the server didn't bundle this version
+    monkeypatch.setattr(server, '_get_instance', unavailable)
+    assert connect_to_server(server.socket_path, '3.1', True) is None
+
+
+def test_server_already_running(server: AstyleServer):
+    with pytest.raises(ValueError) as e:
+        AstyleServer(server.socket_path)
+    assert 'already running' in str(e.value)
+
+
+def test_main_uses_server(
+    server: AstyleServer, capfd: pytest.CaptureFixture[str], tmp_path: pathlib.Path
+):
+    (tmp_path / 'file_a.c').write_text('int main() { foo(); }\n')
+    (tmp_path / 'file_b.c').write_text('int main()\n{\n    foo();\n}\n')
+    socket_arg = f'--socket={server.socket_path}'
+
+    with chdir_ctx(str(tmp_path)):
+        with pytest.raises(SystemExit) as e:
+            astyle_py_main(
+                [socket_arg, '--no-cache', '--style=otbs', 'file_a.c', 'file_b.c']
+            )
+        assert e.value.code == 0
+    assert 'Formatted 1 files' in capfd.readouterr().err
+    assert (tmp_path / 'file_a.c').read_text() == 'int main()\n{\n    foo();\n}\n'
+    assert server._instances.keys() == {'3.1'}
+
+    # the server is gone, the files are formatted locally
+    server.shutdown()
+    (tmp_path / 'file_a.c').write_text('int main() { foo(); }\n')
+    with chdir_ctx(str(tmp_path)):
+        with pytest.raises(SystemExit) as e:
+            astyle_py_main([socket_arg, '--no-cache', '--style=otbs', 'file_a.c'])
+        assert e.value.code == 0
+    assert (tmp_path / 'file_a.c').read_text() == 'int main()\n{\n    foo();\n}\n'
+
+
+def test_main_server_client_imports(server: AstyleServer, tmp_path: pathlib.Path):
+    (tmp_path / 'file_a.c').write_text('int main() { foo(); }\n')
+    code = (
+        'import sys\n'
+        'from astyle_py.__main__ import astyle_py_main\n'
+        'try:\n'
+        '    astyle_py_main(sys.argv[1:])\n'
+        'except SystemExit:\n'
+        '    pass\n'
+        'print("wasmtime" in sys.modules)\n'
+    )
+    args = [f'--socket={server.socket_path}', '--no-cache', '--style=otbs', '--dry-run']
+    args.append('file_a.c')
+    out = subprocess.check_output(
+        [sys.executable, '-c', code] + args,
+        cwd=str(tmp_path),
+        stderr=subprocess.DEVNULL,
+        text=True,
+    )
+    # the client doesn't load wasmtime, the server formats the files
+    assert out.strip() == 'False'
+    assert server._instances.keys() == {'3.1'}
+
+
+def test_main_server_parallel(
+    server: AstyleServer,
+    monkeypatch: pytest.MonkeyPatch,
+    capfd: pytest.CaptureFixture[str],
+    tmp_path: pathlib.Path,
+):
+    monkeypatch.setattr(runner, 'PARALLEL_MIN_BYTES', {})
+    ops = []
+    handle_request = server._handle_request
+
+    def record_op(request: dict) -> dict:
+        ops.append(request.get('op'))
+        return handle_request(request)
+
+    monkeypatch.setattr(server, '_handle_request', record_op)
+    names = ['file_{}.c'.format(i) for i in range(4)]
+    for name in names:
+        (tmp_path / name).write_text('int main() { foo(); }\n')
+    with chdir_ctx(str(tmp_path)):
+        with pytest.raises(SystemExit) as e:
+            astyle_py_main(
+                [f'--socket={server.socket_path}', '--no-cache', '--style=otbs']
+                + ['--jobs=2', '--jobs-backend=thread']
+                + names
+            )
+        assert e.value.code == 0
+    assert 'Formatted 4 files' in capfd.readouterr().err
+    # large workloads are still formatted in parallel, by local instances
+    assert 'format' not in ops
@@ -0,0 +1,19 @@
+# SPDX-FileCopyrightText: 2026 Ivan Grokhotkov <ivan@igrr.me>
+# SPDX-License-Identifier: MIT
+import pathlib
+
+from astyle_py.utils import iterate_file_list
+
+
+def test_iterate_file_list(tmp_path: pathlib.Path):
+    names = ['a.c', 'dir with spaces/b.c', 'cé.h'] + [f'd{i}.c' for i in range(100)]
+
+    lines_file = tmp_path / 'lines.txt'
+    lines_file.write_bytes('\r\n'.join(names).encode('utf-8') + b'\n\n')  # type: ignore
+    nul_file = tmp_path / 'nul.txt'
+    nul_file.write_bytes('\0'.join(names).encode('utf-8') + b'\0')
+
+    # small chunks, so that names get split between them
+    assert list(iterate_file_list(str(lines_file), chunk_size=7)) == names
+    assert list(iterate_file_list(str(nul_file), True, chunk_size=7)) == names
+    assert list(iterate_file_list(str(nul_file), True)) == names
@@ -0,0 +1,128 @@
+# SPDX-FileCopyrightText: 2026 Ivan Grokhotkov <ivan@igrr.me>
+# SPDX-License-Identifier: MIT
+import pathlib
+import shutil
+import subprocess
+
+import pytest
+from test_files_iter import chdir_ctx
+
+from astyle_py.__main__ import astyle_py_main
+from astyle_py.vcs import formatting_changes_lines, git_changed_files, git_changed_lines
+
+# tmp_path: pathlib.Path
+
+pytestmark = pytest.mark.skipif(shutil.which('git') is None, reason='requires git')
+
+BADLY_FORMATTED = 'int main(){\nreturn 0;\n}\n'
+FORMATTED = 'int main()\n{\n    return 0;\n}\n'
+
+
+def git(*args):
+    subprocess.run(
+        ['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com']
+        + list(args),
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+def make_repo(path: pathlib.Path, files):
+    for name, content in files.items():
+        (path / name).parent.mkdir(parents=True, exist_ok=True)
+        (path / name).write_text(content)
+    with chdir_ctx(path):
+        git('init', '-q')
+        git('add', '.')
+        git('commit', '-q', '-m', 'initial')
+
+
+def test_changed_files(tmp_path: pathlib.Path):
+    make_repo(
+        tmp_path,
+        {'a.c': FORMATTED, 'sub/b.c': FORMATTED, 'c.c': FORMATTED, 'd.c': FORMATTED},
+    )
+    (tmp_path / 'sub' / 'b.c').write_text(BADLY_FORMATTED)
+    (tmp_path / 'd.c').unlink()
+    with chdir_ctx(tmp_path):
+        git('add', '-A')
+        git('commit', '-q', '-m', 'second')
+        (tmp_path / 'c.c').write_text(BADLY_FORMATTED)
+        assert git_changed_files('HEAD') == ['c.c']
+        assert sorted(git_changed_files('HEAD~1')) == ['c.c', 'sub/b.c']
+        with pytest.raises(ValueError):
+            git_changed_files('no-such-revision')
+    with chdir_ctx(tmp_path / 'sub'):
+        assert git_changed_files('HEAD~1') == ['b.c']
+
+
+def test_changed_lines(tmp_path: pathlib.Path):
+    original = ''.join('line {}\n'.format(i) for i in range(1, 11))
+    make_repo(tmp_path, {'a.c': original, 'b.c': original})
+    lines = original.splitlines(True)
+    lines[2] = 'changed 3\n'
+    lines[3] = 'changed 4\n'
+    lines.insert(8, 'added\n')
+    (tmp_path / 'a.c').write_text(''.join(lines))
+    b_lines = original.splitlines(True)
+    del b_lines[0]
+    del b_lines[4]
+    (tmp_path / 'b.c').write_text(''.join(b_lines))
+    with chdir_ctx(tmp_path):
+        assert git_changed_lines('HEAD') == {
+            'a.c': [(3, 5), (9, 10)],
+            'b.c': [(1, 2), (4, 6)],
+        }
+
+
+def test_formatting_changes_lines():
+    original = 'a\nb\nc\nd\n'
+    formatted = 'a\nB\nc\nd\n'
+    assert formatting_changes_lines(original, formatted, [(2, 3)])
+    assert formatting_changes_lines(original, formatted, [(1, 5)])
+    assert not formatting_changes_lines(original, formatted, [(3, 5)])
+    assert not formatting_changes_lines(original, formatted, [])
+    # inserted line
+    assert formatting_changes_lines(original, 'a\nb\nX\nc\nd\n', [(3, 4)])
+    assert not formatting_changes_lines(original, 'a\nb\nX\nc\nd\n', [(1, 3)])
+
+
+def test_main_changed_since(capfd: pytest.CaptureFixture[str], tmp_path: pathlib.Path):
+    make_repo(tmp_path, {'a.c': BADLY_FORMATTED, 'b.c': FORMATTED, 'c.txt': ''})
+    (tmp_path / 'b.c').write_text(BADLY_FORMATTED)
+    (tmp_path / 'c.txt').write_text('text')
+    with chdir_ctx(tmp_path):
+        with pytest.raises(SystemExit) as e:
+            astyle_py_main(['--dry-run', '--no-cache', '--changed-since=HEAD'])
+        assert e.value.code == 1
+        _, err = capfd.readouterr()
+        assert err == 'Formatting error in b.c\nFormatting errors found in 1 files\n'
+
+        # only the changed files among the files specified are checked
+        with pytest.raises(SystemExit) as e:
+            astyle_py_main(['--dry-run', '--no-cache', '--changed-since=HEAD', 'a.c'])
+        assert e.value.code == 0
+        _, err = capfd.readouterr()
+        assert err == 'No files checked, no files changed since HEAD\n'
+
+
+def test_main_lines_changed_only(
+    capfd: pytest.CaptureFixture[str], tmp_path: pathlib.Path
+):
+    legacy = BADLY_FORMATTED + '\n' + FORMATTED.replace('main', 'other')
+    make_repo(tmp_path, {'a.c': legacy})
+    # the change is formatted correctly, the formatting errors are elsewhere
+    (tmp_path / 'a.c').write_text(legacy + '\nint x;\n')
+    args = ['--dry-run', '--no-cache', '--changed-since=HEAD', '--lines-changed-only']
+    with chdir_ctx(tmp_path):
+        with pytest.raises(SystemExit) as e:
+            astyle_py_main(args)
+        assert e.value.code == 0
+        capfd.readouterr()
+
+        (tmp_path / 'a.c').write_text(legacy + '\nint y(){\nreturn 1;\n}\n')
+        with pytest.raises(SystemExit) as e:
+            astyle_py_main(args)
+        assert e.value.code == 1
+        _, err = capfd.readouterr()
+        assert err == 'Formatting error in a.c\nFormatting errors found in 1 files\n'